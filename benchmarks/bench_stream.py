@@ -0,0 +1,116 @@
+"""Benchmark building the final response of a stream: litellm.stream_chunk_builder over the
+list of all chunks (chit's previous approach) vs. chit.streaming.StreamAccumulator.
+
+Usage:
+
+    python benchmarks/bench_stream.py                        # synthetic streams
+    python benchmarks/bench_stream.py --record stream.jsonl  # save a synthetic stream
+    python benchmarks/bench_stream.py --chunks stream.jsonl  # replay a recorded stream
+
+A recorded stream is a jsonl file with one `chunk.model_dump()` per line, e.g. recorded
+from a real provider with:
+
+    with open("stream.jsonl", "w") as f:
+        for chunk in litellm.completion(..., stream=True):
+            f.write(json.dumps(chunk.model_dump()) + "\\n")
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+import litellm
+from litellm.types.utils import ModelResponseStream
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from chit.streaming import StreamAccumulator  # noqa: E402
+
+
+def synthetic_stream(n_chunks: int, chunk_chars: int = 4) -> list[ModelResponseStream]:
+    """A stream of n_chunks content deltas, as litellm yields them."""
+    chunks = []
+    for i in range(n_chunks + 1):
+        last = i == n_chunks
+        chunks.append(
+            ModelResponseStream(
+                id="chatcmpl-bench",
+                created=0,
+                model="gpt-4o",
+                choices=[
+                    {
+                        "index": 0,
+                        "finish_reason": "stop" if last else None,
+                        "delta": {
+                            "role": "assistant" if i == 0 else None,
+                            "content": None if last else ("word " * chunk_chars)[:chunk_chars],
+                        },
+                    }
+                ],
+            )
+        )
+    return chunks
+
+
+def load_stream(path: str) -> list[ModelResponseStream]:
+    with open(path, "r") as f:
+        return [ModelResponseStream(**json.loads(line)) for line in f if line.strip()]
+
+
+def bench(chunks: list, history: list[dict], repeat: int = 3) -> dict[str, float]:
+    """Best-of-repeat seconds to consume the stream and build the final message."""
+    results = {}
+    for name in ["stream_chunk_builder", "StreamAccumulator"]:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if name == "stream_chunk_builder":
+                kept = []
+                for chunk in chunks:
+                    _ = chunk.choices[0].delta.content or ""
+                    kept.append(chunk)
+                litellm.stream_chunk_builder(kept, messages=history).choices[0].message
+            else:
+                acc = StreamAccumulator()
+                for chunk in chunks:
+                    acc.add(chunk)
+                acc.message()
+            best = min(best, time.perf_counter() - start)
+        results[name] = best
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--chunks", help="recorded stream (jsonl) to replay")
+    parser.add_argument("--record", help="save the largest synthetic stream here")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--history", type=int, default=50, help="messages of history")
+    parser.add_argument("--out", help="write results as json to this file")
+    args = parser.parse_args()
+
+    history = [{"role": "user", "content": "lorem ipsum " * 50}] * args.history
+    if args.chunks:
+        streams = {os.path.basename(args.chunks): load_stream(args.chunks)}
+    else:
+        streams = {f"{n} chunks": synthetic_stream(n) for n in args.sizes}
+        if args.record:
+            with open(args.record, "w") as f:
+                for chunk in streams[f"{max(args.sizes)} chunks"]:
+                    f.write(json.dumps(chunk.model_dump()) + "\n")
+
+    results = {}
+    for name, chunks in streams.items():
+        results[name] = bench(chunks, history)
+        timings = ", ".join(f"{k}: {v * 1000:.2f} ms" for k, v in results[name].items())
+        print(f"{name}: {timings}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
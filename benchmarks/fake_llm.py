@@ -0,0 +1,140 @@
+"""A local stand-in for litellm.completion, for benchmarking chit without network calls.
+
+    from fake_llm import FakeCompletion
+    with FakeCompletion(response_chars=2000, chunk_chars=4).patch():
+        chat.commit("hello"); chat.commit()
+
+Responses are built from litellm's own response types, so chit processes them exactly as
+it would a provider's. Optional `latency` (seconds before the response or first chunk) and
+`chunk_interval` (seconds between chunks) simulate a provider's timing.
+"""
+
+import sys
+import time
+import random
+from contextlib import contextmanager
+from typing import Iterator
+
+import litellm
+from litellm.types.utils import ModelResponse, ModelResponseStream, Usage
+
+
+class FakeCompletion:
+    def __init__(
+        self,
+        response_chars: int = 1000,
+        chunk_chars: int = 4,
+        latency: float = 0.0,
+        chunk_interval: float = 0.0,
+        tool_calls: list[dict] | None = None,
+        seed: int = 0,
+    ):
+        """
+        Arguments:
+            response_chars (int): length of each response
+            chunk_chars (int): characters per streamed chunk
+            latency (float): seconds to wait before responding
+            chunk_interval (float): seconds to wait between streamed chunks
+            tool_calls (list[dict] | None): tool calls to include in every response that
+                is offered tools, in the OpenAI format
+            seed (int): random seed for the response text
+        """
+        self.response_chars = response_chars
+        self.chunk_chars = chunk_chars
+        self.latency = latency
+        self.chunk_interval = chunk_interval
+        self.tool_calls = tool_calls
+        self.rng = random.Random(seed)
+        self.calls = 0
+
+    def _text(self) -> str:
+        words = []
+        length = 0
+        while length < self.response_chars:
+            word = self.rng.choice(["lorem", "ipsum", "dolor", "sit", "amet", "\n\n"])
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)[: self.response_chars]
+
+    def _usage(self, messages: list) -> Usage:
+        prompt_tokens = sum(len(str(m)) for m in messages) // 4
+        completion_tokens = self.response_chars // 4
+        return Usage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+
+    def __call__(self, model: str, messages: list, stream: bool = False, **kwargs):
+        self.calls += 1
+        tool_calls = self.tool_calls if kwargs.get("tools") else None
+        if self.latency:
+            time.sleep(self.latency)
+        text = self._text()
+        if stream:
+            # like OpenAI, only report the usage of a stream if asked to
+            include_usage = (kwargs.get("stream_options") or {}).get("include_usage")
+            usage = self._usage(messages) if include_usage else None
+            return self._stream(model, text, tool_calls, usage)
+        return ModelResponse(
+            model=model,
+            choices=[
+                {
+                    "index": 0,
+                    "finish_reason": "tool_calls" if tool_calls else "stop",
+                    "message": {
+                        "role": "assistant",
+                        "content": text,
+                        "tool_calls": tool_calls,
+                    },
+                }
+            ],
+            usage=self._usage(messages),
+        )
+
+    def _stream(
+        self, model: str, text: str, tool_calls: list[dict] | None, usage: Usage | None
+    ) -> Iterator[ModelResponseStream]:
+        deltas = [
+            {"content": text[i : i + self.chunk_chars]}
+            for i in range(0, len(text), self.chunk_chars)
+        ] or [{"content": ""}]
+        deltas[0]["role"] = "assistant"
+        for index, tool_call in enumerate(tool_calls or []):
+            deltas.append(
+                {"tool_calls": [tool_call | {"index": index}]},
+            )
+        for i, delta in enumerate(deltas):
+            if i and self.chunk_interval:
+                time.sleep(self.chunk_interval)
+            yield ModelResponseStream(
+                model=model, choices=[{"index": 0, "delta": delta}]
+            )
+        chunk = ModelResponseStream(
+            model=model,
+            choices=[
+                {
+                    "index": 0,
+                    "finish_reason": "tool_calls" if tool_calls else "stop",
+                    "delta": {},
+                }
+            ],
+        )
+        if usage is not None:
+            chunk.usage = usage
+        yield chunk
+
+    @contextmanager
+    def patch(self):
+        """Replace litellm.completion (as imported by chit) with this fake."""
+        import chit.chit  # noqa: F401
+
+        # the chit package re-exports everything from chit.chit, including its `import
+        # chit`, so the attribute chit.chit is the package itself rather than the module
+        module = sys.modules["chit.chit"]
+        original = module.completion, litellm.completion
+        module.completion = litellm.completion = self
+        try:
+            yield self
+        finally:
+            module.completion, litellm.completion = original
@@ -0,0 +1,149 @@
+"""Load-test chit against the mock OpenAI-compatible server: N chats, each in its own
+thread, making M AI commits each, through litellm and real HTTP.
+
+Usage:
+
+    python benchmarks/load.py --chats 16 --commits 10 --latency 0.2 --tokens-per-second 200
+    python benchmarks/load.py --url http://127.0.0.1:8765/v1   # use an already running server
+
+Reports percentiles of commit latency and time to first token, throughput and errors, and
+with --out writes them (and every commit's timings) as json.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+os.environ.setdefault("OPENAI_API_KEY", "mock")  # litellm requires one; the mock ignores it
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import litellm  # noqa: E402
+import chit  # noqa: E402
+import chit.config  # noqa: E402
+from mock_server import MockConfig, serve_in_thread  # noqa: E402
+
+
+def percentiles(values: list[float], ps=(50, 90, 99)) -> dict[str, float]:
+    if not values:
+        return {}
+    values = sorted(values)
+    result = {
+        f"p{p}": values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))] for p in ps
+    }
+    return result | {"max": values[-1], "mean": sum(values) / len(values)}
+
+
+def lookup(a, b):
+    """A tool for the mock server to call.
+
+    Parameters
+    ----------
+    a : str
+        what to look up
+    b : int
+        how many results
+    """
+    return f"{b} results for {a}"
+
+
+def run_chat(i: int, args, records: list, lock: threading.Lock) -> None:
+    chat = chit.Chat(model=args.model, tools=[lookup] if args.tools else None)
+    for j in range(args.commits):
+        chat.commit(f"question {j} from chat {i}", role="user", mode="print")
+        start = time.perf_counter()
+        record = {"chat": i, "commit": j, "start": start}
+        try:
+            chat.commit(mode="return", enable_streaming=not args.no_stream)
+            while chat.current_message.tool_calls:
+                chat.commit(mode="print")  # tool result
+                chat.commit(mode="return", enable_streaming=not args.no_stream)
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"[:200]
+        else:
+            telemetry = chat.current_message.telemetry or {}
+            record["ttft"] = telemetry.get("ttft")
+        record["latency"] = time.perf_counter() - start
+        with lock:
+            records.append(record)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--chats", type=int, default=8, help="concurrent chats")
+    parser.add_argument("--commits", type=int, default=10, help="AI commits per chat")
+    parser.add_argument("--model", default="openai/mock")
+    parser.add_argument("--url", help="api_base of a running mock server (else start one)")
+    parser.add_argument("--no-stream", action="store_true")
+    parser.add_argument("--tools", action="store_true", help="give the chats a tool")
+    # passed to the mock server, if we start one
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--tokens-per-second", type=float, default=None)
+    parser.add_argument("--response-tokens", type=int, default=200)
+    parser.add_argument("--tool-call-rate", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write results as json to this file")
+    args = parser.parse_args()
+
+    chit.config.VERBOSE = False
+    chit.config.AUTOSAVE = False
+    chit.config.RESPONSE_CACHE = None
+    server = None
+    url = args.url
+    if url is None:
+        server, url = serve_in_thread(
+            MockConfig(
+                latency=args.latency,
+                jitter=args.jitter,
+                tokens_per_second=args.tokens_per_second,
+                response_tokens=args.response_tokens,
+                tool_call_rate=args.tool_call_rate,
+                error_rate=args.error_rate,
+                seed=args.seed,
+            )
+        )
+    litellm.api_base = url
+
+    records: list[dict] = []
+    lock = threading.Lock()
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.chats) as pool:
+            for future in [
+                pool.submit(run_chat, i, args, records, lock) for i in range(args.chats)
+            ]:
+                future.result()
+    finally:
+        if server is not None:
+            server.shutdown()
+    elapsed = time.perf_counter() - start
+
+    ok = [r for r in records if "error" not in r]
+    summary = {
+        "chats": args.chats,
+        "commits": len(records),
+        "errors": len(records) - len(ok),
+        "seconds": elapsed,
+        "commits_per_second": len(records) / elapsed,
+        "latency": percentiles([r["latency"] for r in ok]),
+        "ttft": percentiles([r["ttft"] for r in ok if r.get("ttft") is not None]),
+    }
+    print(f"{summary['commits']} commits in {elapsed:.2f}s "
+          f"({summary['commits_per_second']:.1f}/s), {summary['errors']} errors")
+    for name in ["latency", "ttft"]:
+        shown = ", ".join(f"{k} {v * 1000:.1f} ms" for k, v in summary[name].items())
+        print(f"{name}: {shown}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"params": vars(args), "summary": summary, "records": records}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
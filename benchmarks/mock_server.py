@@ -0,0 +1,268 @@
+"""A local OpenAI-compatible chat completions server, for load-testing chit end to end
+(through litellm and real HTTP) without calling a provider.
+
+Usage:
+
+    python benchmarks/mock_server.py --port 8765 --latency 0.2 --tokens-per-second 100
+
+then, in chit:
+
+    import litellm
+    litellm.api_base = "http://127.0.0.1:8765/v1"
+    chat = chit.Chat(model="openai/mock")  # needs OPENAI_API_KEY set, to anything
+
+Supports streaming (server-sent events, with usage in the last chunk), and tool calls: when
+offered tools, the response calls one of them with probability --tool-call-rate, with
+placeholder arguments built from its json schema. --latency and --jitter delay the response
+(or its first chunk), --tokens-per-second paces the stream, and --error-rate makes that
+fraction of requests fail with one of --error-codes.
+"""
+
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod".split()
+
+PLACEHOLDERS = {
+    "string": "lorem",
+    "integer": 1,
+    "number": 1.0,
+    "boolean": True,
+    "array": [],
+    "object": {},
+}
+
+
+class MockConfig:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        tokens_per_second: float | None = None,
+        response_tokens: int = 200,
+        tool_call_rate: float = 0.0,
+        error_rate: float = 0.0,
+        error_codes: tuple[int, ...] = (429, 500),
+        seed: int | None = None,
+    ):
+        """
+        Arguments:
+            latency (float): seconds before the response (or its first chunk)
+            jitter (float): up to this many extra seconds of latency, uniformly at random
+            tokens_per_second (float | None): streaming rate; None to stream as fast as possible
+            response_tokens (int): words per response (one word per streamed chunk)
+            tool_call_rate (float): probability of calling a tool, when offered tools
+            error_rate (float): probability of failing a request
+            error_codes (tuple[int]): http status codes to fail requests with
+            seed (int | None): random seed
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.tool_call_rate = tool_call_rate
+        self.error_rate = error_rate
+        self.error_codes = error_codes
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()  # random.Random isn't safe to share between threads
+        self.requests = 0
+
+    def random(self) -> float:
+        with self.lock:
+            return self.rng.random()
+
+    def choice(self, seq):
+        with self.lock:
+            return self.rng.choice(seq)
+
+
+def placeholder_arguments(tool: dict) -> str:
+    """Arguments for a tool call: a placeholder value for each required parameter."""
+    parameters = tool.get("function", {}).get("parameters") or {}
+    properties = parameters.get("properties", {})
+    required = parameters.get("required", list(properties))
+    return json.dumps(
+        {
+            name: PLACEHOLDERS.get(properties.get(name, {}).get("type"), "lorem")
+            for name in required
+        }
+    )
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    config: MockConfig  # set on the subclass created by make_server
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # send each streamed chunk immediately, rather than batching small writes
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass  # don't log every request to stderr
+
+    def _send_json(self, status: int, data: dict) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        config = self.config
+        with config.lock:
+            config.requests += 1
+            n = config.requests
+        time.sleep(config.latency + config.jitter * config.random())
+        if config.error_rate and config.random() < config.error_rate:
+            code = config.choice(config.error_codes)
+            self._send_json(
+                code, {"error": {"message": f"injected error {code}", "type": "mock_error"}}
+            )
+            return
+
+        words = [config.choice(WORDS) for _ in range(config.response_tokens)]
+        tool_calls = None
+        tools = request.get("tools")
+        if tools and config.random() < config.tool_call_rate:
+            tool = config.choice(tools)
+            tool_calls = [
+                {
+                    "id": f"call_{n}",
+                    "type": "function",
+                    "function": {
+                        "name": tool["function"]["name"],
+                        "arguments": placeholder_arguments(tool),
+                    },
+                }
+            ]
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in request["messages"])
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(words),
+            "total_tokens": prompt_tokens + len(words),
+        }
+        base = {
+            "id": f"chatcmpl-mock{n}",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+        }
+        finish_reason = "tool_calls" if tool_calls else "stop"
+        if request.get("stream"):
+            self._stream(base, words, tool_calls, usage, finish_reason)
+        else:
+            message = {"role": "assistant", "content": " ".join(words)}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            self._send_json(
+                200,
+                base
+                | {
+                    "object": "chat.completion",
+                    "choices": [
+                        {"index": 0, "message": message, "finish_reason": finish_reason}
+                    ],
+                    "usage": usage,
+                },
+            )
+
+    def _stream(self, base, words, tool_calls, usage, finish_reason) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        interval = 1 / self.config.tokens_per_second if self.config.tokens_per_second else 0
+
+        def send(delta: dict, finish: str | None = None, **extra) -> None:
+            chunk = base | {
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            } | extra
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+
+        try:
+            for i, word in enumerate(words):
+                if i and interval:
+                    time.sleep(interval)
+                send({"role": "assistant", "content": word} if i == 0 else {"content": " " + word})
+            for index, tool_call in enumerate(tool_calls or []):
+                send({"tool_calls": [tool_call | {"index": index}]})
+            send({}, finish_reason)
+            send({}, None, choices=[], usage=usage)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client went away
+
+
+def make_server(
+    config: MockConfig | None = None, host: str = "127.0.0.1", port: int = 0
+) -> ThreadingHTTPServer:
+    """A mock server (not yet serving); port 0 picks a free port, see server.server_address."""
+    handler = type("Handler", (MockHandler,), {"config": config or MockConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve_in_thread(config: MockConfig | None = None, port: int = 0) -> tuple[ThreadingHTTPServer, str]:
+    """Start a mock server in a background thread; returns it and its api_base url.
+    Stop it with server.shutdown()."""
+    server = make_server(config, port=port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--tokens-per-second", type=float, default=None)
+    parser.add_argument("--response-tokens", type=int, default=200)
+    parser.add_argument("--tool-call-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-codes", type=int, nargs="+", default=[429, 500])
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    config = MockConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        tool_call_rate=args.tool_call_rate,
+        error_rate=args.error_rate,
+        error_codes=tuple(args.error_codes),
+        seed=args.seed,
+    )
+    server = make_server(config, args.host, args.port)
+    print(f"mock server listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
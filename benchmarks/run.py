@@ -0,0 +1,268 @@
+"""Benchmark chit's core operations on synthetic chat trees of increasing size.
+
+Usage:
+
+    python benchmarks/run.py                                 # 1k, 10k and 100k messages
+    python benchmarks/run.py --sizes 1000 10000 --out results.json
+    python benchmarks/run.py --out new.json --compare results.json   # catch regressions
+
+For each size, a tree is generated (see synthetic.py) and the following are timed: commit
+(user messages, and AI responses from a fake streaming/non-streaming backend, see
+fake_llm.py), push and clone (json, lazy json and jsonl remotes), find, log (tree and
+forum), _generate_viz_html, indexing (by id, and by positive and negative integers), mv and
+rm. An operation that fails (e.g. hits the recursion limit on a deep tree) is recorded
+with its error rather than aborting the run.
+
+Results are written as json: {"meta": ..., "params": ..., "results": {size: {name: {"best",
+"mean", "repeat"} or {"error"}}}}, with times in seconds per operation. With --compare,
+operations whose best time is worse than the baseline's by more than --tolerance are
+reported, and the exit status is 1 if there are any.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from typing import Callable
+
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import chit  # noqa: E402
+import chit.config  # noqa: E402
+from synthetic import generate_chat  # noqa: E402
+from fake_llm import FakeCompletion  # noqa: E402
+
+
+def timed(
+    fn: Callable[..., object], repeat: int, setup: Callable[[], object] | None = None
+) -> dict:
+    """Best and mean seconds of fn() over repeat runs. If given, setup() is called (untimed)
+    before each run and its result passed to fn."""
+    times = []
+    try:
+        for _ in range(repeat):
+            arg = setup() if setup is not None else None
+            start = time.perf_counter()
+            fn(arg) if setup is not None else fn()
+            times.append(time.perf_counter() - start)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"[:200]}
+    return {"best": min(times), "mean": sum(times) / len(times), "repeat": repeat}
+
+
+def per_op(result: dict, n: int) -> dict:
+    """Convert a result for a batch of n operations to per-operation times."""
+    if "error" in result:
+        return result
+    return result | {"best": result["best"] / n, "mean": result["mean"] / n}
+
+
+def master_length(chat: "chit.Chat") -> int:
+    n, current = 0, chat.messages[chat.root_id].children.get("master")
+    while current is not None:
+        n += 1
+        current = chat.messages[current].children.get("master")
+    return n
+
+
+def bench_size(n: int, args, workdir: str) -> dict:
+    results = {}
+
+    def record(name: str, result: dict):
+        results[name] = result
+        shown = f"{result['best'] * 1000:.3f} ms" if "best" in result else result["error"]
+        print(f"  {name:<20} {shown}", flush=True)
+
+    print(f"{n} messages", flush=True)
+    start = time.perf_counter()
+    chat = generate_chat(
+        n,
+        depth=args.depth,
+        branching=args.branching,
+        message_chars=args.message_chars,
+        image_fraction=args.image_fraction,
+        seed=args.seed,
+    )
+    elapsed = time.perf_counter() - start
+    record("generate", per_op({"best": elapsed, "mean": elapsed, "repeat": 1}, n))
+    rng = random.Random(args.seed)
+    repeat = args.repeat
+
+    # remotes
+    json_remote = os.path.join(workdir, f"chat_{n}.json")
+    jsonl_remote = os.path.join(workdir, f"chat_{n}.jsonl")
+
+    def push(path):
+        chat.remote = path
+        chat._jsonl_log = None  # write jsonl remotes in full, not as an append
+        chat.push()
+
+    record("push.json", timed(lambda: push(json_remote), repeat))
+    record("push.jsonl", timed(lambda: push(jsonl_remote), repeat))
+    chat.remote = None
+    record("clone.json", timed(lambda: chit.Chat.clone(json_remote, lazy=False), repeat))
+    record("clone.json_lazy", timed(lambda: chit.Chat.clone(json_remote, lazy=True), repeat))
+    record("clone.jsonl", timed(lambda: chit.Chat.clone(jsonl_remote), repeat))
+
+    # read-only operations
+    record("find.absent", timed(lambda: chat.find("zzzabsentzzz"), repeat))
+    record("find.common", timed(lambda: chat.find("lorem"), repeat))
+    record("log.tree", timed(lambda: chat.log(style="tree", mode="return"), repeat))
+    record("log.forum", timed(lambda: chat.log(style="forum", mode="return"), repeat))
+    record("viz_html", timed(chat._generate_viz_html, repeat))
+
+    n_lookups = 100
+    length = master_length(chat)
+    positions = [rng.randint(0, length) for _ in range(n_lookups)]
+    ids = rng.choices(list(chat.messages), k=n_lookups)
+    chat.checkout(branch_name="master")
+    lookups = {
+        "index.id": lambda: [chat[i] for i in ids],
+        "index.positive": lambda: [chat[k] for k in positions],
+        "index.negative": lambda: [chat[-k - 1] for k in positions],
+        "checkout.positive": lambda: [chat.checkout(k) for k in positions],
+    }
+    for name, fn in lookups.items():
+        record(name, per_op(timed(fn, repeat), n_lookups))
+    chat.checkout(branch_name="master")
+
+    # writes
+    n_commits = args.commits
+    record(
+        "commit.user",
+        timed(
+            lambda _: chat.commit("benchmark message", role="user", mode="print"),
+            n_commits,
+            setup=lambda: chat.commit("benchmark message", role="assistant", mode="print"),
+        ),
+    )
+    fake = FakeCompletion(response_chars=args.response_chars, seed=args.seed)
+    with fake.patch():
+        for name, streaming in [("commit.ai_stream", True), ("commit.ai", False)]:
+            record(
+                name,
+                timed(
+                    lambda _: chat.commit(mode="return", enable_streaming=streaming),
+                    n_commits,
+                    setup=lambda: chat.commit("question", role="user", mode="print"),
+                ),
+            )
+
+    branches = [b for b in chat.branch_tips if b != "master"][:10]
+
+    def mv_round_trip():
+        for b in branches:
+            chat.mv(b, b + "_mv")
+            chat.mv(b + "_mv", b)
+
+    record("mv", per_op(timed(mv_round_trip, repeat), 2 * len(branches) or 1))
+
+    # rm is destructive, so each run gets a fresh copy of the tree (not timed)
+    def fresh():
+        return chit.Chat.clone(json_remote, lazy=False)
+
+    def rm_branch(c):
+        c.rm(branch_name=rng.choice([b for b in c.branch_tips if b != "master"]))
+
+    def rm_commit(c):
+        c.rm(commit_id=c._resolve_nonnegative_index(max(master_length(c) // 2, 1)))
+
+    if branches:
+        record("rm.branch", timed(rm_branch, repeat, setup=fresh))
+    record("rm.commit", timed(rm_commit, repeat, setup=fresh))
+    return results
+
+
+def meta() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(__file__) or ".",
+        ).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Operations that got slower than the baseline by more than the tolerance factor."""
+    regressions = []
+    for size, benches in results["results"].items():
+        for name, result in benches.items():
+            base = baseline.get("results", {}).get(size, {}).get(name)
+            if base is None or "best" not in base:
+                continue
+            if "error" in result:
+                regressions.append(f"{size} {name}: now fails ({result['error']})")
+            elif result["best"] > base["best"] * tolerance:
+                regressions.append(
+                    f"{size} {name}: {base['best'] * 1000:.3f} ms -> "
+                    f"{result['best'] * 1000:.3f} ms ({result['best'] / base['best']:.2f}x)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--depth", type=int, default=500, help="max messages on a line")
+    parser.add_argument("--branching", type=float, default=0.05, help="fork probability")
+    parser.add_argument("--message-chars", type=int, default=500)
+    parser.add_argument("--image-fraction", type=float, default=0.0,
+                        help="fraction of user messages with an image")
+    parser.add_argument("--response-chars", type=int, default=1000,
+                        help="length of fake AI responses")
+    parser.add_argument("--commits", type=int, default=20, help="commits to time per size")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write results as json to this file")
+    parser.add_argument("--compare", help="baseline results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="slowdown factor over the baseline counted as a regression")
+    args = parser.parse_args()
+
+    chit.config.VERBOSE = False
+    chit.config.FORCE = True  # rm without confirmation
+    chit.config.AUTOSAVE = False
+    chit.config.PROFILE = False
+    chit.config.RESPONSE_CACHE = None
+
+    workdir = tempfile.mkdtemp(prefix="chit_bench_")
+    results = {"meta": meta(), "params": vars(args), "results": {}}
+    try:
+        for n in args.sizes:
+            results["results"][str(n)] = bench_size(n, args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
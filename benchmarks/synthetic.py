@@ -0,0 +1,108 @@
+"""Generate synthetic chat trees for benchmarking.
+
+    from synthetic import generate_chat
+    chat = generate_chat(10_000, depth=500, branching=0.05, message_chars=500)
+
+Messages are committed through the normal `Chat.commit` API (with explicit roles, so no AI
+calls are made), alternating user and assistant turns. After each commit, with probability
+`branching` -- or whenever the current line reaches `depth` messages -- the next commit
+forks off a random earlier message, creating a new branch.
+"""
+
+import os
+import sys
+import random
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import chit  # noqa: E402
+import chit.config  # noqa: E402
+
+WORDS = (
+    "the of and to in is that for it as with was on be by this are or from at which "
+    "model chat branch commit message history token stream tool remote tree search "
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor"
+).split()
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def random_text(rng: random.Random, chars: int) -> str:
+    """Roughly `chars` characters of random words, in paragraphs."""
+    words = []
+    length = 0
+    while length < chars:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+        if rng.random() < 0.02:
+            words.append("\n\n")
+    return " ".join(words)[:chars]
+
+
+def make_image(directory: str, size: int, seed: int = 0) -> str:
+    """A file of `size` bytes that chit will embed as a png. It isn't a valid image: chit
+    never decodes images, it only base64-encodes them into the message."""
+    path = os.path.join(directory, f"image_{size}_{seed}.png")
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.write(PNG_SIGNATURE + random.Random(seed).randbytes(max(size - 8, 0)))
+    return path
+
+
+def generate_chat(
+    n_messages: int,
+    depth: int = 500,
+    branching: float = 0.05,
+    message_chars: int = 500,
+    image_fraction: float = 0.0,
+    image_bytes: int = 50_000,
+    seed: int = 0,
+    model: str = "gpt-4o",
+) -> "chit.Chat":
+    """
+    Build a chat tree of n_messages messages (plus the system message).
+
+    Arguments:
+        n_messages (int): number of messages to commit
+        depth (int): maximum number of messages on any line from the root
+        branching (float): probability of forking off a random earlier message after
+            each commit
+        message_chars (int): mean length of message contents; actual lengths are
+            uniform between half and 1.5 times this
+        image_fraction (float): fraction of user messages that include an image
+        image_bytes (int): size of each image
+        seed (int): random seed, for reproducible trees
+        model (str): model of the chat
+    """
+    rng = random.Random(seed)
+    verbose, autosave = chit.config.VERBOSE, chit.config.AUTOSAVE
+    chit.config.VERBOSE = False
+    chit.config.AUTOSAVE = False
+    image_dir = tempfile.mkdtemp(prefix="chit_bench_images_") if image_fraction else None
+    try:
+        chat = chit.Chat(model=model)
+        ids = [chat.root_id]
+        line_depth = {chat.root_id: 0}
+        for _ in range(n_messages):
+            role = "user" if chat.current_message.message["role"] != "user" else "assistant"
+            chars = rng.randint(message_chars // 2, message_chars * 3 // 2)
+            image_path = None
+            if role == "user" and image_fraction and rng.random() < image_fraction:
+                image_path = make_image(image_dir, image_bytes, seed=rng.randrange(8))
+            parent_id = chat.current_id
+            chat.commit(
+                random_text(rng, chars), image_path=image_path, role=role, mode="print"
+            )
+            ids.append(chat.current_id)
+            line_depth[chat.current_id] = line_depth[parent_id] + 1
+            if line_depth[chat.current_id] >= depth or rng.random() < branching:
+                # fork: the next commit goes on a new branch off a random message
+                fork_id = rng.choice(ids)
+                while line_depth[fork_id] >= depth:
+                    fork_id = rng.choice(ids)
+                chat.checkout(fork_id)
+        chat.checkout(branch_name="master")
+    finally:
+        chit.config.VERBOSE, chit.config.AUTOSAVE = verbose, autosave
+    return chat
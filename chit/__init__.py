@@ -1,5 +1,7 @@
 from .chit import *
 from .utils import *
+from .workspace import Workspace
+from .worktree import Worktree
 
 # import os
 # import logging
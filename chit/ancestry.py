@@ -0,0 +1,113 @@
+"""Ancestor index of a chat tree: the depth of each message and one jump pointer.
+
+Finding where two branches fork, or whether one message is an ancestor of another, by
+walking up the parents takes time proportional to the depth of the messages, however close
+together they are. Instead, `AncestorIndex` gives each message its depth and a pointer to
+one further ancestor, as in Myers' skew-binary random access lists: the jump of a message
+is its parent's jump's jump if the parent's jump and that one span equally many messages,
+else its parent. The jump depths only depend on the depth, and any ancestor (and so the
+fork point of two messages) is reached in O(log depth) steps, with O(1) space per message.
+
+Entries are made on demand, walking up only to the nearest ancestor that already has one,
+and kept: the ancestors of a message never change. Chat.rm() forgets removed messages.
+"""
+
+from typing import TYPE_CHECKING, Iterable
+
+if TYPE_CHECKING:
+    from chit.chit import ChitMessage
+
+
+class AncestorIndex:
+    """Depths and jump pointers of the messages of a chat, see the module docstring."""
+
+    __slots__ = ("messages", "_entries")
+
+    def __init__(self, messages: dict[str, "ChitMessage"]):
+        self.messages = messages
+        self._entries: dict[str, tuple[int, str]] = {}  # id -> (depth, jump)
+
+    def _entry(self, msg_id: str) -> tuple[int, str]:
+        entry = self._entries.get(msg_id)
+        if entry is not None:
+            return entry
+        # walk up to the nearest indexed ancestor, then index back down
+        chain = []
+        current = msg_id
+        while current is not None and current not in self._entries:
+            chain.append(current)
+            current = self.messages[current].parent_id
+        entries = self._entries
+        for current in reversed(chain):
+            parent = self.messages[current].parent_id
+            if parent is None:
+                entries[current] = (0, current)
+                continue
+            depth, jump = entries[parent]
+            jump_depth, jump2 = entries[jump]
+            if depth - jump_depth == jump_depth - entries[jump2][0]:
+                entries[current] = (depth + 1, jump2)
+            else:
+                entries[current] = (depth + 1, parent)
+        return entries[msg_id]
+
+    def depth(self, msg_id: str) -> int:
+        """Number of messages above a message (0 for the root)."""
+        return self._entry(msg_id)[0]
+
+    def ancestor_at(self, msg_id: str, depth: int) -> str:
+        """The ancestor of a message (or itself) at a given depth."""
+        d, jump = self._entry(msg_id)
+        if not 0 <= depth <= d:
+            raise ValueError(f"Message {msg_id} at depth {d} has no ancestor at depth {depth}")
+        entries = self._entries
+        while d > depth:
+            jump_depth = entries[jump][0]
+            if jump_depth >= depth:
+                msg_id = jump
+            else:
+                msg_id = self.messages[msg_id].parent_id
+            d, jump = entries[msg_id]
+        return msg_id
+
+    def is_ancestor(self, ancestor_id: str, msg_id: str) -> bool:
+        """Whether ancestor_id is msg_id or one of its ancestors."""
+        depth = self.depth(ancestor_id)
+        return depth <= self.depth(msg_id) and self.ancestor_at(msg_id, depth) == ancestor_id
+
+    def merge_base(self, a: str, b: str) -> str:
+        """The deepest message that is (or is an ancestor of) both a and b."""
+        depth = min(self.depth(a), self.depth(b))
+        a, b = self.ancestor_at(a, depth), self.ancestor_at(b, depth)
+        entries = self._entries
+        while a != b:
+            # messages at the same depth have jumps to the same depth
+            jump_a, jump_b = entries[a][1], entries[b][1]
+            if jump_a != jump_b:
+                a, b = jump_a, jump_b
+            else:
+                a, b = self.messages[a].parent_id, self.messages[b].parent_id
+        return a
+
+    def path(self, ancestor_id: str, msg_id: str) -> list[str]:
+        """Ids of the messages below ancestor_id down to msg_id, in order from the root."""
+        n = self.depth(msg_id) - self.depth(ancestor_id)
+        ids = []
+        current = msg_id
+        for _ in range(n):
+            ids.append(current)
+            current = self.messages[current].parent_id
+        if current != ancestor_id:
+            raise ValueError(f"Message {ancestor_id} is not an ancestor of {msg_id}")
+        ids.reverse()
+        return ids
+
+    def forget(self, message_ids: Iterable[str]) -> None:
+        for msg_id in message_ids:
+            self._entries.pop(msg_id, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"AncestorIndex({len(self._entries)} messages)"
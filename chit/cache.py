@@ -0,0 +1,131 @@
+"""On-disk cache of AI responses, keyed by a hash of the model, message history and tools.
+
+Enabled by setting `chit.config.RESPONSE_CACHE` to a directory. Re-running a notebook (or
+cloning a chat and regenerating a response) then returns cached responses instantly
+instead of calling the provider again. Only identical requests hit the cache, so this is
+mainly useful for deterministic re-runs; it is not a semantic cache.
+"""
+
+import os
+import re
+import json
+import hashlib
+import threading
+from typing import Any, Iterator
+import chit.config
+
+# total size of the entries in each cache directory, as last listed and then kept up to
+# date by put(), so that the directory is only listed again once it may be over size
+_sizes: dict[str, int] = {}
+_sizes_lock = threading.Lock()
+
+
+def _canonical(obj: Any) -> Any:
+    """Convert messages (which may be litellm Message objects) to plain json-able data."""
+    if isinstance(obj, dict):
+        return {k: _canonical(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(v) for v in obj]
+    if hasattr(obj, "json") and callable(obj.json):
+        return _canonical(obj.json())
+    return obj
+
+
+def replay_deltas(content: str) -> Iterator[str]:
+    """Split a cached response into word-sized deltas, to simulate streaming output."""
+    yield from re.findall(r"\s*\S+\s*", content) or [content]
+
+
+class ResponseCache:
+    def __init__(self, directory: str, max_bytes: int | None = None):
+        """
+        Initialize a response cache. Entries are evicted least-recently-used first once
+        the cache exceeds max_bytes.
+
+        Arguments:
+            directory (str): directory to store cached responses in
+            max_bytes (int | None): size bound of the cache. Defaults to
+                chit.config.RESPONSE_CACHE_MAX_BYTES
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes or chit.config.RESPONSE_CACHE_MAX_BYTES
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_config(cls) -> "ResponseCache | None":
+        """The cache configured in chit.config.RESPONSE_CACHE, if any."""
+        if chit.config.RESPONSE_CACHE is None:
+            return None
+        return cls(chit.config.RESPONSE_CACHE)
+
+    @staticmethod
+    def key(model: str, history: list, tools: list[dict] | None = None) -> str:
+        """Stable hash of a completion request."""
+        data = {"model": model, "messages": _canonical(history), "tools": tools or None}
+        return hashlib.sha256(
+            json.dumps(data, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key: str) -> dict | None:
+        """Cached entry for a key, or None on a miss. A hit counts as a use for LRU purposes."""
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, key: str, entry: dict) -> None:
+        """Store an entry, e.g. {"message": ..., "citations": ...}, then evict if over size."""
+        path = self._path(key)
+        with open(path + ".tmp", "w") as f:
+            json.dump(_canonical(entry), f)
+            size = f.tell()
+        os.replace(path + ".tmp", path)
+        directory = os.path.abspath(self.directory)
+        with _sizes_lock:
+            total = _sizes.get(directory)
+            # (an overwritten entry is counted twice, which only means listing sooner)
+            total = self.evict() if total is None or total + size > self.max_bytes else total + size
+            _sizes[directory] = total
+
+    def evict(self) -> int:
+        """Delete least-recently-used entries until the cache is within max_bytes, and
+        return its size."""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.name.endswith(".json") and e.is_file():
+                    stat = e.stat()
+                    entries.append((stat.st_mtime, stat.st_size, e.path))
+                    total += stat.st_size
+        if total <= self.max_bytes:
+            return total
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+        return total
+
+    def clear(self) -> None:
+        """Delete all cached responses."""
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.name.endswith(".json") and e.is_file():
+                    os.unlink(e.path)
+        with _sizes_lock:
+            _sizes.pop(os.path.abspath(self.directory), None)
+
+    def __repr__(self):
+        return f"ResponseCache({self.directory})"
@@ -2,17 +2,53 @@ import os
 import tempfile
 import webbrowser
 import warnings
-from dataclasses import dataclass
-from typing import Optional, Pattern, Any, Literal
+from dataclasses import dataclass, field
+from typing import Optional, Pattern, Any, Literal, Iterable, Iterator, Callable
 from pathlib import Path
 import json
 import re
 import string
 import random
+import time
+import threading
+import weakref
+from contextlib import nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor
 import litellm
-from litellm import completion, stream_chunk_builder
+from litellm import completion
 from chit.utils import wordcel, annoy
 from chit.images import prepare_image_message
+from chit.cache import ResponseCache, replay_deltas
+from chit.context import count_tokens, token_window, context_budget
+from chit.streaming import MarkdownStream, StreamAccumulator
+from chit.profiling import Profiler
+from chit.policy import RequestPolicy, primed
+from chit.scheduler import Grant, Scheduler
+from chit.compaction import boundaries, summary_request, with_summary
+from chit.semantic import SemanticIndex, vectors_path
+from chit.ancestry import AncestorIndex
+from chit.diff import side_by_side_text, side_by_side_html
+from chit.tools import toolset
+from chit.lines import Line, MessageView
+from chit.traversal import iter_edges, iter_subtree, iter_leaves, iter_paths, walk, ancestors
+from chit.export import write_paths, export_remotes
+from chit.objects import (
+    CONTENT_FIELDS,
+    OBJECT_REF,
+    ObjectStore,
+    content_id,
+    resolve_body,
+)
+from chit.storage import (
+    BodyStore,
+    JsonlLog,
+    RemoteReader,
+    encode_body,
+    file_stat,
+    remote_lock,
+    write_indexed_json,
+    read_index,
+)
 import chit.config
 from litellm.types.utils import (
     # ModelResponse,
@@ -30,6 +66,19 @@ class ChitMessage:
     parent_id: Optional[str]
     home_branch: str
     tool_calls: list[ChatCompletionMessageToolCall] | None = None
+    # token usage reported by the provider for an AI-generated message, incl. prompt caching
+    usage: dict[str, int | None] | None = None
+    # performance of the request that generated an AI message: model, latency, time to first
+    # token, cost, number of history messages sent, and whether it came from the response cache
+    telemetry: dict[str, Any] | None = None
+    # summary of the history from the root up to and including this message, if it ends a
+    # compacted segment (see chit.compaction): text, model and number of messages covered
+    summary: dict[str, Any] | None = None
+    # cache of prompt token counts per model; not saved to the remote
+    n_tokens: dict[str, int] | None = field(default=None, compare=False, repr=False)
+
+    # fields stored with the message content rather than with the tree structure
+    BODY_FIELDS = ("message", "tool_calls", "usage", "telemetry", "summary")
 
     @property
     def heir_id(self):
@@ -52,8 +101,84 @@ class ChitMessage:
             ]
             if self.tool_calls is not None
             else None,
+            "usage": self.usage,
+            "telemetry": self.telemetry,
+            "summary": self.summary,
         }
 
+    @property
+    def loaded(self) -> bool:
+        """Whether the message body is in memory (always, unless a LazyChitMessage)."""
+        return True
+
+    def raw_body(self) -> bytes | None:
+        """Encoded body of the message as it is stored on disk, if it has not been
+        loaded into memory (only ever the case for a LazyChitMessage)."""
+        return None
+
+
+class _LazyBody:
+    """Descriptor for the fields of a LazyChitMessage that stay on disk until first accessed."""
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        if self.name not in obj.__dict__:
+            obj._load_body()
+        return obj.__dict__[self.name]
+
+    def __set__(self, obj, value):
+        if not obj.loaded:
+            obj._load_body()  # so that the body is no longer copied over as is on push
+        obj.__dict__[self.name] = value
+
+
+class LazyChitMessage(ChitMessage):
+    """A ChitMessage whose structure (children, parent_id, home_branch) is in memory, but
+    whose body (message, tool_calls) is only decoded from the remote when first accessed.
+    Created by Chat.clone(..., lazy=True)."""
+
+    message = _LazyBody()
+    tool_calls = _LazyBody()
+    usage = _LazyBody()
+    telemetry = _LazyBody()
+    summary = _LazyBody()
+
+    def __init__(
+        self,
+        id: str,
+        children: dict[str, Optional[str]],
+        parent_id: Optional[str],
+        home_branch: str,
+        store: BodyStore,
+        span: tuple[int, int],
+        object_store: str | None = None,
+    ):
+        self.id = id
+        self.children = children
+        self.parent_id = parent_id
+        self.home_branch = home_branch
+        self._store = store
+        self._span = span
+        self._object_store = object_store  # where the remote keeps message contents
+
+    @property
+    def loaded(self) -> bool:
+        return "message" in self.__dict__
+
+    def _load_body(self):
+        body = resolve_body(self._store.load(*self._span), self._object_store)
+        for field in self.BODY_FIELDS:
+            self.__dict__.setdefault(field, body.get(field))
+
+    def raw_body(self) -> bytes | None:
+        if self.loaded or self._store.closed:
+            return None
+        return self._store.raw(*self._span)
+
 
 class Remote:
     def __init__(self, json_file: str | None = None, html_file: str | None = None):
@@ -63,6 +188,7 @@ class Remote:
         Arguments:
             json_file (str): either:
                 path/to/file.json (str)
+                path/to/file.jsonl (str), for an append-only remote with one message per line
                 path/to/file (str), interpreted as Remote("path/to/file.json", "path/to/file.html")
             html_file (str): path to the html file to save the chat history to. If json_file does not
                 end with .json, this should be left blank to automatically infer it
@@ -70,18 +196,18 @@ class Remote:
         if json_file is None and html_file is None:
             raise ValueError("At least one of json_file or html_file must be specified")
         if html_file:
-            assert json_file.endswith(".json"), (
+            assert json_file.endswith((".json", ".jsonl")), (
                 f"Attempted to initialize invalid remote: Remote({json_file}, {html_file})"
             )
             self.json_file = json_file
             self.html_file = html_file
         else:
-            if not json_file.endswith(".json"):
+            if not json_file.endswith((".json", ".jsonl")):
                 # interpret as creating both json and html
                 _json_file = json_file
                 json_file = json_file + ".json"
                 html_file = _json_file + ".html"
-            print(f"Initializing Remote({json_file}, {html_file})")
+            wordcel(f"Initializing Remote({json_file}, {html_file})")
             self.json_file = json_file
             self.html_file = html_file
 
@@ -107,8 +233,10 @@ class Chat:
             model (str): model name, in the [LiteLLM specification](https://github.com/BerriAI/litellm/blob/main/model_prices_and_context_window.json)
                 Defaults to chit.config.DEFAULT_MODEL
             tools (list[callable]): list of tools available to the assistant. NOTE:
-                - if you use this, streaming will be turned off. You can still pass `enable_tools=False` to `commit()` to disable tools for a single commit.
-                - each tool should be a function which either has a `json` attribute of type dict, or has a numpydoc docstring.
+                - you can pass `enable_tools=False` to `commit()` to disable tools for a single commit.
+                - each tool should be a function (or bound method, functools.partial or callable object) which either
+                  has a `json` attribute of type dict, or has a numpydoc docstring. See chit.tools.
+                - set chit.config.EAGER_TOOLS to start running tools while the response is still streaming.
             remote (str or Remote): path to a json file to save the chat history to, or a chit.Remote object with json_file and html_file attributes.
                 attribute will automatically be calculated from the remote argument passed; see Remote.__init__ for more details.
             display_config (dict): configuration for GUI visualization, e.g.
@@ -129,20 +257,32 @@ class Chat:
         """
         self.model = model or chit.config.DEFAULT_MODEL
         self.remote: Remote | None = remote
-        initial_id = self._generate_short_id()
+        # phase timers and counters, recorded if chit.config.PROFILE is set
+        self.profiler = Profiler()
+        # timeouts, retries, fallbacks and hedging of completion requests; None for the
+        # policy in chit.config (see chit.policy)
+        self.request_policy: RequestPolicy | None = None
+        # requests from chats with higher priority are sent first when queued for a
+        # rate-limited model (see chit.scheduler)
+        self.priority = 0
+        # embeddings of the messages for semantic_search(), built on first use (see
+        # chit.semantic)
+        self.semantic_index: SemanticIndex | None = None
+        # directory that push() stores message contents in, see chit.objects
+        self.object_store: str | None = chit.config.OBJECT_STORE
+        system_message = ChitMessage(
+            id=None,
+            message={"role": "system", "content": "You are a helpful assistant."},
+            children={"master": None},
+            parent_id=None,
+            home_branch="master",
+        )
+        initial_id = system_message.id = self._new_id(system_message)
         self.root_id = initial_id  # Store the root message ID
         self.display_config = chit.config.DISPLAY_CONFIG | (display_config or {})
 
         # Initialize with system message
-        self.messages: dict[str, ChitMessage] = {
-            initial_id: ChitMessage(
-                id=initial_id,
-                message={"role": "system", "content": "You are a helpful assistant."},
-                children={"master": None},
-                parent_id=None,
-                home_branch="master",
-            )
-        }
+        self.messages: dict[str, ChitMessage] = {initial_id: system_message}
 
         self.current_id = initial_id
         self.current_branch = "master"
@@ -153,6 +293,39 @@ class Chat:
 
         self.tools: list[callable] | None = tools
 
+        # positional index of the lines (root to tip) of branches looked up so far
+        self._lines: dict[str, Line] = {}
+        # depths and jump pointers of messages, for merge_base() etc. (see chit.ancestry)
+        self._ancestry: AncestorIndex | None = None
+        # messages whose structure or content changed since the last push, for
+        # appending to jsonl remotes
+        self._dirty: set[str] = set()
+        self._jsonl_log: JsonlLog | None = None
+        # results of tool calls started while their request was still streaming, by the
+        # assistant message calling them and the tool call id; run in one thread pool per
+        # chat, and dropped once committed or when the message is removed or abandoned
+        self._tool_results: dict[str, dict[str, Future]] = {}
+        self._tool_executor: ThreadPoolExecutor | None = None
+        # generation of the remote as last cloned or pushed, and its (size, mtime), to
+        # detect pushes by other writers
+        self._generation = 0
+        self._remote_stat: tuple[int, int] | None = None
+        # with chit.config.MULTI_WRITER, the structure of the messages (children,
+        # home_branch) and the branch tips as last cloned or pushed: the common ancestor
+        # for merging in other writers' pushes (see _merge_remote)
+        self._base: dict[str, tuple[dict, str]] | None = (
+            {} if chit.config.MULTI_WRITER else None
+        )
+        self._base_tips: dict[str, str] = {}
+        # guards changes to the tree (messages, branch_tips, _lines, _dirty) and pushes,
+        # for committing from several threads through worktrees (see chit.worktree)
+        self.lock = threading.RLock()
+        self._worktrees: weakref.WeakSet = weakref.WeakSet()
+        # background summarization of the history, by the message it summarizes up to
+        # (see chit.compaction)
+        self._compactor: ThreadPoolExecutor | None = None
+        self._summary_jobs: dict[str, Future] = {}
+
     @property
     def tools(self) -> list[callable] | None:
         # not to be confused with self.tools_, which is a list of tool jsons
@@ -186,14 +359,10 @@ class Chat:
         for tool in self.tools:
             if not callable(tool):
                 raise ValueError("1) what")
-            if not hasattr(tool, "json") or not isinstance(tool.json, dict):
-                # a tool is a function with an attribute json of type dict.
-                # can automatically calculate the json if it has a numpydoc
-                # docstring
-                json_spec: dict = litellm.utils.function_to_dict(tool)
-                tool.json = {"type": "function", "function": json_spec}
-        self.tools_ = [tool.json for tool in self.tools]
-        self.tool_map = {tool.json["function"]["name"]: tool for tool in self.tools}
+        # a tool is a function with an attribute json of type dict, or a numpydoc
+        # docstring to calculate it from (see chit.tools); chats with the same
+        # tools share the resulting tools_ and tool_map
+        self.tools_, self.tool_map = toolset(self.tools)
 
     def _generate_short_id(self, length: int = 8) -> str:
         """Generate a short, unique ID of specified length"""
@@ -205,6 +374,24 @@ class Chat:
             if not hasattr(self, "messages") or new_id not in self.messages:
                 return new_id
 
+    def _new_id(self, message: ChitMessage) -> str:
+        """Id for a new message: random, or if chit.config.CONTENT_IDS is set, derived
+        from its content and parent id (see chit.objects)."""
+        if not chit.config.CONTENT_IDS:
+            return self._generate_short_id()
+        d = message.asdict()
+        content = {k: d[k] for k in CONTENT_FIELDS}
+        salt = 0
+        while True:
+            new_id = content_id(content, message.parent_id, salt)
+            if not hasattr(self, "messages") or new_id not in self.messages:
+                return new_id
+            salt += 1
+
+    def _touch(self, *message_ids: str) -> None:
+        """Mark messages as modified (or removed) since the last push."""
+        self._dirty.update(message_ids)
+
     def _generate_new_branch_name(self, branch_name: str) -> str:
         """Generate a new branch name based on the current branch name"""
         import re
@@ -276,6 +463,7 @@ class Chat:
         enable_streaming=True,
         mode: Literal["print", "return", "print_md"] = None,
         history_length: int | None = None,
+        history_tokens: int | Literal["auto"] | None = None,
     ) -> str:
         """
         Commit a message to the chat history.
@@ -285,13 +473,18 @@ class Chat:
             image_path (str or Path): path to an image to include in the message
             role (str): role of the message (user, assistant, system, tool)
             enable_tools (bool): turn off to disable tool use in a chat that
-                otherwise has tools (e.g. to enable streaming)
+                otherwise has tools
             enable_streaming (bool): turn off to disable streaming e.g. for properly
                 returning citations with openrouter-provided perplexity models
             mode (str): how to output responses: "print", "return", or "print_md" (markdown)
                 Defaults to chit.config.DEFAULT_MODE
             history_length (int | None): number of messages to send to AI, or None to send all
+            history_tokens (int | "auto" | None): maximum number of tokens of history to send
+                to AI. The most recent messages that fit are sent, along with the system
+                message; tool calls are never separated from their results. "auto" uses the
+                model's context window less chit.config.CONTEXT_RESERVE. None for no limit.
         """
+        commit_start = time.perf_counter()
         mode = mode or chit.config.DEFAULT_MODE
         if message and message.startswith("^N"):
             # Parse editor specification
@@ -323,24 +516,14 @@ class Chat:
         # allow short roles
         ROLE_SHORTS = {"u": "user", "a": "assistant", "s": "system"}
         role = ROLE_SHORTS.get(role.lower(), role)
-        existing_child_id = self.messages[self.current_id].children[self.current_branch]
-
-        # check that checked-out message does not already have a child in the checked-out branch
-        if existing_child_id is not None:
-            new_branch_name = self._generate_new_branch_name(self.current_branch)
-            wordcel(
-                f"WARNING: Current message {self.current_id} already has a child message {existing_child_id} on branch {self.current_branch}. "
-                f"Creating new branch {new_branch_name} to avoid overwriting."
-            )
-            self.branch(new_branch_name, checkout=True)
-
-        new_id = self._generate_short_id()
+        self._branch_off_if_taken()
 
         if image_path is not None:
             assert role == "user", "Only user messages can include images"
             message = prepare_image_message(message, image_path)
 
         response_tool_calls = None  # None by default unless assistant calls for it or we have some from previous tool call
+        usage = telemetry = None  # only for AI-generated messages
 
         if role == "user":
             assert message is not None or image_path is not None, (
@@ -354,60 +537,24 @@ class Chat:
 
         if role == "assistant" and message is None:
             # Generate AI response
-            history = self._get_message_history(history_length)
-            if (hasattr(self, "tools_") and self.tools_ and enable_tools) or not enable_streaming:
-                response = completion(
-                    model=self.model,
-                    messages=history,
-                    tools=self.tools_,
-                    tool_choice="auto",
-                    stream=False,
-                )
-                message_full: ChatCompletionMessage = response.choices[0].message
-                references = getattr(response, "citations", [])
-                message_full: ChatCompletionMessage = (
-                    self._render_message_with_references(message_full, references)
-                )
-                response_tool_calls: list[ChatCompletionMessageToolCall] | None = (
-                    message_full.tool_calls
+            # under the lock, as other worktrees may be adding children to its messages
+            with self.lock, self.profiler.phase("history"):
+                history, plain_history, prompt_tokens = self._get_cached_message_history(
+                    history_length, history_tokens
                 )
-
-                # Output based on mode
-                if mode == "print":
-                    print(message_full.content)
-                elif mode == "print_md":
-                    from IPython.display import display, Markdown
-                    display(Markdown(message_full.content))
-                # For "return" mode, we don't output anything here, just return at the end
-            else:
-                # Handle streaming
-                _response = completion(model=self.model, messages=history, stream=True)
-                chunks = []
-                full_response = "" # for print_md                        
-
-                for chunk in _response:
-                    if mode == "print_md":
-                        from IPython.display import display, Markdown, clear_output
-                        content_delta = chunk.choices[0].delta.content or ""
-                        full_response += content_delta
-                        clear_output(wait=True)
-                        display(Markdown(full_response))
-                    if mode == "print":
-                        print(chunk.choices[0].delta.content or "", end="")
-                    chunks.append(chunk)
-                
-                response = stream_chunk_builder(chunks, messages=history)
-                message_full: ChatCompletionMessage = response.choices[0].message
-                references = getattr(response, "citations", [])
-                message_full: ChatCompletionMessage = (
-                    self._render_message_with_references(message_full, references)
-                )
-                reference_str = self._render_references(references)
-                if mode == "print":
-                    print(reference_str)  # print references separately
-                elif mode == "print_md":
-                    from IPython.display import display, Markdown
-                    display(Markdown(reference_str))
+            eager_results: dict[str, Future] = {}
+            message_full, usage, telemetry = self._generate(
+                history,
+                enable_tools=enable_tools,
+                enable_streaming=enable_streaming,
+                mode=mode,
+                prompt_tokens=prompt_tokens,
+                key_history=plain_history,
+                tool_results=eager_results,
+            )
+            response_tool_calls: list[ChatCompletionMessageToolCall] | None = (
+                message_full.tool_calls
+            )
 
         if role == "tool":
             # when we pop tool calls, it should not modify previous history
@@ -418,45 +565,59 @@ class Chat:
             f: Function = t.function
             f_name: str = f.name
             f_args: str = f.arguments
-            if f_name not in self.tool_map:
-                warnings.warn(f"Tool {f_name} not found in tool_map; skipping")
-                tool_result = f"ERROR: Tool {f_name} not found"
+            # the tool may already have been started while the response was streaming
+            eager_result = self._pop_tool_result(t.id)
+            if eager_result is not None:
+                message = eager_result.result()
             else:
-                tool: callable = self.tool_map[f_name]
-                tool_kwargs: dict = json.loads(f_args)
-                try:
-                    tool_result: Any = tool(**tool_kwargs)
-                except Exception as e:
-                    tool_result: str = f"ERROR: {e}"
-                message = str(tool_result)
-                message_full = {
-                    "role": "tool",
-                    "content": message,
-                    "tool_call_id": t.id,
-                    "name": f_name,
-                }
+                message = self._run_tool(f_name, f_args)
+            message_full = {
+                "role": "tool",
+                "content": message,
+                "tool_call_id": t.id,
+                "name": f_name,
+            }
 
-        # Create new message
-        new_message = ChitMessage(
-            id=new_id,
-            message=message_full,
-            tool_calls=response_tool_calls,
-            children={self.current_branch: None},
-            parent_id=self.current_id,
-            home_branch=self.current_branch,
-        )
+        with self.lock:
+            # another worktree may have committed here while we were generating
+            self._branch_off_if_taken()
+            if role != "tool" and self._tool_results and self.current_message.tool_calls:
+                # tool calls left uncalled on this line: their eager results are abandoned
+                for tool_call in self.current_message.tool_calls:
+                    self._pop_tool_result(tool_call.id, cancel=True)
+
+            # Create new message
+            new_message = ChitMessage(
+                id=None,
+                message=message_full,
+                tool_calls=response_tool_calls,
+                usage=usage,
+                telemetry=telemetry,
+                children={self.current_branch: None},
+                parent_id=self.current_id,
+                home_branch=self.current_branch,
+            )
+            new_id = new_message.id = self._new_id(new_message)
 
-        # Update parent's children
-        self.messages[self.current_id].children[self.current_branch] = new_id
+            # Update parent's children
+            line = self._lines.get(self.current_branch)
+            if line is not None and line.tip == self.current_id:
+                line.append(new_id)
+            self.messages[self.current_id].children[self.current_branch] = new_id
 
-        # Add to messages dict
-        self.messages[new_id] = new_message
+            # Add to messages dict
+            self.messages[new_id] = new_message
+            self._touch(self.current_id, new_id)
+            if self.semantic_index is not None:
+                self.semantic_index.add([new_id])
 
-        # Update branch tip
-        self.branch_tips[self.current_branch] = new_id
+            # Update branch tip
+            self.branch_tips[self.current_branch] = new_id
 
-        # Update checkout
-        self.current_id = new_id
+            # Update checkout
+            self.current_id = new_id
+            if role == "assistant" and message is None and eager_results:
+                self._tool_results[new_id] = eager_results
 
         if response_tool_calls:
             wordcel(
@@ -466,11 +627,313 @@ class Chat:
 
         self.backup()
 
+        if chit.config.PROFILE:
+            self.profiler.add("commit", commit_start, time.perf_counter())
+            self.profiler.count(f"commits.{role}")
+
         if mode == "return":
             return message_full.content
 
         # return new_message.message["content"]
 
+    def _pop_tool_result(self, tool_call_id: str, cancel: bool = False) -> Future | None:
+        """Take the eager result of a tool call (see _generate), if there is one; with
+        cancel, drop it, cancelling the call if it hasn't started."""
+        with self.lock:
+            for msg_id, futures in self._tool_results.items():
+                future = futures.pop(tool_call_id, None)
+                if future is not None:
+                    if not futures:
+                        del self._tool_results[msg_id]
+                    if cancel:
+                        future.cancel()
+                    return future
+        return None
+
+    def _drop_tool_results(self, message_ids: Iterable[str]) -> None:
+        """Drop the eager tool results of removed messages."""
+        for msg_id in message_ids:
+            for future in self._tool_results.pop(msg_id, {}).values():
+                future.cancel()
+
+    def _branch_off_if_taken(self) -> None:
+        """If the checked-out message already has a child on the checked-out branch, create
+        and check out a new branch to commit to instead."""
+        with self.lock:
+            existing_child_id = self.messages[self.current_id].children[self.current_branch]
+            if existing_child_id is not None:
+                new_branch_name = self._generate_new_branch_name(self.current_branch)
+                wordcel(
+                    f"WARNING: Current message {self.current_id} already has a child message {existing_child_id} on branch {self.current_branch}. "
+                    f"Creating new branch {new_branch_name} to avoid overwriting."
+                )
+                self.branch(new_branch_name, checkout=True)
+
+    def _run_tool(self, f_name: str, f_args: str) -> str:
+        """Call a tool with its json-encoded arguments, returning its result as a string."""
+        if f_name not in self.tool_map:
+            warnings.warn(f"Tool {f_name} not found in tool_map; skipping")
+            return f"ERROR: Tool {f_name} not found"
+        tool: callable = self.tool_map[f_name]
+        try:
+            with self.profiler.phase(f"tool.{f_name}"):
+                tool_kwargs: dict = json.loads(f_args)
+                tool_result: Any = tool(**tool_kwargs)
+        except Exception as e:
+            tool_result: str = f"ERROR: {e}"
+        return str(tool_result)
+
+    def _generate(
+        self,
+        history: list,
+        enable_tools: bool = True,
+        enable_streaming: bool = True,
+        mode: Literal["print", "return", "print_md"] = "print_md",
+        prompt_tokens: int | None = None,
+        key_history: list | None = None,
+        tool_results: dict[str, Future] | None = None,
+    ) -> tuple[ChatCompletionMessage, dict | None, dict]:
+        """Get an AI response to the history -- from the response cache if one is
+        configured and has it, otherwise from the provider -- and output it per `mode`.
+        Requests to the provider wait for their turn if the model is rate limited (see
+        chit.scheduler), by an estimate of `prompt_tokens` (computed if None). The response
+        cache is keyed by `key_history` (defaults to history), i.e. the history without
+        prompt caching breakpoints. With chit.config.EAGER_TOOLS, tools called by a
+        streamed response are started as soon as their arguments are in, and their futures
+        put in `tool_results` by tool call id.
+
+        Returns:
+            the response message (with references rendered), its token usage (None if the
+            response came from the cache), and its telemetry (see ChitMessage.telemetry)
+        """
+        start = time.perf_counter()
+        first_token = None
+        stream = enable_streaming
+        tool_kwargs = {}
+        if self.tools:
+            self._recalc_tools()  # cheap; picks up e.g. chat.tools.append(...)
+        if hasattr(self, "tools_") and self.tools_ and enable_tools:
+            tool_kwargs = {"tools": self.tools_, "tool_choice": "auto"}
+        cache = ResponseCache.from_config()
+        key = entry = None
+        if cache is not None:
+            with self.profiler.phase("response_cache"):
+                key = cache.key(
+                    self.model,
+                    history if key_history is None else key_history,
+                    tool_kwargs.get("tools"),
+                )
+                entry = cache.get(key)
+            self.profiler.count(
+                "response_cache.hits" if entry is not None else "response_cache.misses"
+            )
+            if entry is None and chit.config.RESPONSE_CACHE_OFFLINE:
+                raise LookupError(
+                    f"No cached response for this request in {cache} "
+                    "and chit.config.RESPONSE_CACHE_OFFLINE is set"
+                )
+
+        model = self.model  # the model that answers, which may be a fallback
+        if entry is not None:
+            message_full = ChatCompletionMessage(**entry["message"])
+            references = entry.get("citations")
+            usage = None
+            first_token = time.perf_counter()
+            if stream:
+                self._output_stream(replay_deltas(message_full.content or ""), mode)
+        else:
+            with self.profiler.phase("completion"):
+                _response, model, grant = self._complete(
+                    history, stream, prompt_tokens, **tool_kwargs
+                )
+            if stream:
+                on_tool_call = None
+                if tool_kwargs and chit.config.EAGER_TOOLS and tool_results is not None:
+                    # run each tool as soon as its arguments have been streamed in full
+                    with self.lock:
+                        if self._tool_executor is None:
+                            self._tool_executor = ThreadPoolExecutor(
+                                thread_name_prefix="chit-tools"
+                            )
+                    executor = self._tool_executor
+
+                    def on_tool_call(tool_call: dict):
+                        tool_results[tool_call["id"]] = executor.submit(
+                            self._run_tool,
+                            tool_call["function"]["name"],
+                            tool_call["function"]["arguments"],
+                        )
+
+                response = StreamAccumulator(on_tool_call=on_tool_call)
+                with self.profiler.phase("stream"):
+                    self._output_stream(
+                        (response.add(chunk) for chunk in _response), mode
+                    )
+                    response.finish()
+                response.estimate_usage(model, history, prompt_tokens)
+                first_token = response.first_token_time
+                message_full: ChatCompletionMessage = response.message()
+            else:
+                response = _response
+                message_full: ChatCompletionMessage = response.choices[0].message
+            references = getattr(response, "citations", [])
+            usage = self._extract_usage(response)
+            if usage is not None:
+                Scheduler.shared().settle(
+                    grant, (usage["prompt_tokens"] or 0) + (usage["completion_tokens"] or 0)
+                )
+            if cache is not None:
+                # cache the response as it came, before rendering references into it
+                with self.profiler.phase("response_cache"):
+                    cache.put(
+                        key, {"message": message_full.json(), "citations": references}
+                    )
+        latency = time.perf_counter() - start
+        telemetry = {
+            "model": model,
+            "latency": latency,
+            "ttft": latency if first_token is None else first_token - start,
+            "cost": 0.0 if entry is not None else self._cost(usage, model),
+            "history_length": len(history),
+            "cached": entry is not None,
+        }
+
+        message_full: ChatCompletionMessage = (
+            self._render_message_with_references(message_full, references)
+        )
+        with self.profiler.phase("render"):
+            if stream:
+                reference_str = self._render_references(references)
+                if mode == "print":
+                    print(reference_str)  # print references separately
+                elif mode == "print_md":
+                    from IPython.display import display, Markdown
+                    display(Markdown(reference_str))
+            else:
+                # Output based on mode
+                if mode == "print":
+                    print(message_full.content)
+                elif mode == "print_md":
+                    from IPython.display import display, Markdown
+                    display(Markdown(message_full.content))
+                # For "return" mode, we don't output anything here, just return at the end
+        return message_full, usage, telemetry
+
+    def _complete(
+        self,
+        messages: list,
+        stream: bool = False,
+        prompt_tokens: int | None = None,
+        model: str | None = None,
+        **kwargs,
+    ) -> tuple[Any, str, Grant | None]:
+        """Request a completion from the provider, per the chat's request policy (see
+        chit.policy) and within rate limits (see chit.scheduler).
+
+        Returns:
+            the response (a stream whose first chunk has arrived, if streaming), the model
+            that gave it, and its Grant from the scheduler, to settle once its usage is known
+        """
+        policy = self.request_policy or RequestPolicy.from_config()
+        if policy.timeout is not None:
+            kwargs["timeout"] = policy.timeout
+        if stream:
+            # OpenAI-style providers only report the usage of streams when asked to
+            kwargs.setdefault("stream_options", {"include_usage": True})
+        scheduler = Scheduler.shared()
+        grants = {}  # id of each response -> its Grant from the scheduler
+
+        def reserve(model: str) -> Grant | None:
+            """Wait for room for the request within the model's rate limits, if any."""
+            if not chit.config.RATE_LIMITS:
+                return None
+            tokens = prompt_tokens
+            if tokens is None:
+                tokens = litellm.token_counter(model=self.model, messages=messages)
+            with self.profiler.phase("scheduler.wait"):
+                return scheduler.acquire(
+                    model,
+                    tokens + chit.config.RATE_LIMIT_OUTPUT_TOKENS,
+                    id(self),
+                    self.priority,
+                )
+
+        def request(model: str, grant: Grant | None, abandoned: threading.Event):
+            if grant is None:
+                grant = reserve(model)  # a hedge, which waits for its grant in its own thread
+            if abandoned.is_set():
+                # timed out or lost to a hedge before being sent: give back its tokens
+                scheduler.settle(grant, 0)
+                raise TimeoutError(f"Request to {model} abandoned before it was sent")
+            try:
+                response = completion(model=model, messages=messages, stream=stream, **kwargs)
+                response = primed(response) if stream else response
+            except litellm.RateLimitError:
+                scheduler.throttle(model)
+                raise
+            grants[id(response)] = grant
+            return response
+
+        # rate limit waits happen before each attempt, so they don't count as timeouts
+        response, model = policy.run(
+            model or self.model, request, self.profiler, reserve=reserve
+        )
+        return response, model, grants.get(id(response))
+
+    def _cost(
+        self, usage: dict[str, int | None] | None, model: str | None = None
+    ) -> float | None:
+        """Cost in USD of a completion with the given usage (by the chat's model, unless
+        another is given), per litellm's price list."""
+        if usage is None:
+            return None
+        suppress_debug_info = litellm.suppress_debug_info
+        litellm.suppress_debug_info = True  # don't print help for unknown models
+        try:
+            prompt_cost, completion_cost = litellm.cost_per_token(
+                model=model or self.model,
+                prompt_tokens=usage["prompt_tokens"] or 0,
+                completion_tokens=usage["completion_tokens"] or 0,
+                cache_read_input_tokens=usage["cached_tokens"] or 0,
+                cache_creation_input_tokens=usage["cache_creation_tokens"] or 0,
+            )
+        except Exception:
+            return None
+        finally:
+            litellm.suppress_debug_info = suppress_debug_info
+        return prompt_cost + completion_cost
+
+    def _output_stream(
+        self, deltas: Iterable[str], mode: Literal["print", "return", "print_md"]
+    ) -> str:
+        """Output streamed text deltas as they arrive, and return the full text.
+
+        If profiling, the time spent rendering the deltas (as opposed to waiting for
+        them) is recorded as the "render" phase."""
+        full_response = ""
+        profile = chit.config.PROFILE and mode != "return"
+        render_time = 0.0
+        render_start = time.perf_counter()
+        if mode == "print_md":
+            md_stream = MarkdownStream()
+        for content_delta in deltas:
+            full_response += content_delta
+            if profile:
+                t = time.perf_counter()
+            if mode == "print_md":
+                md_stream.feed(content_delta)
+            if mode == "print":
+                print(content_delta, end="")
+            if profile:
+                render_time += time.perf_counter() - t
+        if mode == "print_md":
+            md_stream.close()
+        if profile:
+            # one aggregate span, ending when the stream did
+            end = time.perf_counter()
+            self.profiler.add("render", max(render_start, end - render_time), end)
+        return full_response
+
     def _capture_editor_content(self, editor_spec=None):
         """
         Open editor and capture content based on editor specification.
@@ -534,13 +997,15 @@ class Chat:
         return cell_map
 
     def branch(self, branch_name: str, checkout: bool = True) -> None:
-        if branch_name in self.branch_tips:
-            raise ValueError(
-                f"Branch '{branch_name}' already exists (latest at message {self.branch_tips[branch_name]})"
-            )
+        with self.lock:
+            if branch_name in self.branch_tips:
+                raise ValueError(
+                    f"Branch '{branch_name}' already exists (latest at message {self.branch_tips[branch_name]})"
+                )
 
-        self.messages[self.current_id].children[branch_name] = None
-        self.branch_tips[branch_name] = self.current_id
+            self.messages[self.current_id].children[branch_name] = None
+            self.branch_tips[branch_name] = self.current_id
+            self._touch(self.current_id)
         if checkout:
             old_id = self.current_id
             self.checkout(branch_name=branch_name)
@@ -571,13 +1036,38 @@ class Chat:
         else:
             raise ValueError(f"Invalid mode: {mode}")
 
+    def _line(self, branch_name: str) -> Line:
+        """The (cached) line of messages from the root to the tip of a branch."""
+        with self.lock:
+            tip_id = self.branch_tips.get(branch_name)
+            if tip_id is None:
+                raise IndexError(f"Chat history not long enough (no {branch_name} branch)")
+            line = self._lines.get(branch_name)
+            if line is None or line.tip != tip_id:
+                line = self._lines[branch_name] = Line(branch_name, self.messages, tip_id)
+            return line
+
     def _resolve_forward_path(
         self, branch_path: list[str], start_id: Optional[str] = None
     ) -> str:
         """Follow a path of branches forward from start_id (or current_id if None)"""
         current = start_id if start_id is not None else self.current_id
 
-        for branch in branch_path:
+        i = 0
+        while i < len(branch_path):
+            branch = branch_path[i]
+            # a run of the same branch is a jump along its line, if we're on it
+            run = 1
+            while i + run < len(branch_path) and branch_path[i + run] == branch:
+                run += 1
+            if run > 1 and branch in self.branch_tips:
+                line = self._line(branch)
+                pos = line.pos.get(current)
+                if pos is not None and pos >= line.start and pos + run < len(line):
+                    current = line.ids[pos + run]
+                    i += run
+                    continue
+            i += 1
             current_msg = self.messages[current]
             if branch not in current_msg.children:
                 raise KeyError(f"Branch '{branch}' not found in message {current}")
@@ -600,6 +1090,13 @@ class Chat:
         current = self.current_id
         steps = -index - 1  # -1 -> 0 steps, -2 -> 1 step, etc.
 
+        if self.current_branch in self.branch_tips:
+            pos = self._line(self.current_branch).pos.get(current)
+            if pos is not None:
+                if steps > pos:
+                    raise IndexError("Chat history is not deep enough")
+                return self._line(self.current_branch).ids[pos - steps]
+
         for _ in range(steps):
             current_msg = self.messages[current]
             if current_msg.parent_id is None:
@@ -612,20 +1109,10 @@ class Chat:
         """Convert positive or zero index to message ID by following master branch from root"""
         if index < 0:
             raise ValueError("This method only handles non-negative indices")
-
-        current = self.root_id
-        steps = index  # 0 -> root, 1 -> first message, etc.
-
-        for _ in range(steps):
-            current_msg = self.messages[current]
-            if "master" not in current_msg.children:
-                raise IndexError("Chat history not long enough (no master branch)")
-            next_id = current_msg.children["master"]
-            if next_id is None:
-                raise IndexError("Chat history not long enough (branch ends)")
-            current = next_id
-
-        return current
+        line = self._line("master")  # 0 -> root, 1 -> first message, etc.
+        if index >= len(line):
+            raise IndexError("Chat history not long enough (branch ends)")
+        return line.ids[index]
 
     def checkout(
         self,
@@ -672,24 +1159,226 @@ class Chat:
 
         self.backup()
 
+    def _get_history_ids(self, history_length=None, history_tokens=None) -> list[str]:
+        """IDs of the messages from root (or the `history_length` most recent) to the
+        current point, cut down to a token budget if `history_tokens` is given (see commit)."""
+        history_ids = []
+        current = self.current_id
+        while current is not None and (
+            history_length is None or len(history_ids) < history_length
+        ):
+            history_ids.append(current)
+            current = self.messages[current].parent_id
+        history_ids.reverse()
+        if history_tokens is not None:
+            budget = (
+                context_budget(self.model)
+                if history_tokens == "auto"
+                else history_tokens
+            )
+            window = token_window(
+                [self.messages[i] for i in history_ids], budget, self.model
+            )
+            history_ids = [msg.id for msg in window]
+        return history_ids
+
     def _get_message_history(self, history_length=None) -> list[dict[str, str]]:
         """Reconstruct message history from current point back to root.
 
         Arguments:
             history_len (int | None): number of most recent messages to send, or None to send all
         """
-        history = []
-        current = self.current_id
-        len_history: int = 0
-        while current is not None and (history_length is None or len_history < history_length):
-            msg = self.messages[current]
-            history.insert(0, msg.message)
-            len_history += 1
-            current = msg.parent_id
+        return [self.messages[i].message for i in self._get_history_ids(history_length)]
+
+    def _uses_cache_control(self) -> bool:
+        """Whether the model needs prompt caching breakpoints to be marked explicitly
+        (Anthropic-style `cache_control`), rather than caching automatically or not at all."""
+        model = self.model.lower()
+        return "anthropic" in model or "claude" in model
+
+    def _cache_breakpoints(self, history_ids: list[str]) -> list[int]:
+        """Positions in the history at which to mark a cacheable prefix: the system message,
+        the two latest fork points (prefixes shared with sibling branches) and the last
+        message (the prefix that the next commit on this branch will resend).
+        Anthropic allows at most 4 breakpoints per request."""
+        points = set()
+        if history_ids and self.messages[history_ids[0]].message["role"] == "system":
+            points.add(0)
+        forks = [
+            i
+            for i, msg_id in enumerate(history_ids[:-1])
+            if sum(c is not None for c in self.messages[msg_id].children.values()) > 1
+        ]
+        points.update(forks[-2:])
+        if history_ids:
+            points.add(len(history_ids) - 1)
+        return sorted(points)
+
+    @staticmethod
+    def _with_cache_control(message: dict | ChatCompletionMessage) -> dict | ChatCompletionMessage:
+        """Copy of a message with its (last) text content block marked as a cache breakpoint."""
+        if not isinstance(message, dict):
+            message = {k: v for k, v in message.json().items() if v is not None}
+        content = message.get("content")
+        if not content:
+            return message  # e.g. assistant message consisting only of tool calls
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        content = list(content)
+        for i in reversed(range(len(content))):
+            if content[i].get("type") == "text":
+                content[i] = content[i] | {"cache_control": {"type": "ephemeral"}}
+                break
+        return message | {"content": content}
+
+    def _get_cached_message_history(
+        self, history_length=None, history_tokens=None
+    ) -> tuple[list[dict[str, str]], list[dict[str, str]], int | None]:
+        """Like _get_message_history, but compacted if chit.config.COMPACT_SEGMENT is set,
+        and with prompt caching breakpoints marked if chit.config.PROMPT_CACHING is enabled
+        and the model needs them. Also returns the history without the breakpoints (which
+        depend on the forks above, not just on the request), to key the response cache by,
+        and an estimate of its prompt tokens for the scheduler if chit.config.RATE_LIMITS is
+        set (else None)."""
+        history_ids = self._get_history_ids(history_length, history_tokens)
+        summary = None
+        if chit.config.COMPACT_SEGMENT and history_length is None and history_tokens is None:
+            history_ids, summary = self._compacted(history_ids)
+        history = [self.messages[i].message for i in history_ids]
+        if summary is not None:
+            history[0] = with_summary(history[0], summary)
+        plain_history = list(history)
+        if chit.config.PROMPT_CACHING and self._uses_cache_control():
+            for i in self._cache_breakpoints(history_ids):
+                history[i] = self._with_cache_control(history[i])
+        prompt_tokens = None
+        if chit.config.RATE_LIMITS:
+            prompt_tokens = sum(count_tokens(self.messages[i], self.model) for i in history_ids)
+            if summary is not None:
+                prompt_tokens += litellm.token_counter(model=self.model, text=summary)
+        return history, plain_history, prompt_tokens
+
+    def _compacted(self, history_ids: list[str]) -> tuple[list[str], str | None]:
+        """The history to send, given the full one: the root, then the messages after the
+        latest segment that has been summarized, and that summary (None if there is none
+        yet). Starts summarizing the segments that haven't been in the background."""
+        points = boundaries(
+            self.messages, history_ids, chit.config.COMPACT_SEGMENT, chit.config.COMPACT_KEEP
+        )
+        ready = next(
+            (b for b in reversed(points) if self.messages[history_ids[b]].summary is not None),
+            None,
+        )
+        if points and points[-1] != ready:
+            self._summarize_in_background(history_ids, points)
+        if ready is None:
+            return history_ids, None
+        summary = self.messages[history_ids[ready]].summary["text"]
+        return [history_ids[0], *history_ids[ready + 1 :]], summary
+
+    def _summarize_in_background(self, history_ids: list[str], points: list[int]) -> Future:
+        """Summarize a history up to each of the given segment boundaries, in the chat's
+        background thread, unless that is already under way."""
+        target = history_ids[points[-1]]
+        with self.lock:
+            job = self._summary_jobs.get(target)
+            if job is None:
+                if self._compactor is None:
+                    self._compactor = ThreadPoolExecutor(
+                        max_workers=1, thread_name_prefix="chit-compact"
+                    )
+                job = self._summary_jobs[target] = self._compactor.submit(
+                    self._summarize, history_ids[: points[-1] + 1], points
+                )
+                job.add_done_callback(lambda _: self._summary_jobs.pop(target, None))
+        return job
+
+    def _summarize(self, history_ids: list[str], points: list[int]) -> None:
+        """Summarize a history up to each of the given segment boundaries that doesn't
+        have a summary yet, each from the one before and the messages since."""
+        previous, start = None, 1
+        try:
+            for b in points:
+                message = self.messages[history_ids[b]]
+                if message.summary is None:
+                    request = summary_request(
+                        previous, [self.messages[i] for i in history_ids[start : b + 1]]
+                    )
+                    with self.profiler.phase("compact"):
+                        response, model, grant = self._complete(
+                            request, model=chit.config.COMPACT_MODEL
+                        )
+                    usage = self._extract_usage(response)
+                    if usage is not None:
+                        Scheduler.shared().settle(
+                            grant, (usage["prompt_tokens"] or 0) + (usage["completion_tokens"] or 0)
+                        )
+                    with self.lock:
+                        message.summary = {
+                            "text": response.choices[0].message.content,
+                            "model": model,
+                            "n_messages": b,
+                        }
+                        self._touch(message.id)
+                    self.profiler.count("compact.summaries")
+                previous, start = message.summary["text"], b + 1
+        except Exception as e:
+            wordcel(f"WARNING: failed to summarize the history up to {history_ids[b]}: {e!r}")
+
+    def compact(
+        self, message_id: str | int | list[str] | None = None, wait: bool = True
+    ) -> Future | None:
+        """
+        Summarize the history up to a message now (see chit.compaction), rather than
+        leaving it to the background as commits need it, e.g. to prepare a long chat before
+        branching off it. Summaries are saved with the next push.
+
+        Arguments:
+            message_id: the message, as for checkout(); defaults to the current one
+            wait (bool): wait for the summaries to be written
 
-        return history
+        Returns:
+            the summarization job, or None if the history is too short to compact
+        """
+        if not chit.config.COMPACT_SEGMENT:
+            raise ValueError("Set chit.config.COMPACT_SEGMENT to compact histories")
+        msg_id = self._start_id(message_id, self.current_id)
+        history_ids = [m.id for m in ancestors(self.messages, msg_id, include_self=True)][::-1]
+        points = boundaries(
+            self.messages, history_ids, chit.config.COMPACT_SEGMENT, chit.config.COMPACT_KEEP
+        )
+        if not points:
+            return None
+        job = self._summarize_in_background(history_ids, points)
+        if wait:
+            job.result()
+        return job
+
+    @staticmethod
+    def _extract_usage(response) -> dict[str, int | None] | None:
+        """Token usage of a completion, including prompt caching figures."""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return None
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(usage, "cache_read_input_tokens", None) or getattr(
+            details, "cached_tokens", None
+        )
+        return {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "cached_tokens": cached_tokens or 0,
+            "cache_creation_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+        }
 
     def asdict(self):
+        with self.lock:
+            return self._header_dict() | {
+                "messages": {k: v.asdict() for k, v in self.messages.items()},
+            }
+
+    def _header_dict(self) -> dict:
+        """Everything in self.asdict() apart from the messages."""
         return {
             "model": self.model,
             "tools_": self.tools_,
@@ -697,33 +1386,382 @@ class Chat:
             "display_config": self.display_config
             if self.display_config is not None
             else None,
-            "messages": {k: v.asdict() for k, v in self.messages.items()},
             "current_id": self.current_id,
             "current_branch": self.current_branch,
             "root_id": self.root_id,
             "branch_tips": self.branch_tips,
+            "object_store": self.object_store,
+            "generation": self._generation,
         }
 
+    def _message_body(self, msg: ChitMessage) -> bytes:
+        raw = msg.raw_body()
+        if raw is not None:
+            # copy the body over as is, unless it needs to move into or out of the
+            # chat's object store
+            if raw.startswith(OBJECT_REF):
+                if msg._object_store == self.object_store:
+                    return raw
+            elif self.object_store is None:
+                return raw
+        d = msg.asdict()
+        body = {k: d[k] for k in ChitMessage.BODY_FIELDS}
+        if self.object_store is not None:
+            key = ObjectStore.open(self.object_store).put(
+                {k: body.pop(k) for k in CONTENT_FIELDS}
+            )
+            body = {"object": key} | body
+        return encode_body(body)
+
+    def _message_records(self, message_ids):
+        """(id, structure, body) triples for writing messages to a remote; structure
+        and body are None for messages that have been removed. Bodies of lazily-cloned
+        messages are copied over without decoding them."""
+        for k in message_ids:
+            v = self.messages.get(k)
+            if v is None:
+                yield k, None, None
+                continue
+            yield (
+                k,
+                {
+                    "children": v.children,
+                    "parent_id": v.parent_id,
+                    "home_branch": v.home_branch,
+                },
+                lambda v=v: self._message_body(v),
+            )
+
+    def _push_jsonl(self, path: str) -> None:
+        """Append the messages changed since the last push to a jsonl remote, or write
+        it in full if it isn't the file we last pushed to (or is due for compaction)."""
+        log = self._jsonl_log
+        if (
+            log is not None
+            and log.path == path
+            and log.can_append(chit.config.JSONL_COMPACT_DEPTH)
+        ):
+            log.append(self._header_dict(), self._message_records(sorted(self._dirty)))
+        else:
+            self._jsonl_log = self._rewrite_remote(
+                path,
+                lambda before_replace: JsonlLog.write(
+                    path,
+                    self._header_dict(),
+                    self._message_records(self.messages),
+                    before_replace,
+                ),
+            )
+
+    def _rewrite_remote(self, path: str, write: Callable[[Callable | None], Any]) -> Any:
+        """Rewrite a remote with write(before_replace) (see write_indexed_json), returning
+        what it returns. Lazily-cloned messages may still have the remote memory-mapped
+        for their bodies, and Windows doesn't allow replacing a mapped file: their stores
+        are closed just before it is replaced, and the messages then read their bodies
+        from the new file."""
+        target = os.path.abspath(path)
+        lazy = [
+            msg
+            for msg in self.messages.values()
+            if isinstance(msg, LazyChitMessage)
+            and not msg.loaded
+            and not msg._store.closed
+            and os.path.abspath(msg._store.path) == target
+        ]
+        if not lazy:
+            return write(None)
+        stores = {id(msg._store): msg._store for msg in lazy}.values()
+        new_index = None
+
+        def before_replace(index: dict[str, list]) -> None:
+            nonlocal new_index
+            for store in stores:
+                store.close()
+            new_index = index
+
+        try:
+            result = write(before_replace)
+        finally:
+            if new_index is not None:
+                # if the write failed before the new file replaced the old one, the old
+                # one's bodies are still where they were
+                replaced = not os.path.exists(path + ".tmp")
+                store = BodyStore(path)
+                for msg in lazy:
+                    msg._store = store
+                    if replaced:
+                        msg._span = tuple(new_index[msg.id][:2])
+                        msg._object_store = self.object_store
+        return result
+
     def push(self) -> None:
         """Save chat history to configured remote"""
         if self.remote is None:
             raise ValueError("No remote configured. Set chat.remote first.")
+        with self.lock, self.profiler.phase("push"):
+            self._push()
 
+    def _push(self) -> None:
         if self.remote.json_file is not None:
-            data = self.asdict()
-            os.makedirs(os.path.dirname(self.remote.json_file), exist_ok=True)
-            with open(self.remote.json_file, "w") as f:
-                json.dump(data, f)
+            path = self.remote.json_file
+            with remote_lock(path) if chit.config.MULTI_WRITER else nullcontext():
+                merged = self._check_remote(path)
+                self._generation += 1
+                appending = path.endswith(".jsonl") and self._jsonl_log is not None
+                with self.profiler.phase("push.serialize"):
+                    if path.endswith(".jsonl"):
+                        self._push_jsonl(path)
+                    else:
+                        self._rewrite_remote(
+                            path,
+                            lambda before_replace: write_indexed_json(
+                                path,
+                                self._header_dict(),
+                                self._message_records(self.messages),
+                                before_replace,
+                            ),
+                        )
+                self._remote_stat = file_stat(path)
+            if chit.config.MULTI_WRITER or self._base is not None:
+                self._snapshot_base(
+                    self._dirty if appending and not merged and self._base is not None else None
+                )
+            self.profiler.count("push.changed_messages", len(self._dirty))
+            self._dirty.clear()
+            if self.semantic_index is not None and self.semantic_index.changed:
+                with self.profiler.phase("push.semantic_index"):
+                    self.semantic_index.save(vectors_path(path))
 
         if self.remote.html_file is not None:
-            html_content = self._generate_viz_html()
-            os.makedirs(os.path.dirname(self.remote.html_file), exist_ok=True)
+            with self.profiler.phase("push.viz_html"):
+                html_content = self._generate_viz_html()
+            if os.path.dirname(self.remote.html_file):
+                os.makedirs(os.path.dirname(self.remote.html_file), exist_ok=True)
             with open(self.remote.html_file, "w") as f:
                 f.write(html_content)
 
+    def _snapshot_base(self, message_ids: Iterable[str] | None = None) -> None:
+        """Record the structure of the given messages (all, if None) and the branch tips as
+        the common ancestor for merging, i.e. as they now are in the remote."""
+        if message_ids is None or self._base is None:
+            self._base = {}
+            message_ids = self.messages
+        for k in message_ids:
+            v = self.messages.get(k)
+            if v is None:
+                self._base.pop(k, None)
+            else:
+                self._base[k] = (dict(v.children), v.home_branch)
+        self._base_tips = dict(self.branch_tips)
+
+    def _check_remote(self, path: str) -> bool:
+        """Before pushing to path: if another writer pushed to it since we last cloned or
+        pushed, merge their changes in (with chit.config.MULTI_WRITER) or warn that they
+        are about to be overwritten. Returns whether anything was merged."""
+        stat = file_stat(path)
+        if stat is None or stat == self._remote_stat:
+            return False
+        with RemoteReader(path) as reader:
+            generation = reader.header.get("generation", 0)
+            if self._remote_stat is not None and generation == self._generation:
+                return False  # e.g. touched, but not pushed to
+            if not chit.config.MULTI_WRITER:
+                wordcel(
+                    f"WARNING: {path} was modified since this chat last cloned or pushed "
+                    f"it (generation {generation}, ours {self._generation}); overwriting it. "
+                    "Set chit.config.MULTI_WRITER to merge instead."
+                )
+                self._generation = max(generation, self._generation)
+                return False
+            self._merge_remote(reader)
+            self._generation = max(generation, self._generation)
+            if reader.jsonl_log is not None:
+                self._jsonl_log = reader.jsonl_log  # append our changes after theirs
+        return True
+
+    def _merge_remote(self, reader: RemoteReader) -> None:
+        """
+        Three-way merge of the chat another writer pushed to our remote ("theirs") into
+        this one ("ours"), relative to the state both started from ("base": what we last
+        cloned or pushed, see _snapshot_base).
+
+        Since message ids are unique and messages never change apart from their links,
+        messages are merged by id: those added on either side are kept, and those removed
+        on either side are removed -- unless the other side added messages below them, or
+        we have them checked out, in which case they are kept so as not to lose anything.
+        Children links, home branches and branch tips are merged key by key, taking the
+        side that changed; if both sides moved the same branch (e.g. both committed to
+        master), ours keeps the branch and theirs continues on a new branch, named as by
+        branch() (e.g. master_1).
+        """
+        if reader.header["root_id"] != self.root_id:
+            raise ValueError(
+                f"{reader.path} holds a different chat (root {reader.header['root_id']}); "
+                "cannot merge with it"
+            )
+        MISSING = object()
+        ours = self.messages
+        theirs = reader.structure  # id -> (children, parent_id, home_branch)
+        base = self._base or {}
+        base_tips = self._base_tips or {}
+        theirs_tips = reader.header["branch_tips"]
+
+        def merge3(o, t, b):
+            if o == t or t == b:
+                return o
+            if o == b:
+                return t
+            return MISSING if o is MISSING and t is MISSING else (o if o is not MISSING else t)
+
+        # messages: kept unless removed on a side (i.e. in the base but no longer there)
+        keep = {k for k in ours if k in theirs or k not in base}
+        keep |= {k for k in theirs if k not in base}
+
+        def parent_of(k: str) -> str | None:
+            return ours[k].parent_id if k in ours else theirs[k][1]
+
+        for k in list(keep) + [self.current_id]:
+            keep.add(k)
+            p = parent_of(k)
+            while p is not None and p not in keep:  # removed, but needed
+                keep.add(p)
+                p = parent_of(p)
+
+        added = set()  # messages only theirs have
+        merged: dict[str, ChitMessage] = {k: v for k, v in ours.items() if k in keep}
+        for k in theirs:
+            if k in keep and k not in ours:
+                children, parent_id, home_branch = theirs[k]
+                merged[k] = ChitMessage(
+                    id=k,
+                    children=dict(children),
+                    parent_id=parent_id,
+                    home_branch=home_branch,
+                    **reader.body(k),
+                )
+                added.add(k)
+
+        # links: children and home branches
+        for k, msg in merged.items():
+            if k in added or k not in theirs:
+                continue
+            t_children, _, t_home = theirs[k]
+            b_children, b_home = base.get(k, ({}, msg.home_branch))
+            if t_children != b_children:
+                o_children = msg.children
+                msg.children = {}
+                for branch in list(o_children) + [b for b in t_children if b not in o_children]:
+                    value = merge3(
+                        o_children.get(branch, MISSING),
+                        t_children.get(branch, MISSING),
+                        b_children.get(branch, MISSING),
+                    )
+                    if value is not MISSING:
+                        msg.children[branch] = value
+            if t_home != b_home and msg.home_branch == b_home:
+                msg.home_branch = t_home
+        for k, msg in merged.items():
+            for branch, child_id in msg.children.items():
+                if child_id is not None and child_id not in merged:
+                    msg.children[branch] = None
+        # re-link messages that were kept although one side had unlinked them
+        for k, msg in merged.items():
+            p = msg.parent_id
+            if p is None or k in merged[p].children.values():
+                continue
+            links = [b for b, c in theirs.get(p, ({},))[0].items() if c == k]
+            links += [b for b, c in base.get(p, ({},))[0].items() if c == k]
+            branch = links[0] if links else msg.home_branch
+            if merged[p].children.get(branch) is not None:
+                branch = self._generate_new_branch_name(branch)
+            merged[p].children[branch] = k
+
+        # branch tips
+        tips: dict[str, str] = {}
+        conflicts = []
+        for branch in list(self.branch_tips) + [b for b in theirs_tips if b not in self.branch_tips]:
+            o = self.branch_tips.get(branch, MISSING)
+            t = theirs_tips.get(branch, MISSING)
+            b = base_tips.get(branch, MISSING)
+            if o is not MISSING and t is not MISSING and o != t != b and o != b:
+                conflicts.append(branch)
+            value = merge3(o, t, b)
+            if value is not MISSING:
+                tips[branch] = value
+        self.messages = merged
+        self.branch_tips = tips
+        for branch in conflicts:
+            # theirs continues on a new branch, from where their line of it leaves ours
+            tip = theirs_tips[branch]
+            if tip not in added:
+                continue
+            new_branch = self._generate_new_branch_name(branch)
+            # walk up their line of the branch, as far as it's theirs only
+            current = tip
+            while True:
+                p = merged[current].parent_id
+                if p is None or p not in added or merged[p].children.get(branch) != current:
+                    break
+                current = p
+            p = merged[current].parent_id
+            if p is not None and theirs.get(p, ({},))[0].get(branch) == current:
+                # the fork: ours continues the branch from here, theirs the new one
+                if merged[p].children.get(branch) == current:
+                    del merged[p].children[branch]
+                merged[p].children[new_branch] = current
+                self._touch(p)
+            while current in added:
+                msg = merged[current]
+                if msg.home_branch == branch:
+                    msg.home_branch = new_branch
+                if branch not in msg.children:
+                    break
+                msg.children[new_branch] = msg.children.pop(branch)
+                current = msg.children[new_branch]
+                if current is None:
+                    break
+            tips[new_branch] = tip
+        for branch, tip in list(tips.items()):
+            if tip not in merged:
+                del tips[branch]
+        if self.current_branch not in tips:
+            tips[self.current_branch] = self.current_id
+
+        # everything that now differs from theirs has to be written
+        for k, msg in merged.items():
+            if k not in theirs or theirs[k][0] != msg.children or theirs[k][2] != msg.home_branch:
+                self._touch(k)
+        self._touch(*(k for k in theirs if k not in merged))
+        self._lines.clear()
+
+    def stats(self, reset: bool = False) -> dict:
+        """Time spent in each phase of this chat's work (with count, total, mean and max
+        seconds), plus counters. Only recorded while chit.config.PROFILE is set.
+
+        Phases: "commit" (the whole commit, including any autosave), "history" (building
+        the history to send), "response_cache", "completion" (sending the request, up to
+        the response or the start of its stream), "stream" (receiving a streamed
+        response, including rendering it), "render" (rendering the response), "tool.<name>",
+        "push" (of which "push.serialize" and "push.viz_html") and "clone".
+
+        Arguments:
+            reset (bool): clear the recorded stats after returning them
+        """
+        stats = self.profiler.stats()
+        if reset:
+            self.profiler.reset()
+        return stats
+
+    def dump_trace(self, path: str) -> None:
+        """Write the phases recorded while chit.config.PROFILE was set to a json file in
+        the Chrome trace event format, viewable in chrome://tracing or ui.perfetto.dev."""
+        self.profiler.dump_trace(path)
+
     def __getitem__(
         self, key: str | int | list[str] | slice
-    ) -> ChitMessage | list[ChitMessage]:
+    ) -> ChitMessage | MessageView:
+        """Messages by id, position or branch path; slices (from start to stop, both
+        inclusive) give a lazy MessageView of the path between them."""
         # Handle string indices (commit IDs)
         if isinstance(key, str):
             if key not in self.messages:
@@ -770,36 +1808,51 @@ class Chat:
             else:
                 stop_id = key.stop
 
-            # Walk up from stop_id to start_id
-            result = []
-            current = stop_id if stop_id is not None else self.current_id
-
-            while True:
-                if current is None:
-                    raise IndexError("Reached root before finding start")
+            return self._path_view(start_id, stop_id)
 
-                result.append(self.messages[current])
+        raise TypeError(f"Invalid key type: {type(key)}")
 
-                if current == start_id:
+    def _path_view(self, start_id: str | None, stop_id: str | None) -> MessageView:
+        """View of the messages from start_id (or the root) down to stop_id (or the
+        current message), which must be its descendant."""
+        stop_id = stop_id if stop_id is not None else self.current_id
+        # use a cached line that the path lies on, if there is one
+        for line in self._lines.values():
+            stop = line.pos.get(stop_id)
+            if stop is not None and self.branch_tips.get(line.branch) == line.tip:
+                start = 0 if start_id is None else line.pos.get(start_id)
+                if start is None or start > stop:
+                    break  # start is not an ancestor of stop
+                return MessageView(self.messages, line.ids, start, stop + 1)
+        # otherwise walk up from stop_id to start_id
+        ids = []
+        current = stop_id
+        while True:
+            if current is None:
+                if start_id is None:
                     break
-
-                current = self.messages[current].parent_id
-
-            return result[::-1]  # Reverse to get chronological order
-
-        raise TypeError(f"Invalid key type: {type(key)}")
+                raise IndexError("Reached root before finding start")
+            ids.append(current)
+            if current == start_id:
+                break
+            current = self.messages[current].parent_id
+        ids.reverse()  # chronological order
+        return MessageView(self.messages, ids)
 
     @classmethod
     def clone(
         cls,
         remote: str | Remote,
         prioritize_data_remote: bool = None,
+        lazy: bool = None,
     ) -> "Chat":
         """Create new Chat instance from remote file
 
         Arguments:
             remote (str or Remote): where to load chat history from. Can be:
                     - /path/to/file.json (str)
+                    - /path/to/file.jsonl (str), an append-only remote (always cloned lazily
+                      unless lazy=False is passed)
                     - /path/to/file (str), interpreted as Remote("/path/to/file.json", "/path/to/file.html")
                     - Remote("/path/to/file.json", "/path/to/file.html")
                     - ("/path/to/file.json", "/path/to/file.html") (tuple) -- interpreted as Remote object
@@ -811,8 +1864,13 @@ class Chat:
                 priority compared to the path you're actually cloning from. Set to
                 False if e.g. you are cloning from a copy or move of the file in a
                 different folder or machine.
+            lazy (bool): only load the structure of the chat tree, and decode each
+                message's content from the remote when it is first accessed. Requires
+                the remote to have been written by `push()` (which indexes it).
+                Defaults to chit.config.LAZY_CLONE
 
         """
+        clone_start = time.perf_counter()
         prioritize_data_remote = prioritize_data_remote or chit.config.PRIORITIZE_DATA_REMOTE
         if isinstance(remote, tuple):
             remote = Remote(*remote)
@@ -820,7 +1878,7 @@ class Chat:
             remote_str: str = remote.json_file
             remote_dict: dict = vars(remote)
         elif isinstance(remote, str):
-            if remote.endswith(".json"):
+            if remote.endswith((".json", ".jsonl")):
                 remote_str: str = remote
                 remote_dict: dict = {"json_file": remote_str}
             else:
@@ -835,8 +1893,25 @@ class Chat:
                 f"unrecognized remote type {type(remote)}; must be str, Remote or tuple"
             )
 
-        with open(remote_str, "r") as f:
-            data = json.load(f)
+        # before reading, so that a push by another writer while we read is noticed
+        remote_stat = file_stat(remote_str)
+        jsonl_log = None
+        if remote_str.endswith(".jsonl"):
+            lazy = True if lazy is None else lazy
+            jsonl_log, index = JsonlLog.read(remote_str)
+        else:
+            lazy = chit.config.LAZY_CLONE if lazy is None else lazy
+            index = read_index(remote_str) if lazy else None
+        if index is not None:
+            data = index["header"]
+        else:
+            if lazy:
+                wordcel(
+                    f"No up-to-date index found for {remote_str}; loading it in full. "
+                    "It will be indexed on the next push."
+                )
+            with open(remote_str, "r") as f:
+                data = json.load(f)
 
         data_remote_dict = data.get("remote", {})
         if prioritize_data_remote:
@@ -854,23 +1929,248 @@ class Chat:
             remote=updated_remote,
             display_config=data.get("display_config", chit.config.DISPLAY_CONFIG),
         )
-
-        chat.messages = {k: ChitMessage(**v) for k, v in data["messages"].items()}
+        object_store = data.get("object_store")
+        if object_store is not None:
+            chat.object_store = object_store
+
+        if index is not None:
+            store = BodyStore(remote_str)
+            chat.messages = {
+                k: LazyChitMessage(
+                    id=k,
+                    children=children,
+                    parent_id=parent_id,
+                    home_branch=home_branch,
+                    store=store,
+                    span=(offset, length),
+                    object_store=object_store,
+                )
+                for k, (offset, length, children, parent_id, home_branch) in index[
+                    "index"
+                ].items()
+            }
+            if not lazy:
+                chat.messages = {
+                    k: ChitMessage(
+                        id=k,
+                        children=v.children,
+                        parent_id=v.parent_id,
+                        home_branch=v.home_branch,
+                        **{field: getattr(v, field) for field in ChitMessage.BODY_FIELDS},
+                    )
+                    for k, v in chat.messages.items()
+                }
+                store.close()
+            chat._jsonl_log = jsonl_log
+        else:
+            chat.messages = {
+                k: ChitMessage(**resolve_body(v, object_store))
+                for k, v in data["messages"].items()
+            }
         chat.current_id = data["current_id"]
         chat.current_branch = data["current_branch"]
         chat.root_id = data["root_id"]
         chat.branch_tips = data["branch_tips"]
+        chat._lines = {}
+        chat._generation = data.get("generation", 0)
+        if chat.remote.json_file == remote_str:
+            chat._remote_stat = remote_stat
+        if chit.config.MULTI_WRITER:
+            chat._snapshot_base()
         if data.get("_tools", None):
             wordcel(
                 f"WARNING: found the following tools in the remote: {data['_tools']} "
                 "but cannot add them as we do not have the functions. Please add them manually."
             )
+        if chit.config.PROFILE:
+            chat.profiler.add("clone", clone_start, time.perf_counter())
         return chat
 
+    def worktree(
+        self,
+        message_id: Optional[str | int | list[str]] = None,
+        branch_name: Optional[str] = None,
+    ) -> "Worktree":
+        """
+        A new checkout of this chat that shares its messages, for committing to several
+        branches at once, e.g. from different threads (see chit.worktree).
+
+        Arguments:
+            message_id, branch_name: what to check out in the worktree, as for checkout().
+                Defaults to what this chat has checked out
+
+        ```
+        a, b = chat.worktree(branch_name="a"), chat.worktree(branch_name="b")
+        with ThreadPoolExecutor() as pool:
+            pool.submit(a.commit, mode="return"), pool.submit(b.commit, mode="return")
+        ```
+        """
+        from chit.worktree import Worktree
+
+        return Worktree(self, message_id, branch_name)
+
+    def _cursors(self) -> list["Chat"]:
+        """This chat and its worktrees, i.e. everything with a checkout of its tree."""
+        return [self, *self._worktrees]
+
     @property
     def current_message(self):
         return self[self.current_id]
 
+    def compare(self, other: "Chat") -> dict[str, set[str]]:
+        """Compare the message trees of two chats by message id.
+
+        With content-derived ids (chit.config.CONTENT_IDS), a message id determines the
+        message's content and its whole history, so messages with the same id in both
+        chats are the same, and the comparison never looks at message contents.
+
+        Returns:
+            dict with the sets of message ids "common" to both chats, "only_self",
+            "only_other", and "forks": common messages after which the chats diverge,
+            i.e. which have a child in one chat that is not in the other
+        """
+        mine, theirs = self.messages.keys(), other.messages.keys()
+        common = mine & theirs
+        forks = {
+            k
+            for k in common
+            if {c for c in self.messages[k].children.values() if c is not None}
+            != {c for c in other.messages[k].children.values() if c is not None}
+        }
+        return {
+            "common": common,
+            "only_self": mine - theirs,
+            "only_other": theirs - mine,
+            "forks": forks,
+        }
+
+    def _start_id(self, start: str | int | list[str] | None, default: str) -> str:
+        """Id of the message to start a traversal from, given any index of it."""
+        if start is None:
+            return default
+        if isinstance(start, str):
+            if start not in self.messages:
+                raise ValueError(f"Message {start} does not exist")
+            return start
+        return self[start].id
+
+    def walk(
+        self,
+        start: str | int | list[str] | None = None,
+        order: Literal["dfs", "bfs"] = "dfs",
+        where: Callable[[ChitMessage], bool] | None = None,
+        prune: Callable[[ChitMessage], bool] | None = None,
+        max_depth: int | None = None,
+    ) -> Iterator[ChitMessage]:
+        """
+        Lazily walk the messages of the tree, or of the subtree below a message.
+
+        Args:
+            start (str | int | list[str] | None): the message to start from, indexed as in
+                chat[...]. Defaults to the root.
+            order (str): "dfs" (depth-first: each message followed by its subtree, the heir
+                first, as drawn by log()) or "bfs" (breadth-first: level by level)
+            where (callable): only yield the messages for which where(message) is true
+            prune (callable): skip the messages for which prune(message) is true together
+                with their subtrees, without visiting them
+            max_depth (int | None): don't go deeper than this many messages below the start
+
+        Filters run during the walk, which only keeps the messages still to be visited, so
+        e.g. `sum(1 for m in chat.walk(where=lambda m: m.message["role"] == "user"))` streams
+        over the tree. See chit.traversal.
+        """
+        return walk(
+            self.messages, self._start_id(start, self.root_id), order, where, prune, max_depth
+        )
+
+    def iter_subtree(
+        self,
+        start: str | int | list[str] | None = None,
+        order: Literal["dfs", "bfs"] = "dfs",
+        prune: Callable[[ChitMessage], bool] | None = None,
+        max_depth: int | None = None,
+    ) -> Iterator[str]:
+        """Like walk(), but yields message ids, without looking up the messages."""
+        return iter_subtree(
+            self.messages, self._start_id(start, self.root_id), order, prune, max_depth
+        )
+
+    def iter_leaves(
+        self,
+        start: str | int | list[str] | None = None,
+        prune: Callable[[ChitMessage], bool] | None = None,
+    ) -> Iterator[ChitMessage]:
+        """Messages without children below (or at) start, which defaults to the root."""
+        return iter_leaves(self.messages, self._start_id(start, self.root_id), prune)
+
+    def iter_paths(
+        self,
+        start: str | int | list[str] | None = None,
+        prune: Callable[[ChitMessage], bool] | None = None,
+    ) -> Iterator[MessageView]:
+        """
+        Every path from start (default: the root) down to a leaf, as a view of its messages.
+
+        Consecutive paths share their common prefix, so a path is only valid until the next
+        one is generated: use list(path) or path.ids to keep it.
+        """
+        for path in iter_paths(self.messages, self._start_id(start, self.root_id), prune):
+            yield MessageView(self.messages, path)
+
+    def ancestors(
+        self, start: str | int | list[str] | None = None, include_self: bool = False
+    ) -> Iterator[ChitMessage]:
+        """The parent, grandparent, ... up to the root, of start (default: the current message)."""
+        return ancestors(self.messages, self._start_id(start, self.current_id), include_self)
+
+    def export_paths(
+        self,
+        path: str,
+        format: Literal["openai", "sharegpt"] = "openai",
+        branches: list[str] | None = None,
+        roles: list[str] | None = None,
+        where: Callable[[MessageView], bool] | None = None,
+        prune: Callable[[ChitMessage], bool] | None = None,
+        start: str | int | list[str] | None = None,
+        append: bool = False,
+    ) -> int:
+        """
+        Export every path from the root to a leaf as a conversation, one per line of a JSONL
+        file, e.g. as a fine-tuning or eval dataset. Shared prefixes are only converted
+        once, and lines are written as they are generated (see chit.export).
+
+        Args:
+            path (str): file to write
+            format (str): "openai" ({"messages": [{"role": ..., "content": ...}, ...]}) or
+                "sharegpt" ({"conversations": [{"from": ..., "value": ...}, ...]})
+            branches (list[str] | None): only export paths ending on these branches
+            roles (list[str] | None): only include messages with these roles, e.g. leave
+                out the system prompt
+            where (callable): only export the paths (views of their messages, see
+                iter_paths) for which where(path) is true
+            prune (callable): leave out the messages for which prune(message) is true, and
+                their subtrees, without visiting them
+            start (str | int | list[str] | None): export paths from this message instead of
+                the root
+            append (bool): append to the file rather than overwrite it
+
+        Returns:
+            int: number of conversations written
+
+        To export many chats at once, in parallel, see chit.export_remotes.
+        """
+        with self.lock, open(path, "a" if append else "w", encoding="utf-8") as f:
+            return write_paths(
+                f,
+                self.messages,
+                self._start_id(start, self.root_id),
+                format,
+                branches,
+                roles,
+                where,
+                prune,
+            )
+
     def _is_descendant(self, child_id: str, ancestor_id: str) -> bool:
         """
         Test if ancestor_id is an ancestor of child_id
@@ -891,19 +2191,108 @@ class Chat:
         if ancestor_id not in self.messages:
             raise ValueError(f"Message {ancestor_id} does not exist")
 
-        # If they're the same, return False (not a true ancestor)
-        if child_id == ancestor_id:
-            return True
+        return self._ancestors().is_ancestor(ancestor_id, child_id)
 
-        # Traverse up from child until we either find the ancestor or reach the root
-        current = self.messages[child_id].parent_id
+    def _ancestors(self) -> AncestorIndex:
+        """The ancestor index of the messages, made anew if they were replaced (e.g. by a
+        merge)."""
+        if self._ancestry is None or self._ancestry.messages is not self.messages:
+            self._ancestry = AncestorIndex(self.messages)
+        return self._ancestry
 
-        while current is not None:
-            if current == ancestor_id:
-                return True
-            current = self.messages[current].parent_id
+    def _resolve_ref(self, ref: str | int | list[str]) -> str:
+        """Message id of a branch name (its tip), message id, index or branch path."""
+        if isinstance(ref, str) and ref in self.branch_tips:
+            return self.branch_tips[ref]
+        return self[ref].id
+
+    def merge_base(self, a: str | int | list[str], b: str | int | list[str]) -> ChitMessage:
+        """
+        The latest message that both a and b descend from (or are), i.e. where they fork.
 
-        return False
+        Args:
+            a, b: branch names (for their tips), message ids, or any other index
+        """
+        with self.lock:
+            return self.messages[
+                self._ancestors().merge_base(self._resolve_ref(a), self._resolve_ref(b))
+            ]
+
+    def diff(
+        self, a: str | int | list[str], b: str | int | list[str], context: int = 0
+    ) -> dict[str, ChitMessage | MessageView]:
+        """
+        Compare two branches (or messages) by where they fork.
+
+        Args:
+            a, b: branch names (for their tips), message ids, or any other index
+            context: number of messages up to and including the merge base to include
+
+        Returns:
+            dict containing:
+                - 'merge_base': the latest message both a and b descend from
+                - 'a': messages after the merge base down to a
+                - 'b': messages after the merge base down to b
+                - 'context': the last `context` messages up to the merge base
+        """
+        with self.lock:
+            index = self._ancestors()
+            a_id, b_id = self._resolve_ref(a), self._resolve_ref(b)
+            base = index.merge_base(a_id, b_id)
+            depth = index.depth(base)
+            top = index.ancestor_at(base, max(depth - context + 1, 0)) if context > 0 else None
+            return {
+                "merge_base": self.messages[base],
+                "a": MessageView(self.messages, index.path(base, a_id)),
+                "b": MessageView(self.messages, index.path(base, b_id)),
+                "context": MessageView(
+                    self.messages, [] if top is None else [top, *index.path(top, base)]
+                ),
+            }
+
+    def show_diff(
+        self,
+        a: str | int | list[str],
+        b: str | int | list[str],
+        context: int = 1,
+        format: Literal["text", "html"] = "text",
+        mode: Literal["print", "return", "print_md"] = None,
+        width: int = 120,
+    ) -> None | str:
+        """Show two branches (or messages) side by side from where they fork.
+
+        Arguments:
+            a, b: branch names (for their tips), message ids, or any other index
+            context (int): number of messages up to and including the merge base to show
+            format (str): "text", or "html" for a table
+            mode (str): whether to print the diff or return it; in html format, "print"
+                opens it in the browser and "print_md" displays it in the notebook
+            width (int): width of text output in characters
+        """
+        mode = mode or chit.config.DEFAULT_MODE
+        diff = self.diff(a, b, context=context)
+        labels = (str(a), str(b))
+        if format == "text":
+            content = side_by_side_text(diff, labels, width=width)
+        elif format == "html":
+            content = side_by_side_html(diff, labels)
+        else:
+            raise ValueError(f"Invalid format: {format}")
+        if mode == "return":
+            return content
+        elif mode == "print_md":
+            from IPython.display import display, HTML, Markdown
+
+            display(HTML(content) if format == "html" else Markdown(f"```\n{content}\n```"))
+        elif mode == "print":
+            if format == "text":
+                print(content)
+            else:
+                with tempfile.NamedTemporaryFile("w", suffix=".html", delete=False) as f:
+                    f.write(content)
+                webbrowser.open(f"file://{f.name}")
+        else:
+            raise ValueError(f"Invalid mode: {mode}")
 
     def _get_branch_root(self, branch_name: str) -> str:
         """
@@ -1006,6 +2395,7 @@ class Chat:
             if branch_name in msg.children:
                 # to_delete.add(msg.children[branch_name]) # no need to do this now
                 del msg.children[branch_name]
+                self._touch(msg_id)
 
         # Clean up parent references
         for parent_id, msg_id in parent_cleanups:
@@ -1017,11 +2407,19 @@ class Chat:
                 ):  # Create list copy to modify during iteration
                     if child_id == msg_id:
                         del parent.children[branch]
+                        self._touch(parent_id)
 
         # Finally delete the messages
         for msg_id in to_delete:
             if msg_id in self.messages:  # Check message still exists
                 del self.messages[msg_id]
+                self._touch(msg_id)
+        if self.semantic_index is not None:
+            self.semantic_index.remove(to_delete)
+        if self._ancestry is not None:
+            self._ancestry.forget(to_delete)
+        if self._tool_results:
+            self._drop_tool_results(to_delete)
 
         # Remove from branch_tips if present
         if branch_name in self.branch_tips:
@@ -1037,13 +2435,14 @@ class Chat:
         # if removing the current commit or an ancestor, checkout its parent
         self.checkout(*self._check_kalidasa_commit(commit_id))
 
-        # kill all children
-        for child_branch, child_id in message.children.items():
-            if child_id is not None:
-                self._rm_commit(child_id)
-            if child_branch != message.home_branch:
-                # this is a branch that doesn't exist anywhere else, so it must be removed
-                self.branch_tips.pop(child_branch, None)
+        removed: set[str] = set(iter_subtree(self.messages, commit_id))
+
+        # branches forking off within the subtree don't exist anywhere else
+        for msg_id in removed:
+            msg = self.messages[msg_id]
+            for child_branch in msg.children:
+                if child_branch != msg.home_branch:
+                    self.branch_tips.pop(child_branch, None)
 
         # Update parent's children
         if message.parent_id is not None:
@@ -1051,17 +2450,29 @@ class Chat:
             for branch, child_id in parent.children.items():
                 if child_id == commit_id:
                     parent.children[branch] = None
+            self._touch(message.parent_id)
 
-        for branch, tip_id in self.branch_tips.items():
-            if tip_id == commit_id:
+        for branch, tip_id in list(self.branch_tips.items()):
+            if tip_id in removed:
                 # if parent is also in the same branch, that's the new tip
-                if self[message.parent_id].home_branch == branch:
+                if (
+                    message.parent_id is not None
+                    and self.messages[message.parent_id].home_branch == branch
+                ):
                     self.branch_tips[branch] = message.parent_id
                 else:
                     del self.branch_tips[branch]
 
-        # Delete the message
-        del self.messages[commit_id]
+        # Delete the messages
+        for msg_id in removed:
+            del self.messages[msg_id]
+        self._touch(*removed)
+        if self.semantic_index is not None:
+            self.semantic_index.remove(removed)
+        if self._ancestry is not None:
+            self._ancestry.forget(removed)
+        if self._tool_results:
+            self._drop_tool_results(removed)
 
         return
 
@@ -1088,14 +2499,22 @@ class Chat:
             f"Are you sure you want to delete {'commit ' + commit_id if commit_id else 'branch ' + branch_name}?"
         ):
             return
-        if commit_id is not None:
-            if branch_name is not None:
-                raise ValueError(
-                    "cannot specify both commit_name and branch_name for rm"
-                )
-            self._rm_commit(commit_id)
-        elif branch_name is not None:
-            self._rm_branch(branch_name)
+        if commit_id is not None and branch_name is not None:
+            raise ValueError("cannot specify both commit_name and branch_name for rm")
+        with self.lock:
+            # move other worktrees off what is being removed, as this checkout is below
+            for cursor in self._cursors():
+                if cursor is not self:
+                    cursor.current_id, cursor.current_branch = (
+                        cursor._check_kalidasa_commit(commit_id)
+                        if commit_id is not None
+                        else cursor._check_kalidasa_branch(branch_name)
+                    )
+            if commit_id is not None:
+                self._rm_commit(commit_id)
+            elif branch_name is not None:
+                self._rm_branch(branch_name)
+            self._lines.clear()
         self.backup()
 
     def mv(self, branch_name_old: str, branch_name_new: str) -> None:
@@ -1105,28 +2524,51 @@ class Chat:
             branch_name_old (str): Name of the branch to rename
             branch_name_new (str): New name for the branch
         """
+        with self.lock:
+            self._mv(branch_name_old, branch_name_new)
+        self.backup()
+
+    def _mv(self, branch_name_old: str, branch_name_new: str) -> None:
         if branch_name_new in self.branch_tips:
             raise ValueError(f"Branch '{branch_name_new}' already exists")
 
+        if branch_name_old in self.branch_tips:
+            # the messages referring to the branch are on its line from where it forks off,
+            # or below that and on the branch
+            line = self._line(branch_name_old)
+            affected = list(
+                walk(
+                    self.messages,
+                    line.ids[min(line.start, len(line) - 1)],
+                    prune=lambda m: m.home_branch != branch_name_old
+                    and branch_name_old not in m.children,
+                )
+            )
+        else:
+            affected = list(self.messages.values())
+
         # Update all references to the branch
-        for msg in self.messages.values():
+        for msg in affected:
             # Update children dict keys
             if branch_name_old in msg.children:
                 msg.children[branch_name_new] = msg.children.pop(branch_name_old)
+                self._touch(msg.id)
 
             # Update home_branch
             if msg.home_branch == branch_name_old:
                 msg.home_branch = branch_name_new
+                self._touch(msg.id)
 
         # Update branch_tips
         if branch_name_old in self.branch_tips:
             self.branch_tips[branch_name_new] = self.branch_tips.pop(branch_name_old)
 
-        # Update current_branch if needed
-        if self.current_branch == branch_name_old:
-            self.current_branch = branch_name_new
+        # Update current_branch if needed, here and in other worktrees
+        for cursor in self._cursors():
+            if cursor.current_branch == branch_name_old:
+                cursor.current_branch = branch_name_new
 
-        self.backup()
+        self._lines.clear()
 
     def find(
         self,
@@ -1163,13 +2605,11 @@ class Chat:
 
         results = []
 
-        # Walk through messages in chronological order from root
-        current_id = self.root_id
-        message_sequence = []
+        # Walk through messages in chronological order from root, along master
+        master = self._line("master").ids
 
-        while current_id is not None:
-            message = self.messages[current_id]
-            message_sequence.append(message)
+        for i, msg_id in enumerate(master):
+            message = self.messages[msg_id]
 
             # Check if message matches search criteria
             if (roles is None or message.message["role"] in roles) and pattern.search(
@@ -1178,25 +2618,70 @@ class Chat:
                 # Get context if requested
                 context_messages = []
                 if context > 0:
-                    start_idx = max(0, len(message_sequence) - context - 1)
-                    end_idx = min(
-                        len(message_sequence) + context, len(message_sequence)
-                    )
-                    context_messages = message_sequence[start_idx:end_idx]
-                    context_messages.remove(
-                        message
-                    )  # Don't include the match itself in context
+                    context_messages = [
+                        self.messages[context_id]
+                        for context_id in master[max(0, i - context) : i]
+                    ]
 
                 results.append({"match": message, "context": context_messages})
 
                 if max_results and len(results) >= max_results:
                     break
 
-            # Move to next message on master branch
-            current_id = message.children.get("master")
-
         return results
 
+    def semantic_search(
+        self,
+        query: str,
+        k: int = 10,
+        *,
+        roles: Optional[list[str]] = None,
+        embed: Optional[Callable[[list[str]], Any]] = None,
+    ) -> list[dict[str, ChitMessage | float]]:
+        """
+        Search all messages, on every branch, for those most similar in meaning to a query.
+
+        Args:
+            query: text to search for
+            k: number of results
+            roles: List of roles to search in ("user", "assistant", "system"). None means all roles.
+            embed: embedding function (a list of texts to one vector each) to use from now
+                on, see chit.semantic; None keeps the current one, initially
+                chit.config.SEMANTIC_EMBEDDER or a local HashingEmbedder
+
+        Returns:
+            List of dicts, most similar first, each containing:
+                - 'match': Message that matched
+                - 'score': cosine similarity of the message to the query
+        """
+        with self.lock, self.profiler.phase("semantic_search"):
+            index = self._semantic_index(embed)
+            with self.profiler.phase("semantic_search.embed"):
+                index.update(self.messages)
+            hits = index.search(query, k, roles)
+            return [
+                {"match": self.messages[i], "score": score}
+                for i, score in hits
+                if i in self.messages
+            ]
+
+    def _semantic_index(self, embed: Optional[Callable] = None) -> SemanticIndex:
+        """The semantic index, loaded from next to the remote or created if there is none
+        yet (or it is for a different embedding function), with every message queued that
+        isn't in it yet."""
+        index = self.semantic_index
+        if index is None or (embed is not None and embed is not index.embed):
+            index = None
+            if self.remote is not None and self.remote.json_file is not None:
+                index = SemanticIndex.load(vectors_path(self.remote.json_file), embed)
+            if index is None:
+                index = SemanticIndex(embed)
+            self.semantic_index = index
+        # e.g. new, saved before messages were removed and others added, or merged
+        if index.rows.keys() | index.pending != self.messages.keys():
+            index.sync(self.messages)
+        return index
+
     def _process_commit_id(self, commit_id: str):
         """Helper function for Chat.log()"""
         commit = self.messages[commit_id]
@@ -1215,55 +2700,39 @@ class Chat:
     def _log_tree_draw_from(self, frontier_id: str, branch_name: str) -> list[str]:
         """Helper function for Chat.log()"""
         log_lines: list[str] = []
-        log_lines.append(self._process_commit_id(frontier_id))
-        frontier: ChitMessage = self.messages[frontier_id]
-
-        horizontal_pos: int = len(log_lines[0])  # position where stuff should be added
-
-        if hasattr(frontier, "heir_id"):
-            log_lines[0] += "──"
-            if frontier.heir_id is None:
-                log_lines[0] += self._process_branch_name(branch_name)
+        # for each message on the path to the one being drawn: [id, its line, the position
+        # where its other branches hang from, the first line still to be connected to that
+        # position, the branch it was reached by]
+        frames: list[list] = []
+        for branch, msg_id, depth in iter_edges(self.messages, frontier_id, branch_name):
+            del frames[depth:]
+            if not frames:  # the frontier itself
+                log_lines.append(self._process_commit_id(msg_id))
+                row = 0
             else:
-                subtree: list[str] = self._log_tree_draw_from(
-                    frontier.heir_id, frontier.home_branch
-                )
-                # we would like to just append subtree to the current log
-                # but it's actually multiple lines that need to get appended
-                # to the right propositions
-                indent: int = len(log_lines[0])
-                log_lines[0] += subtree[0]
-                for subtree_line in subtree[1:]:
-                    log_lines.append(" " * indent + subtree_line)
-
-        for child_branch, child_id in frontier.children.items():
-            if child_branch == frontier.home_branch:
-                # already processed the heir
-                continue
-            else:
-                for i in range(len(log_lines)):
-                    if i == 0:
-                        continue
-                    line = log_lines[i]
-                    if line[horizontal_pos] == "└":  # no longer the final branch
-                        line = line[:horizontal_pos] + "├" + line[horizontal_pos + 1 :]
-                    if line[horizontal_pos] == " ":  # extend
-                        line = line[:horizontal_pos] + "│" + line[horizontal_pos + 1 :]
-                    log_lines[i] = line
-                log_lines.append(" " * horizontal_pos + "└─")
-                if child_id is None:
-                    log_lines[-1] += self._process_branch_name(child_branch)
+                frame = frames[-1]
+                parent_id, parent_row, horizontal_pos, connect_from, parent_branch = frame
+                heir = branch == self.messages[parent_id].home_branch
+                if msg_id is not None:
+                    label = self._process_commit_id(msg_id)
+                else:  # a branch ending at the parent
+                    label = self._process_branch_name(parent_branch if heir else branch)
+                if heir:
+                    log_lines[parent_row] += "──" + label
+                    row = parent_row
                 else:
-                    subtree: list[str] = self._log_tree_draw_from(
-                        child_id, child_branch
-                    )
-                    indent: int = horizontal_pos + 1  # the length of log_lines[-1]
-                    log_lines[-1] += subtree[0]
-                    for subtree_line in subtree[1:]:
-                        log_lines.append(" " * indent + subtree_line)
-
-        # if not frontier.children or all(v is None for v in frontier.children.values()):
-        #     log_lines[0] += self._process_branch_name(branch_name)
+                    for i in range(connect_from, len(log_lines)):
+                        line = log_lines[i]
+                        if line[horizontal_pos] == "└":  # no longer the final branch
+                            line = line[:horizontal_pos] + "├" + line[horizontal_pos + 1 :]
+                        if line[horizontal_pos] == " ":  # extend
+                            line = line[:horizontal_pos] + "│" + line[horizontal_pos + 1 :]
+                        log_lines[i] = line
+                    frame[3] = len(log_lines)
+                    log_lines.append(" " * horizontal_pos + "└─" + label)
+                    row = len(log_lines) - 1
+            if msg_id is not None:
+                frames.append([msg_id, row, len(log_lines[row]), row + 1, branch])
         return log_lines
 
     def _log_tree(self) -> str:
@@ -1296,36 +2765,51 @@ class Chat:
         content_proc = content_proc.replace("\n", r" ").strip()[:57] + "..."
         return content_proc
 
-    def _log_forum_draw_from(self, frontier_id: str) -> list[str]:
+    @staticmethod
+    def _process_telemetry(message: ChitMessage) -> str:
+        """Helper function for Chat.log(): summary of an AI message's telemetry and usage"""
+        if message.telemetry is None:
+            return ""
+        t = message.telemetry
+        parts = [t["model"]]
+        if t.get("cached"):
+            parts.append("from response cache")
+        else:
+            parts.append(f"{t['latency']:.2f}s, ttft {t['ttft']:.2f}s")
+        if message.usage is not None:
+            u = message.usage
+            tokens = f"{u['prompt_tokens']}+{u['completion_tokens']} tok"
+            if u.get("cached_tokens"):
+                tokens += f" ({u['cached_tokens']} cached)"
+            parts.append(tokens)
+        if t.get("cost") is not None:
+            parts.append(f"${t['cost']:.4f}")
+        parts.append(f"{t['history_length']} msgs sent")
+        return " [" + " | ".join(parts) + "]"
+
+    def _log_forum_draw_from(self, frontier_id: str, telemetry: bool = False) -> list[str]:
         log_lines: list[str] = []
-        frontier: ChitMessage = self[frontier_id]
-        log_lines.append(
-            f"{self._process_commit_id(frontier_id)}: {self._process_message_content(frontier.message['content'])}"
-        )
-        # show heir first
-        if hasattr(frontier, "heir_id"):
-            if frontier.heir_id is None:
-                log_lines[0] += self._process_branch_name(frontier.home_branch)
-            else:
-                subtree: list[str] = self._log_forum_draw_from(
-                    frontier.heir_id
-                )  # recurse
-                subtree_ = [" " * 4 + line for line in subtree]  # indent
-                log_lines.extend(subtree_)
-        for child_branch, child_id in frontier.children.items():
-            if child_branch == frontier.home_branch:
-                continue  # already processed the heir
-            elif child_id is None:
-                log_lines.append(" " * 4 + self._process_branch_name(child_branch))
-            else:
-                subtree: list[str] = self._log_forum_draw_from(child_id)  # recurse
-                subtree_ = [" " * 4 + line for line in subtree]  # indent
-                log_lines.extend(subtree_)
-        # if not frontier.children or all(v is None for v in frontier.children.values()):
-        #     log_lines[0] += self._process_branch_name(frontier.home_branch)
+        parents: list[ChitMessage] = []  # the path to the message being drawn
+        for branch, msg_id, depth in iter_edges(self.messages, frontier_id):
+            del parents[depth:]
+            indent = " " * 4 * depth
+            if msg_id is None:
+                if branch == parents[-1].home_branch:
+                    # the heir comes first, so its parent's line is the last one
+                    log_lines[-1] += self._process_branch_name(branch)
+                else:
+                    log_lines.append(indent + self._process_branch_name(branch))
+                continue
+            frontier: ChitMessage = self.messages[msg_id]
+            log_lines.append(
+                f"{indent}{self._process_commit_id(msg_id)}: {self._process_message_content(frontier.message['content'])}"
+            )
+            if telemetry:
+                log_lines[-1] += self._process_telemetry(frontier)
+            parents.append(frontier)
         return log_lines
 
-    def _log_forum(self) -> str:
+    def _log_forum(self, telemetry: bool = False) -> str:
         """
         Generate a forum-style visualization of the conversation history, like this:
 
@@ -1347,7 +2831,7 @@ class Chat:
                         [A] b16327: Since you are working with g... (pypi)
         ```
         """
-        log_lines: list[str] = self._log_forum_draw_from(self.root_id)
+        log_lines: list[str] = self._log_forum_draw_from(self.root_id, telemetry)
         res = "\n".join(log_lines)
         return res
 
@@ -1390,30 +2874,67 @@ class Chat:
         else:
             raise ValueError(f"Invalid mode: {mode}")
 
+    @staticmethod
+    def _prepare_message_for_viz(m: ChitMessage) -> dict[str, Any]:
+        return {
+            "id": m.id,
+            "message": m.message
+            if isinstance(m.message, dict)
+            else m.message.json(),
+            "children": m.children,
+            "parent_id": m.parent_id,
+            "home_branch": m.home_branch,
+            "usage": m.usage,
+            "telemetry": m.telemetry,
+        }
+
     def _prepare_messages_for_viz(self) -> dict[str, Any]:
         """Convert messages to a format suitable for visualization."""
         return {
             "messages": {
-                k: {
-                    "id": m.id,
-                    "message": m.message
-                    if isinstance(m.message, dict)
-                    else m.message.json(),
-                    "children": m.children,
-                    "parent_id": m.parent_id,
-                    "home_branch": m.home_branch,
-                }
-                for k, m in self.messages.items()
+                k: self._prepare_message_for_viz(m) for k, m in self.messages.items()
             },
             "current_id": self.current_id,
             "current_branch": self.current_branch,
             "root_id": self.root_id,
         }
 
+    def _viz_data_str(self) -> str:
+        """Equivalent to json.dumps(self._prepare_messages_for_viz()), except that
+        bodies of lazily-cloned messages are copied over without decoding them."""
+        messages_str = []
+        for k, m in self.messages.items():
+            raw = m.raw_body()
+            if raw is None or raw.startswith(OBJECT_REF):
+                messages_str.append(
+                    json.dumps(k)
+                    + ": "
+                    + json.dumps(self._prepare_message_for_viz(m))
+                )
+            else:
+                structure = json.dumps(
+                    {
+                        "id": m.id,
+                        "children": m.children,
+                        "parent_id": m.parent_id,
+                        "home_branch": m.home_branch,
+                    }
+                )
+                messages_str.append(
+                    json.dumps(k) + ": " + structure[:-1] + ", " + raw.decode() + "}"
+                )
+        rest = json.dumps(
+            {
+                "current_id": self.current_id,
+                "current_branch": self.current_branch,
+                "root_id": self.root_id,
+            }
+        )
+        return '{"messages": {' + ", ".join(messages_str) + "}, " + rest[1:]
+
     def _generate_viz_html(self) -> str:
         """Generate the HTML for visualization."""
-        data = self._prepare_messages_for_viz()
-        data_str = json.dumps(data).replace("</", "<\\/")
+        data_str = self._viz_data_str().replace("</", "<\\/")
 
         self.display_config = getattr(
             self, "display_config", chit.config.DISPLAY_CONFIG
@@ -1425,6 +2946,7 @@ class Chat:
         favicon = self.display_config.get("favicon", "")
         show_model = self.display_config.get("show_model", False)
         show_tools = self.display_config.get("show_tools", False)
+        show_telemetry = self.display_config.get("show_telemetry", False)
         max_tools = self.display_config.get("max_tools", None)
         custom_css = self.display_config.get("css", "")
 
@@ -1603,6 +3125,27 @@ class Chat:
         
         marked.setOptions({{ breaks: true, gfm: true }});
 
+        const showTelemetry = {"true" if show_telemetry else "false"};
+
+        function renderTelemetry(msg) {{
+            const t = msg.telemetry;
+            if (!showTelemetry || !t) return '';
+            const parts = [t.model];
+            if (t.cached) {{
+                parts.push('from response cache');
+            }} else {{
+                parts.push(`${{t.latency.toFixed(2)}}s, ttft ${{t.ttft.toFixed(2)}}s`);
+            }}
+            if (msg.usage) {{
+                let tokens = `${{msg.usage.prompt_tokens}}+${{msg.usage.completion_tokens}} tok`;
+                if (msg.usage.cached_tokens) tokens += ` (${{msg.usage.cached_tokens}} cached)`;
+                parts.push(tokens);
+            }}
+            if (t.cost !== null && t.cost !== undefined) parts.push(`$${{t.cost.toFixed(4)}}`);
+            parts.push(`${{t.history_length}} msgs sent`);
+            return `<span class="telemetry"> · ${{parts.join(' | ')}}</span>`;
+        }}
+
         function renderContent(content) {{
             if (typeof content === 'string') return marked.parse(content);
             
@@ -1714,7 +3257,7 @@ class Chat:
                 
                 div.innerHTML = `
                     <div class="message-header">
-                        <span>${{msg.message.role}} (${{msg.id}})</span>
+                        <span>${{msg.message.role}} (${{msg.id}})</span>${{renderTelemetry(msg)}}
                     </div>
                     <div class="message-content">
                         ${{renderContent(msg.message.content)}}
@@ -1885,6 +3428,7 @@ class Chat:
         self,
         style: Literal["tree", "forum", "gui"] = "tree",
         mode: Literal["print", "return", "print_md"] = None,
+        telemetry: bool = False,
     ) -> None | str:
         """
         Generate a visualization of the conversation history.
@@ -1926,24 +3470,27 @@ class Chat:
         Args:
             style (str): Style of visualization ("tree", "forum", "gui")
             mode (str): Whether to print the visualization or return it as a string"
+            telemetry (bool): for style="forum", show the model, latency, token usage and
+                cost of each AI message (for the gui, see display_config["show_telemetry"])
         """
         mode = mode or chit.config.DEFAULT_MODE
-        if mode in ["print", "print_md"]: # no special markdown rendering
-            if style == "tree":
-                print(self._log_tree())
-            elif style == "forum":
-                print(self._log_forum())
-            elif style == "gui":
-                self.gui()
-        elif mode == "return":
-            if style == "tree":
-                return self._log_tree()
-            elif style == "forum":
-                return self._log_forum()
-            elif style == "gui":
-                return self.gui(mode="return")
-        else:
-            raise ValueError(f"Invalid mode {mode}")
+        with self.lock:
+            if mode in ["print", "print_md"]: # no special markdown rendering
+                if style == "tree":
+                    print(self._log_tree())
+                elif style == "forum":
+                    print(self._log_forum(telemetry))
+                elif style == "gui":
+                    self.gui()
+            elif mode == "return":
+                if style == "tree":
+                    return self._log_tree()
+                elif style == "forum":
+                    return self._log_forum(telemetry)
+                elif style == "gui":
+                    return self.gui(mode="return")
+            else:
+                raise ValueError(f"Invalid mode {mode}")
 
     @classmethod
     def migrate(cls, json_file: str, format: Literal["claude"] = "claude") -> "Chat":
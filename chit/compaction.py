@@ -0,0 +1,105 @@
+"""Compaction of long histories into summaries.
+
+With `chit.config.COMPACT_SEGMENT` set, the history sent for an AI response is cut down to
+the system message, a summary of everything up to some earlier message, and the most
+recent messages after it (at least chit.config.COMPACT_KEEP of them) in full. The
+summaries are made in the background, by the model, one segment at a time: the summary up
+to a message is the summary up to the previous segment boundary plus the messages since,
+so no single summarization request grows with the length of the branch.
+
+Segments end at fixed depths (multiples of COMPACT_SEGMENT, moved back if need be so that
+tool results aren't separated from their calls), so every branch through the same
+messages has the same boundaries. A summary is stored on the message it summarizes up to
+(ChitMessage.summary) and so is shared by every branch below it, and saved with the chat;
+the summarized messages themselves stay in the tree untouched.
+
+Until a boundary's summary is ready, commits use the latest summary that is, or the full
+history if there is none yet.
+"""
+
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from chit.chit import ChitMessage
+
+SUMMARY_PROMPT = (
+    "You are compacting a long conversation so that it can be continued without its "
+    "earlier part. Summarize the conversation below concisely, as notes rather than as a "
+    "dialogue, keeping every fact, decision, instruction, open question, name, number and "
+    "piece of code that later turns may depend on."
+)
+
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+
+
+def _text(message: dict) -> str:
+    content = message.get("content")
+    if content is None or isinstance(content, str):
+        return content or ""
+    return "".join(
+        item["text"] if item["type"] == "text" else "[image]" for item in content
+    )
+
+
+def _as_dict(message) -> dict:
+    return message if isinstance(message, dict) else message.json()
+
+
+def transcript(messages: list["ChitMessage"]) -> str:
+    """Plain text rendering of messages, for the model to summarize."""
+    lines = []
+    for msg in messages:
+        m = _as_dict(msg.message)
+        role = m["role"]
+        if role == "tool":
+            lines.append(f"Tool result ({m.get('name')}): {_text(m)}")
+            continue
+        text = _text(m)
+        if text:
+            lines.append(f"{role.capitalize()}: {text}")
+        for tool_call in map(_as_dict, msg.tool_calls or []):
+            function = tool_call["function"]
+            lines.append(f"{role.capitalize()} called {function['name']}({function['arguments']})")
+    return "\n\n".join(lines)
+
+
+def summary_request(previous: Optional[str], messages: list["ChitMessage"]) -> list[dict]:
+    """The messages asking for a summary of a segment, given the summary before it."""
+    prompt = ""
+    if previous:
+        prompt += f"Summary of the conversation before this part:\n{previous}\n\n"
+    prompt += f"Conversation:\n{transcript(messages)}"
+    return [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def with_summary(system_message, summary: str):
+    """The system message with a summary of the earlier conversation appended."""
+    message = dict(_as_dict(system_message))
+    addition = f"\n\n{SUMMARY_HEADER}\n{summary}"
+    content = message.get("content")
+    if isinstance(content, list):
+        message["content"] = list(content) + [{"type": "text", "text": addition}]
+    else:
+        message["content"] = (content or "") + addition
+    return message
+
+
+def boundaries(
+    messages: dict[str, "ChitMessage"], history_ids: list[str], segment: int, keep: int
+) -> list[int]:
+    """Positions in a history (root first) at which segments end, up to the last one that
+    leaves at least `keep` messages after it. A boundary at a multiple of `segment` is moved
+    back while the message after it is a tool result."""
+    points = []
+    for b in range(segment, len(history_ids) - keep, segment):
+        while (
+            0 < b < len(history_ids) - 1
+            and messages[history_ids[b + 1]].message["role"] == "tool"
+        ):
+            b -= 1
+        if b > 0 and (not points or b > points[-1]):
+            points.append(b)
+    return points
@@ -47,6 +47,7 @@ DISPLAY_CONFIG = {
     "show_model": True,
     "show_tools": True,
     "max_tools": 5,
+    "show_telemetry": False,
     "dark": True,
     "css": ""
 }
@@ -64,4 +65,216 @@ DEFAULT_MODE: Literal["print", "return", "print_md"] = "print_md"
 """
 default: "print_md""
 Default behaviour of functions: return, print, or print as markdown?
-"""
\ No newline at end of file
+"""
+
+LAZY_CLONE = False
+"""
+default: False
+whether Chat.clone should only load the structure of the chat tree, decoding each message
+from the remote when it is first accessed. Much faster for resuming large chats.
+"""
+
+JSONL_COMPACT_DEPTH = 256
+"""
+default: 256
+number of appending pushes to a .jsonl remote after which the next push rewrites it in full,
+dropping superseded lines and bounding the number of headers read on clone.
+"""
+
+PROMPT_CACHING = True
+"""
+default: True
+for models that need prompt caching to be requested explicitly (Anthropic models), mark the
+system message, the latest branch fork points and the end of the history as cacheable prefixes,
+so that repeated and sibling-branch commits reuse the provider's cache.
+"""
+
+RESPONSE_CACHE: str | None = None
+"""
+default: None
+directory to cache AI responses in, keyed by a hash of the model, message history and tools.
+Identical requests (e.g. when re-running a notebook) are then answered from the cache
+instantly, with streaming output simulated. None disables the cache.
+"""
+
+RESPONSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+"""
+default: 256 MiB
+size bound of the response cache; least recently used responses are evicted beyond this.
+"""
+
+RESPONSE_CACHE_OFFLINE = False
+"""
+default: False
+raise an error on a response cache miss instead of calling the provider, e.g. to run
+notebooks in CI against a committed cache.
+"""
+
+CONTEXT_RESERVE = 4096
+"""
+default: 4096
+number of tokens of the model's context window to leave free for the response when
+committing with history_tokens="auto".
+"""
+
+COMPACT_SEGMENT: int | None = None
+"""
+default: None
+compact long histories: summarize the history in the background, this many messages at a
+time, and send AI requests the latest summary plus the messages after it rather than the
+whole history (see chit.compaction). Applies to commits without history_length or
+history_tokens. None disables compaction.
+"""
+
+COMPACT_KEEP = 20
+"""
+default: 20
+minimum number of most recent messages to send in full, rather than summarized, when
+compacting the history.
+"""
+
+COMPACT_MODEL: str | None = None
+"""
+default: None
+model to write history summaries with; None uses the chat's model.
+"""
+
+SEMANTIC_EMBEDDER = None
+"""
+default: None
+embedding function for Chat.semantic_search(): takes a list of texts and returns one vector
+per text, e.g. chit.semantic.litellm_embedder("text-embedding-3-small"). None uses a local
+chit.semantic.HashingEmbedder, which needs no model but only matches shared words.
+"""
+
+SEMANTIC_DIM = 256
+"""
+default: 256
+number of dimensions of the vectors the default HashingEmbedder makes.
+"""
+
+STREAM_RENDER_INTERVAL_MS = 100
+"""
+default: 100
+minimum time between re-renders of a response streamed with mode="print_md". Completed
+paragraphs and code blocks are rendered once and then left alone; only the unfinished
+tail of the response is re-rendered.
+"""
+
+EAGER_TOOLS = False
+"""
+default: False
+start running each tool the assistant calls as soon as its arguments have finished streaming,
+rather than when its result is committed with .commit(). Only enable this if your tools are
+safe to run even if you end up not committing their results.
+"""
+
+REQUEST_TIMEOUT: float | None = None
+"""
+default: None
+seconds to wait for the provider to answer a completion request (for a streamed response,
+to send its first chunk) before giving up on it -- and retrying, falling back or failing,
+per the settings below. None waits indefinitely. See chit.policy.
+"""
+
+REQUEST_RETRIES = 0
+"""
+default: 0
+number of times to retry a completion request that timed out or failed with a transient
+error (rate limit, connection error, server error), waiting with exponential backoff.
+"""
+
+RETRY_BACKOFF = 1.0
+"""
+default: 1.0
+seconds to wait (at most, with random jitter) before the first retry, doubling for each
+further retry up to 60 seconds.
+"""
+
+FALLBACK_MODELS: list[str] = []
+"""
+default: []
+models to try in turn, with their own retries, if a completion request to the chat's model
+still fails after its retries.
+"""
+
+HEDGE_AFTER: float | None = None
+"""
+default: None
+seconds after which a completion request that hasn't answered yet is hedged: a second
+request is sent to HEDGE_MODEL, and whichever answers first is used. Set to around the
+usual 95th percentile latency to cut the tail. None disables hedging.
+"""
+
+HEDGE_MODEL: str | None = None
+"""
+default: None
+model to send hedging requests to. None uses the first of FALLBACK_MODELS, or if there
+are none, the chat's model.
+"""
+
+RATE_LIMITS: dict[str, dict[str, int]] = {}
+"""
+default: {}
+providers' rate limits, per model (or fnmatch pattern of models), as requests and/or tokens
+per minute, e.g. {"gpt-4o": {"rpm": 500, "tpm": 30_000}, "openrouter/anthropic/*": {"rpm": 50}}.
+All completion requests in the process to these models are then queued so as to stay
+within them; see chit.scheduler. Requests to other models are sent straight away.
+"""
+
+RATE_LIMIT_OUTPUT_TOKENS = 1024
+"""
+default: 1024
+tokens to expect a response to take, on top of the prompt, when estimating a request's
+tokens against a tokens-per-minute limit (corrected once its actual usage is known).
+"""
+
+PROFILE = False
+"""
+default: False
+record phase timers and counters (see Chat.stats() and Chat.dump_trace()) for every chat.
+"""
+
+PROFILE_MAX_EVENTS = 100_000
+"""
+default: 100_000
+number of most recent timed spans each chat keeps for Chat.dump_trace().
+"""
+
+CONTENT_IDS = False
+"""
+default: False
+derive the id of each new message from its content and its parent's id (a Merkle hash),
+rather than at random, so that chats built from the same messages share ids and can be
+compared by id (see Chat.compare()).
+"""
+
+CONTENT_ID_LENGTH = 16
+"""
+default: 16
+number of hex digits in content-derived message ids.
+"""
+
+OBJECT_STORE = None
+"""
+default: None
+Set to a directory to have push() store message contents there, once per distinct
+content, with remotes only referring to them by hash. Chats that share messages, e.g. the
+same system prompt and opening turns, then share their storage. Best used together with
+CONTENT_IDS.
+"""
+
+MULTI_WRITER = False
+"""
+default: False
+allow several processes to push to the same remote: pushes hold an advisory lock on the
+remote, and merge in whatever other writers pushed since this chat last cloned or pushed,
+rather than overwriting it. Set before creating or cloning chats.
+"""
+
+WORKSPACE_MAX_BYTES = 1024 * 1024 * 1024
+"""
+default: 1 GiB
+bound on the total size of the chats a chit.Workspace keeps loaded, as estimated by the size
+of their remotes; least recently used chats are pushed back (if changed) and unloaded beyond this.
+"""
@@ -0,0 +1,92 @@
+"""Choosing which part of a branch's history to send to the model.
+
+`commit(history_length=k)` simply sends the last k messages. `commit(history_tokens=n)`
+instead sends the longest recent part of the history that fits in n tokens, while always
+keeping the system message and never separating an assistant's tool calls from their
+results. Token counts are computed with litellm's token counter and cached on each
+ChitMessage (per model), so each message is only ever tokenized once.
+"""
+
+from typing import TYPE_CHECKING
+import litellm
+import chit.config
+
+if TYPE_CHECKING:
+    from chit.chit import ChitMessage
+
+
+def _as_dict(message) -> dict:
+    if isinstance(message, dict):
+        return message
+    return {k: v for k, v in message.json().items() if v is not None}
+
+
+def count_tokens(msg: "ChitMessage", model: str) -> int:
+    """Number of prompt tokens a message takes up for a model (cached on the message)."""
+    if msg.n_tokens is None:
+        msg.n_tokens = {}
+    if model not in msg.n_tokens:
+        msg.n_tokens[model] = litellm.token_counter(
+            model=model,
+            messages=[_as_dict(msg.message)],
+            use_default_image_token_count=True,  # don't download images to count them
+        )
+    return msg.n_tokens[model]
+
+
+def context_budget(model: str) -> int:
+    """Default token budget for the history sent to a model: its input context window,
+    less chit.config.CONTEXT_RESERVE tokens kept free for the response."""
+    try:
+        max_input_tokens = litellm.get_model_info(model)["max_input_tokens"]
+    except Exception:
+        max_input_tokens = None
+    if not max_input_tokens:
+        raise ValueError(
+            f"Context window of {model} is unknown to litellm; "
+            "pass history_tokens as an integer instead"
+        )
+    return max_input_tokens - chit.config.CONTEXT_RESERVE
+
+
+def _units(messages: list["ChitMessage"]) -> list[list[int]]:
+    """Group positions in the history into units that must be sent together: each
+    message along with any tool results that follow it."""
+    units: list[list[int]] = []
+    for i, msg in enumerate(messages):
+        if units and msg.message["role"] == "tool":
+            units[-1].append(i)
+        else:
+            units.append([i])
+    return units
+
+
+def token_window(
+    messages: list["ChitMessage"], budget: int, model: str
+) -> list["ChitMessage"]:
+    """The largest suffix of the history (plus the system message, if it starts with one)
+    that fits in the token budget, without splitting tool calls from their results.
+
+    The most recent message (with its tool results) is always included, even if it alone
+    exceeds the budget.
+
+    Arguments:
+        messages (list[ChitMessage]): history, from root to the current message
+        budget (int): maximum number of prompt tokens
+        model (str): model to count tokens for
+    """
+    if not messages:
+        return messages
+    head: list[int] = []
+    if messages[0].message["role"] == "system":
+        head = [0]
+        budget -= count_tokens(messages[0], model)
+    units = _units(messages[len(head) :])
+    kept: list[int] = []
+    for n, unit in enumerate(reversed(units)):
+        cost = sum(count_tokens(messages[len(head) + i], model) for i in unit)
+        if cost > budget and n > 0:
+            break
+        budget -= cost
+        kept = [len(head) + i for i in unit] + kept
+    return [messages[i] for i in head + kept]
@@ -0,0 +1,115 @@
+"""Side-by-side rendering of the difference between two branches (or messages).
+
+Chat.diff(a, b) finds the fork point of a and b with the ancestor index (chit.ancestry)
+and gives the messages each side has since then; the functions here lay those out in two
+columns, message against message by position after the fork, as plain text or as an HTML
+table. Both make one pass over the messages shown and build the output with a single
+join, so they stay fast however deep the branches are; text output also cuts each
+message down to a few lines.
+"""
+
+import html
+import textwrap
+from itertools import zip_longest
+from typing import TYPE_CHECKING, Optional
+from chit.semantic import message_text
+
+if TYPE_CHECKING:
+    from chit.chit import ChitMessage
+
+
+def _header(message: "ChitMessage") -> str:
+    return f"[{message.message['role'][0].upper()}] {message.id}"
+
+
+def _wrap(message: "ChitMessage", width: int, max_lines: int) -> list[str]:
+    """A message's header and text, wrapped to width and cut to max_lines of text."""
+    lines = []
+    # no more of the text than could fit, so that long messages cost no more to wrap
+    for paragraph in message_text(message)[: (max_lines + 1) * width].splitlines():
+        lines.extend(textwrap.wrap(paragraph, width) or [""])
+        if len(lines) > max_lines:
+            break
+    if len(lines) > max_lines:
+        lines = lines[:max_lines]
+        lines[-1] = lines[-1][: width - 1] + "…"
+    return [_header(message)[:width]] + lines
+
+
+def side_by_side_text(
+    diff: dict,
+    labels: tuple[str, str] = ("a", "b"),
+    width: int = 120,
+    max_lines: int = 4,
+) -> str:
+    """
+    Two columns of plain text: the messages since the fork on each side.
+
+    Arguments:
+        diff (dict): as returned by Chat.diff()
+        labels (tuple): headings of the two columns
+        width (int): total width in characters
+        max_lines (int): lines of text to show per message
+    """
+    col = max((width - 3) // 2, 10)
+    out = [f"merge base: {_header(diff['merge_base'])}"]
+    for message in diff["context"]:
+        out.extend("  " + line for line in _wrap(message, width - 2, max_lines))
+    a, b = diff["a"], diff["b"]
+    out.append("")
+    out.append(f"{labels[0][:col]:<{col}} | {labels[1][:col]}")
+    out.append(f"{'-' * col}-+-{'-' * col}")
+    for left, right in zip_longest(a, b):
+        left_lines = _wrap(left, col, max_lines) if left is not None else []
+        right_lines = _wrap(right, col, max_lines) if right is not None else []
+        for l, r in zip_longest(left_lines, right_lines, fillvalue=""):
+            out.append(f"{l:<{col}} | {r}".rstrip())
+        out.append(f"{' ' * col} |")
+    out.append(f"{len(a)} messages only in {labels[0]}, {len(b)} only in {labels[1]}")
+    return "\n".join(out)
+
+
+_STYLE = """
+table.chit-diff { border-collapse: collapse; width: 100%; table-layout: fixed; font-family: sans-serif; font-size: 13px; }
+table.chit-diff th, table.chit-diff td { border: 1px solid #ddd; padding: 6px; vertical-align: top; }
+table.chit-diff td { white-space: pre-wrap; word-wrap: break-word; }
+table.chit-diff td.common { background: #f6f6f6; }
+table.chit-diff td.a { background: #fff5f5; }
+table.chit-diff td.b { background: #f3fff3; }
+table.chit-diff td.empty { background: #fafafa; }
+table.chit-diff .id { color: #888; font-family: monospace; display: block; }
+"""
+
+
+def _cell(message: Optional["ChitMessage"], css_class: str, colspan: int = 1) -> str:
+    if message is None:
+        return '<td class="empty"></td>'
+    span = f' colspan="{colspan}"' if colspan > 1 else ""
+    return (
+        f'<td class="{css_class}"{span}><span class="id">{html.escape(_header(message))}</span>'
+        f"{html.escape(message_text(message))}</td>"
+    )
+
+
+def side_by_side_html(diff: dict, labels: tuple[str, str] = ("a", "b")) -> str:
+    """
+    An HTML table of two columns: the messages since the fork on each side, below the
+    context messages (or else the merge base) across both.
+
+    Arguments:
+        diff (dict): as returned by Chat.diff()
+        labels (tuple): headings of the two columns
+    """
+    a, b = diff["a"], diff["b"]
+    rows = [
+        f"<style>{_STYLE}</style>",
+        '<table class="chit-diff">',
+        f"<tr><th>{html.escape(labels[0])} ({len(a)})</th>"
+        f"<th>{html.escape(labels[1])} ({len(b)})</th></tr>",
+    ]
+    for message in diff["context"] or [diff["merge_base"]]:
+        rows.append(f"<tr>{_cell(message, 'common', colspan=2)}</tr>")
+    for left, right in zip_longest(a, b):
+        rows.append(f"<tr>{_cell(left, 'a')}{_cell(right, 'b')}</tr>")
+    rows.append("</table>")
+    return "\n".join(rows)
@@ -0,0 +1,197 @@
+"""Export of chat trees as conversation datasets, e.g. for fine-tuning or evals.
+
+Every root-to-leaf path of a chat becomes one conversation, written as one line of JSONL in
+the OpenAI chat format (`{"messages": [{"role": ..., "content": ...}, ...]}`) or the
+ShareGPT format (`{"conversations": [{"from": ..., "value": ...}, ...]}`).
+
+The paths are enumerated by a single depth-first walk (chit.traversal.iter_paths), and each
+message is converted and encoded only once, when the walk first reaches it; paths sharing a
+prefix reuse its encoding. Lines are written as they are produced, so exporting needs memory
+for one path rather than for the dataset.
+
+`export_remotes` exports many chats at once, cloning and exporting each in a worker process
+and concatenating their output in order.
+"""
+
+import os
+import json
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, TYPE_CHECKING, Any, Callable, Literal, Optional
+from chit.lines import MessageView
+from chit.traversal import iter_paths
+
+if TYPE_CHECKING:
+    from chit.chit import ChitMessage, Remote
+
+FORMATS = ("openai", "sharegpt")
+
+# the members of a message that the OpenAI fine-tuning format has
+OPENAI_KEYS = ("role", "content", "name", "tool_calls", "tool_call_id")
+
+SHAREGPT_ROLES = {"system": "system", "user": "human", "assistant": "gpt", "tool": "observation"}
+
+_WRAPPERS = {
+    "openai": ('{"messages": [', "]}\n"),
+    "sharegpt": ('{"conversations": [', "]}\n"),
+}
+
+
+def _as_dict(message: Any) -> dict:
+    return message if isinstance(message, dict) else message.json()
+
+
+def _tool_calls(message: dict) -> list[dict]:
+    return [
+        {
+            "id": tool_call["id"],
+            "type": tool_call.get("type", "function"),
+            "function": {
+                "name": tool_call["function"]["name"],
+                "arguments": tool_call["function"]["arguments"],
+            },
+        }
+        for tool_call in map(_as_dict, message.get("tool_calls") or [])
+    ]
+
+
+def _text(content: str | list[dict] | None) -> str:
+    """Text of a message's content, with images replaced by <image>."""
+    if content is None or isinstance(content, str):
+        return content or ""
+    return "".join(
+        item["text"] if item["type"] == "text" else "<image>" for item in content
+    )
+
+
+def openai_message(message: dict) -> dict:
+    """A message as it appears in the OpenAI chat (fine-tuning) format."""
+    message = _as_dict(message)
+    converted = {k: message[k] for k in OPENAI_KEYS if message.get(k) is not None}
+    converted.setdefault("content", None)
+    if "tool_calls" in converted:
+        converted["tool_calls"] = _tool_calls(message)
+    return converted
+
+
+def sharegpt_turns(message: dict) -> list[dict]:
+    """The turns of the ShareGPT format for a message: one, plus one "function_call" turn
+    per tool call of an AI message."""
+    message = _as_dict(message)
+    turns = []
+    text = _text(message.get("content"))
+    tool_calls = _tool_calls(message)
+    if text or not tool_calls:
+        turns.append({"from": SHAREGPT_ROLES.get(message["role"], message["role"]), "value": text})
+    for tool_call in tool_calls:
+        function = tool_call["function"]
+        try:
+            arguments = json.loads(function["arguments"])
+        except (TypeError, ValueError):
+            arguments = function["arguments"]
+        turns.append(
+            {
+                "from": "function_call",
+                "value": json.dumps({"name": function["name"], "arguments": arguments}),
+            }
+        )
+    return turns
+
+
+def _encode(message: "ChitMessage", format: str, roles: Optional[list[str]]) -> str:
+    """The encoded turns of a message, "" if it is left out."""
+    if roles is not None and message.message["role"] not in roles:
+        return ""
+    if format == "openai":
+        return json.dumps(openai_message(message.message))
+    return ", ".join(json.dumps(turn) for turn in sharegpt_turns(message.message))
+
+
+def write_paths(
+    f: IO[str],
+    messages: dict[str, "ChitMessage"],
+    start_id: str,
+    format: Literal["openai", "sharegpt"] = "openai",
+    branches: Optional[list[str]] = None,
+    roles: Optional[list[str]] = None,
+    where: Optional[Callable[[MessageView], bool]] = None,
+    prune: Optional[Callable[["ChitMessage"], bool]] = None,
+) -> int:
+    """Write the paths from the start message to each leaf below it to a file, one
+    conversation per line. See Chat.export_paths for the arguments. Returns the number of
+    conversations written."""
+    if format not in FORMATS:
+        raise ValueError(f"Invalid format {format}, must be one of {FORMATS}")
+    head, tail = _WRAPPERS[format]
+    ids: list[str] = []  # the path whose messages are encoded in `encoded`
+    encoded: list[str] = []
+    n = 0
+    for path in iter_paths(messages, start_id, prune):
+        leaf = messages[path[-1]]
+        if branches is not None and leaf.home_branch not in branches:
+            continue
+        if where is not None and not where(MessageView(messages, path)):
+            continue
+        common = 0
+        while common < min(len(ids), len(path)) and ids[common] == path[common]:
+            common += 1
+        del ids[common:], encoded[common:]
+        for msg_id in path[common:]:
+            ids.append(msg_id)
+            encoded.append(_encode(messages[msg_id], format, roles))
+        f.write(head + ", ".join(turns for turns in encoded if turns) + tail)
+        n += 1
+    return n
+
+
+def _export_remote(
+    remote: "str | Remote", part_path: str, format: str, filters: dict[str, Any]
+) -> int:
+    from chit.chit import Chat
+
+    chat = Chat.clone(remote)
+    with open(part_path, "w", encoding="utf-8") as f:
+        return write_paths(f, chat.messages, chat.root_id, format, **filters)
+
+
+def export_remotes(
+    remotes: list["str | Remote"],
+    path: str,
+    format: Literal["openai", "sharegpt"] = "openai",
+    processes: int | None = None,
+    **filters,
+) -> int:
+    """
+    Export the root-to-leaf paths of many chats to one JSONL file, cloning and exporting the
+    chats in a pool of worker processes.
+
+    Arguments:
+        remotes (list): the remotes to clone the chats from, as taken by Chat.clone
+        path (str): file to write
+        format (str): "openai" or "sharegpt"
+        processes (int | None): number of worker processes; defaults to the number of CPUs
+        **filters: branches, roles, where and prune, as for Chat.export_paths. where and
+            prune must be picklable, i.e. functions defined at the top level of a module
+
+    Returns:
+        int: number of conversations written
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Invalid format {format}, must be one of {FORMATS}")
+    parts = [f"{path}.{i}.part" for i in range(len(remotes))]
+    n = 0
+    try:
+        with ProcessPoolExecutor(processes) as pool, open(path, "w", encoding="utf-8") as out:
+            counts = pool.map(
+                _export_remote, remotes, parts, [format] * len(remotes), [filters] * len(remotes)
+            )
+            for part, count in zip(parts, counts):  # in order, as each chat is done
+                with open(part, encoding="utf-8") as f:
+                    shutil.copyfileobj(f, out)
+                os.remove(part)
+                n += count
+    finally:
+        for part in parts:  # left over if a chat failed
+            if os.path.exists(part):
+                os.remove(part)
+    return n
@@ -0,0 +1,112 @@
+"""Positional index of the lines of a chat tree.
+
+The line of a branch is the path of messages from the root to the branch's tip. `chat[k]`,
+`chat.checkout(k)` and friends address messages by their position on the master line (and
+`chat[-k]` by position on the current line), and `chat[["b", "b", ...]]` walks along the
+line of branch b; rather than walking the tree for every such lookup, a Chat keeps the
+lines it has looked up so far as `Line`s, extended in place by commits and rebuilt when
+the tree changes otherwise.
+"""
+
+from collections.abc import Sequence
+from typing import TYPE_CHECKING, Iterator
+
+if TYPE_CHECKING:
+    from chit.chit import ChitMessage
+
+
+class Line:
+    """The ids of the messages on the line of a branch, in order from the root, and their
+    positions. Messages from position `start` on have the branch among their children,
+    i.e. they can be walked to along the branch with `chat[[branch, ...]]`."""
+
+    __slots__ = ("branch", "ids", "pos", "start")
+
+    def __init__(self, branch: str, messages: dict[str, "ChitMessage"], tip_id: str):
+        ids = []
+        start = None
+        current = tip_id
+        while current is not None:
+            msg = messages[current]
+            if start is None and branch not in msg.children:
+                start = len(ids)  # counted from the tip, for now
+            ids.append(current)
+            current = msg.parent_id
+        ids.reverse()
+        self.branch = branch
+        self.ids = ids
+        self.pos = {msg_id: i for i, msg_id in enumerate(ids)}
+        self.start = 0 if start is None else len(ids) - start
+
+    def append(self, msg_id: str) -> None:
+        self.pos[msg_id] = len(self.ids)
+        self.ids.append(msg_id)
+
+    @property
+    def tip(self) -> str:
+        return self.ids[-1]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return f"Line({self.branch}, {len(self.ids)} messages)"
+
+
+class MessageView(Sequence):
+    """Read-only view of a run of messages, e.g. a slice of a chat: a list of ids whose
+    messages are only looked up (and, for lazily cloned chats, loaded) when accessed.
+
+    Supports len(), indexing, slicing (giving another view), iteration and comparison
+    with lists; use list(view) to get a list of ChitMessages.
+    """
+
+    __slots__ = ("_messages", "_ids", "_start", "_stop")
+
+    def __init__(
+        self,
+        messages: dict[str, "ChitMessage"],
+        ids: list[str],
+        start: int = 0,
+        stop: int | None = None,
+    ):
+        self._messages = messages
+        self._ids = ids  # not copied: may be a Line's ids, which only ever get appended to
+        self._start = start
+        self._stop = len(ids) if stop is None else stop
+
+    def __len__(self) -> int:
+        return max(self._stop - self._start, 0)
+
+    def __getitem__(self, i: int | slice) -> "ChitMessage | MessageView":
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                return [self[j] for j in range(start, stop, step)]
+            return MessageView(
+                self._messages, self._ids, self._start + start, self._start + max(stop, start)
+            )
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("MessageView index out of range")
+        return self._messages[self._ids[self._start + i]]
+
+    def __iter__(self) -> Iterator["ChitMessage"]:
+        for j in range(self._start, self._stop):
+            yield self._messages[self._ids[j]]
+
+    @property
+    def ids(self) -> list[str]:
+        return self._ids[self._start : self._stop]
+
+    def __eq__(self, other):
+        if isinstance(other, MessageView):
+            return self.ids == other.ids and self._messages is other._messages
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"MessageView({self.ids})"
@@ -0,0 +1,123 @@
+"""Content-addressed message ids and a shared store of message contents.
+
+With `chit.config.CONTENT_IDS`, the id of a new message is a hash of its content (message
+and tool calls) and its parent's id, Merkle-style, rather than random. Messages with the
+same id in any two chats then have the same content *and* the same history, so comparing
+trees (see `Chat.compare`) only means comparing ids; e.g. two chats cloned from the same
+template share ids up to where they diverge.
+
+With `chit.config.OBJECT_STORE` set to a directory, `push()` writes the contents of messages
+to that directory, one file per distinct content, and the remote only refers to them by
+hash. Identical messages (the same system prompt and onboarding turns in hundreds of
+chats) are then stored once, however many chats and remotes they appear in. Usage and
+telemetry, which differ between otherwise identical AI responses, stay in the remote.
+"""
+
+import os
+import json
+import hashlib
+from typing import Any
+import chit.config
+
+# the part of a message's body that is content-addressed; see ChitMessage.BODY_FIELDS
+CONTENT_FIELDS = ("message", "tool_calls")
+
+# how an encoded body (see chit.storage.encode_body) that refers to the store begins
+OBJECT_REF = b'"object": '
+
+
+def _encode(content: dict[str, Any]) -> bytes:
+    return json.dumps(content, sort_keys=True, separators=(",", ":")).encode()
+
+
+def content_hash(content: dict[str, Any]) -> str:
+    """sha256 of a message's content, i.e. its CONTENT_FIELDS as in ChitMessage.asdict()."""
+    return hashlib.sha256(_encode(content)).hexdigest()
+
+
+def content_id(
+    content: dict[str, Any], parent_id: str | None, salt: int = 0, length: int | None = None
+) -> str:
+    """Merkle id of a message: a hash of its content and its parent's id.
+
+    Arguments:
+        content (dict): the message's CONTENT_FIELDS, as in ChitMessage.asdict()
+        parent_id (str | None): id of the parent message
+        salt (int): to tell apart identical messages with the same parent, e.g. the same
+            prompt committed on two branches
+        length (int | None): number of hex digits. Defaults to chit.config.CONTENT_ID_LENGTH
+    """
+    length = length or chit.config.CONTENT_ID_LENGTH
+    h = hashlib.sha256(content_hash(content).encode())
+    h.update(b"\0" + (parent_id or "").encode())
+    if salt:
+        h.update(b"\0" + str(salt).encode())
+    return h.hexdigest()[:length]
+
+
+class ObjectStore:
+    """Directory of message contents, each stored once under its content hash.
+
+    Stores are shared by every chat in the process that uses the same directory; get
+    them with `ObjectStore.open(directory)`.
+    """
+
+    _open: dict[str, "ObjectStore"] = {}
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._known: set[str] = set()  # hashes known to be in the store
+
+    @classmethod
+    def open(cls, directory: str) -> "ObjectStore":
+        key = os.path.abspath(directory)
+        if key not in cls._open:
+            cls._open[key] = cls(directory)
+        return cls._open[key]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key[2:] + ".json")
+
+    def __contains__(self, key: str) -> bool:
+        if key in self._known:
+            return True
+        if os.path.exists(self._path(key)):
+            self._known.add(key)
+            return True
+        return False
+
+    def put(self, content: dict[str, Any]) -> str:
+        """Store a message's content, if not already stored, and return its hash."""
+        data = _encode(content)
+        key = hashlib.sha256(data).hexdigest()
+        if key not in self:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self._known.add(key)
+        return key
+
+    def get(self, key: str) -> dict[str, Any]:
+        with open(self._path(key), "rb") as f:
+            return json.loads(f.read())
+
+    def __repr__(self):
+        return f"ObjectStore({self.directory})"
+
+
+def resolve_body(body: dict[str, Any], object_store: str | None) -> dict[str, Any]:
+    """A message body as read from a remote, with its content fetched from the object
+    store if the remote only refers to it by hash."""
+    if "object" not in body:
+        return body
+    if object_store is None:
+        raise ValueError(
+            f"Message content {body['object']} is in an object store, "
+            "but the remote does not say which"
+        )
+    body = dict(body)
+    return body | ObjectStore.open(object_store).get(body.pop("object"))
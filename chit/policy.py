@@ -0,0 +1,245 @@
+"""Timeouts, retries, fallback models and hedging for completion requests.
+
+A `RequestPolicy` wraps the call to the provider that Chat.commit makes for an AI response:
+
+- each attempt gets `timeout` seconds to answer (for a streamed response: to send its
+  first chunk, after which the stream is committed to);
+- attempts that time out or fail with a transient error (rate limits, connection and
+  server errors) are retried up to `retries` times, with exponential backoff and full
+  jitter;
+- if the model still fails, each of the `fallbacks` is tried in turn, with the same
+  retries;
+- with `hedge_after`, an attempt that hasn't answered after that many seconds is hedged
+  by sending the same request to `hedge_model`, and whichever answers first wins; the
+  other is abandoned (and its stream, if any, closed).
+
+Waiting for room within rate limits (chit.scheduler) happens before each attempt, and
+doesn't count towards its timeout.
+
+The default policy is read from chit.config (REQUEST_TIMEOUT, REQUEST_RETRIES,
+RETRY_BACKOFF, FALLBACK_MODELS, HEDGE_AFTER, HEDGE_MODEL); set `chat.request_policy` to
+use a different one for a chat. With no timeout and no hedging, requests are made
+directly in the calling thread, as without a policy.
+"""
+
+import time
+import random
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Iterator
+import litellm
+import chit.config
+from chit.utils import wordcel
+
+if TYPE_CHECKING:
+    from chit.profiling import Profiler
+
+# errors worth retrying the same request for
+TRANSIENT_ERRORS = (
+    TimeoutError,
+    litellm.Timeout,
+    litellm.RateLimitError,
+    litellm.APIConnectionError,
+    litellm.ServiceUnavailableError,
+    litellm.InternalServerError,
+    litellm.BadGatewayError,
+)
+
+MAX_BACKOFF = 60.0
+
+
+def _spawn(fn: Callable, *args) -> Future:
+    """Run fn in a daemon thread, so that a stalled request can't hold up exiting."""
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def _discard(future: Future) -> None:
+    """Close the stream a losing (hedged or timed out) request returns, whenever it does."""
+
+    def close(future: Future):
+        if not future.cancelled() and future.exception() is None:
+            close_stream = getattr(future.result(), "close", None)
+            if close_stream is not None:
+                close_stream()
+
+    future.add_done_callback(close)
+
+
+class _Primed:
+    """Iterator over a stream whose first chunk has already been received. Closing it
+    closes the underlying stream (and its connection), whether or not iteration started."""
+
+    def __init__(self, first: Any, stream: Iterator):
+        self._first = [first]
+        self._stream = stream
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._first:
+            return self._first.pop()
+        try:
+            return next(self._stream)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        stream, self._stream = self._stream, iter(())
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+
+    def __del__(self):
+        # e.g. output interrupted halfway through
+        self.close()
+
+
+def primed(stream: Iterator) -> Iterator:
+    """A stream whose first chunk has already been received, so that the request counts
+    as answered (for timeouts and hedging) only once the provider starts streaming."""
+    stream = iter(stream)
+    try:
+        first = next(stream)
+    except StopIteration:
+        return iter(())
+    return _Primed(first, stream)
+
+
+@dataclass
+class RequestPolicy:
+    timeout: float | None = None  # seconds per attempt, to the first chunk if streaming
+    retries: int = 0  # retries per model, on timeouts and TRANSIENT_ERRORS
+    backoff: float = 1.0  # maximum delay before the first retry; doubles per retry
+    fallbacks: list[str] = field(default_factory=list)  # models to try next, in order
+    hedge_after: float | None = None  # seconds before hedging an attempt
+    hedge_model: str | None = None  # defaults to the first fallback, else the same model
+
+    @classmethod
+    def from_config(cls) -> "RequestPolicy":
+        """The policy configured in chit.config."""
+        return cls(
+            timeout=chit.config.REQUEST_TIMEOUT,
+            retries=chit.config.REQUEST_RETRIES,
+            backoff=chit.config.RETRY_BACKOFF,
+            fallbacks=list(chit.config.FALLBACK_MODELS),
+            hedge_after=chit.config.HEDGE_AFTER,
+            hedge_model=chit.config.HEDGE_MODEL,
+        )
+
+    def delay(self, retry: int) -> float:
+        """Seconds to wait before the given retry (0 for the first): exponential backoff
+        with full jitter."""
+        return random.uniform(0, min(MAX_BACKOFF, self.backoff * 2**retry))
+
+    def run(
+        self,
+        model: str,
+        request: Callable[[str, Any, threading.Event], Any],
+        profiler: "Profiler | None" = None,
+        reserve: Callable[[str], Any] | None = None,
+    ) -> tuple[Any, str]:
+        """
+        Make a request per the policy.
+
+        Arguments:
+            model (str): the model to ask first
+            request (callable): makes the request to a given model and returns its response;
+                called with the model, what `reserve` returned for the attempt (None for
+                hedges), and an Event set once the attempt is given up on, so that a
+                request that hasn't been sent yet by then can skip sending it
+            profiler (Profiler | None): to count retries, timeouts, fallbacks and hedges in
+            reserve (callable | None): called with the model before each attempt, outside
+                its timeout, e.g. to wait for room within rate limits
+
+        Returns:
+            the response, and the model that gave it
+
+        Raises:
+            the error of the last attempt, if every model failed
+        """
+        count = profiler.count if profiler is not None else lambda name, n=1: None
+        hedge_model = self.hedge_model or (self.fallbacks[0] if self.fallbacks else None)
+        error: BaseException | None = None
+        models = [model, *self.fallbacks]
+        for i, m in enumerate(models):
+            if i > 0:
+                wordcel(f"WARNING: {models[i - 1]} failed ({error!r}); falling back to {m}.")
+                count("completion.fallbacks")
+            for retry in range(self.retries + 1):
+                if retry > 0:
+                    count("completion.retries")
+                    time.sleep(self.delay(retry - 1))
+                reservation = reserve(m) if reserve is not None else None
+                try:
+                    return self._attempt(m, hedge_model or m, request, count, reservation)
+                except TRANSIENT_ERRORS as e:
+                    error = e
+                    if isinstance(e, TimeoutError):
+                        count("completion.timeouts")
+                except Exception as e:
+                    error = e
+                    break  # not worth retrying; fall back
+        raise error
+
+    def _attempt(
+        self,
+        model: str,
+        hedge_model: str,
+        request: Callable[[str, Any, threading.Event], Any],
+        count: Callable,
+        reservation: Any = None,
+    ) -> tuple[Any, str]:
+        """One attempt at a request to a model, hedged after hedge_after seconds."""
+        abandoned = threading.Event()
+        if self.timeout is None and self.hedge_after is None:
+            return request(model, reservation, abandoned), model
+        start = time.perf_counter()
+        deadline = None if self.timeout is None else start + self.timeout
+        hedge_at = None if self.hedge_after is None else start + self.hedge_after
+        first = _spawn(request, model, reservation, abandoned)
+        pending = {first: model}
+        error = None
+        try:
+            while pending:
+                wake = min((t for t in (deadline, hedge_at) if t is not None), default=None)
+                done, _ = wait(
+                    pending,
+                    timeout=None if wake is None else max(wake - time.perf_counter(), 0),
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    answered_by = pending.pop(future)
+                    if future.exception() is None:
+                        for loser in pending:
+                            _discard(loser)
+                        if future is not first:
+                            count("completion.hedge_wins")
+                        return future.result(), answered_by
+                    error = future.exception()
+                now = time.perf_counter()
+                if pending and deadline is not None and now >= deadline:
+                    for loser in pending:
+                        _discard(loser)
+                    raise TimeoutError(
+                        f"No response from {', '.join(pending.values())} within {self.timeout}s"
+                    )
+                if pending and hedge_at is not None and now >= hedge_at:
+                    hedge_at = None
+                    count("completion.hedges")
+                    pending[_spawn(request, hedge_model, None, abandoned)] = hedge_model
+            raise error
+        finally:
+            # requests of this attempt not sent yet needn't be any more
+            abandoned.set()
@@ -0,0 +1,135 @@
+"""Phase timers and counters for finding out where the time in chit goes.
+
+Enabled by setting `chit.config.PROFILE = True`. Each Chat then records how long it spends
+in each phase of its work (building the history, waiting on the provider, rendering the
+streamed response, running tools, pushing, generating the gui ...), summarized by
+`chat.stats()`, and can write a trace of the session with `chat.dump_trace(path)`, to be
+opened in chrome://tracing or https://ui.perfetto.dev.
+
+When disabled, a timed phase costs one config lookup and entering a no-op context manager.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from contextlib import nullcontext
+import chit.config
+
+_NULL = nullcontext()
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, self.start, time.perf_counter())
+        return False
+
+
+class Profiler:
+    """Aggregate timings per phase, plus the individual spans for tracing (the last
+    chit.config.PROFILE_MAX_EVENTS of them).
+
+    Usage:
+
+    ```
+    with profiler.phase("push"):
+        ...
+    profiler.count("tool_calls")
+    ```
+    """
+
+    def __init__(self):
+        self.phases: dict[str, list[float]] = {}  # name -> [count, total, max]
+        self.counters: dict[str, int] = {}
+        self.events: deque = deque(maxlen=chit.config.PROFILE_MAX_EVENTS)
+        # perf_counter() is relative to an arbitrary point; anchor it for the trace
+        self._epoch = time.time() - time.perf_counter()
+        # worktrees of a chat share its profiler, and may commit from several threads
+        self._lock = threading.Lock()
+
+    def phase(self, name: str):
+        """Context manager timing a phase, if profiling is enabled."""
+        if not chit.config.PROFILE:
+            return _NULL
+        return _Span(self, name)
+
+    def add(self, name: str, start: float, end: float) -> None:
+        """Record a phase that ran from start to end (time.perf_counter() values)."""
+        duration = end - start
+        with self._lock:
+            stat = self.phases.get(name)
+            if stat is None:
+                self.phases[name] = [1, duration, duration]
+            else:
+                stat[0] += 1
+                stat[1] += duration
+                if duration > stat[2]:
+                    stat[2] = duration
+            self.events.append((name, start, duration, threading.get_ident()))
+
+    def count(self, name: str, n: int = 1) -> None:
+        """Increment a counter, if profiling is enabled."""
+        if chit.config.PROFILE:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def stats(self) -> dict:
+        """Per-phase count, total, mean and max seconds, and counters."""
+        return {
+            "phases": {
+                name: {
+                    "count": count,
+                    "total": total,
+                    "mean": total / count,
+                    "max": longest,
+                }
+                for name, (count, total, longest) in sorted(
+                    self.phases.items(), key=lambda item: -item[1][1]
+                )
+            },
+            "counters": dict(self.counters),
+        }
+
+    def trace(self) -> dict:
+        """The recorded spans in the Chrome trace event format."""
+        pid = os.getpid()
+        return {
+            "traceEvents": [
+                {
+                    "name": name,
+                    "cat": "chit",
+                    "ph": "X",
+                    "ts": (self._epoch + start) * 1e6,
+                    "dur": duration * 1e6,
+                    "pid": pid,
+                    "tid": tid,
+                }
+                for name, start, duration, tid in self.events
+            ],
+            "displayTimeUnit": "ms",
+            "otherData": self.stats(),
+        }
+
+    def dump_trace(self, path: str) -> None:
+        """Write the trace to a json file."""
+        with open(path, "w") as f:
+            json.dump(self.trace(), f)
+
+    def reset(self) -> None:
+        self.phases.clear()
+        self.counters.clear()
+        self.events.clear()
+
+    def __repr__(self):
+        return f"Profiler({len(self.phases)} phases, {len(self.events)} events)"
@@ -0,0 +1,238 @@
+"""Process-wide scheduling of completion requests within providers' rate limits.
+
+With `chit.config.RATE_LIMITS` set, every completion request any chat in the process makes
+to a rate-limited model first waits for its turn in that model's queue. Each model has a
+token bucket for its requests per minute and one for its tokens per minute; a request is
+sent once both have room for it, so that chats driven concurrently (from threads, or
+worktrees) stay under the provider's limits instead of running into storms of 429s.
+
+A request's tokens are estimated as the prompt tokens of its history -- the sum of the
+per-message token counts cached on each message (see chit.context.count_tokens), so that
+each message is only tokenized once however many requests send it -- plus
+chit.config.RATE_LIMIT_OUTPUT_TOKENS for the response; once the response's usage is known
+the bucket is corrected by the difference. A 429 that gets through anyway empties the
+model's buckets, so that the queue waits for them to refill before sending more.
+
+Waiting requests are served in order of priority (`chat.priority`, higher first) and,
+within a priority, fairly between chats: each chat's requests are tagged with the chat's
+cumulative tokens (weighted fair queuing), so that a chat sending many or large requests
+can't starve others.
+"""
+
+import time
+import heapq
+import fnmatch
+import threading
+from typing import Any
+import chit.config
+
+
+class TokenBucket:
+    """Up to `per_minute` units, refilled continuously at per_minute / 60 a second."""
+
+    __slots__ = ("capacity", "rate", "level", "updated")
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, n: float, now: float) -> float:
+        """Seconds until n units are available (a request larger than the bucket only
+        waits for it to be full)."""
+        self._refill(now)
+        return max(0.0, (min(n, self.capacity) - self.level) / self.rate)
+
+    def take(self, n: float, now: float) -> None:
+        self._refill(now)
+        self.level -= min(n, self.capacity)
+
+    def give(self, n: float) -> None:
+        """Return (or, if negative, take) units, e.g. to correct an estimate."""
+        self.level = min(self.capacity, self.level + n)
+
+    def drain(self, now: float) -> None:
+        self._refill(now)
+        self.level = min(self.level, 0.0)
+
+    def __repr__(self):
+        return f"TokenBucket({self.level:.0f}/{self.capacity:g})"
+
+
+class Grant:
+    """Permission to send one request, as given by Scheduler.acquire."""
+
+    __slots__ = ("model", "tokens")
+
+    def __init__(self, model: str, tokens: int):
+        self.model = model
+        self.tokens = tokens
+
+    def __repr__(self):
+        return f"Grant({self.model}, {self.tokens} tokens)"
+
+
+class _ModelQueue:
+    def __init__(self, limits: dict[str, int]):
+        rpm, tpm = limits.get("rpm"), limits.get("tpm")
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        # waiting requests as (-priority, fair tag, sequence number)
+        self.heap: list[tuple[int, float, int]] = []
+        self.seq = 0
+        self.vtime = 0.0  # fair tag of the request last sent
+        self.tags: dict[Any, float] = {}  # latest fair tag of each chat
+        self.sent = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        return max(
+            self.requests.wait_time(1, now) if self.requests else 0.0,
+            self.tokens.wait_time(tokens, now) if self.tokens else 0.0,
+        )
+
+    def take(self, tokens: int, now: float) -> None:
+        if self.requests:
+            self.requests.take(1, now)
+        if self.tokens:
+            self.tokens.take(tokens, now)
+
+
+class Scheduler:
+    """Queues of completion requests per rate-limited model. There is one per process,
+    `Scheduler.shared()`, which all chats use."""
+
+    _shared: "Scheduler | None" = None
+
+    def __init__(self, limits: dict[str, dict[str, int]] | None = None):
+        """
+        Arguments:
+            limits (dict | None): {model pattern: {"rpm": ..., "tpm": ...}}, as
+                chit.config.RATE_LIMITS (which is used if None)
+        """
+        self.limits = limits
+        self._cond = threading.Condition()
+        self._queues: dict[str, _ModelQueue | None] = {}
+
+    @classmethod
+    def shared(cls) -> "Scheduler":
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def _queue(self, model: str) -> _ModelQueue | None:
+        """The queue of a model, None if it isn't rate limited. Call with the lock held."""
+        if model not in self._queues:
+            limits = self.limits if self.limits is not None else chit.config.RATE_LIMITS
+            match = next(
+                (v for pattern, v in limits.items() if fnmatch.fnmatchcase(model, pattern)),
+                None,
+            )
+            self._queues[model] = _ModelQueue(match) if match else None
+        return self._queues[model]
+
+    def acquire(
+        self, model: str, tokens: int, chat: Any = None, priority: int = 0
+    ) -> Grant | None:
+        """
+        Wait until a request to a model can be sent within its rate limits.
+
+        Arguments:
+            model (str): the model the request is to
+            tokens (int): estimated tokens of the request, prompt and response
+            chat: key of the chat making the request, to be fair between chats
+            priority (int): requests with higher priority are sent first
+
+        Returns:
+            a Grant to settle once the request's usage is known, or None if the model
+            isn't rate limited
+        """
+        with self._cond:
+            queue = self._queue(model)
+            if queue is None:
+                return None
+            start = time.monotonic()
+            tag = max(queue.vtime, queue.tags.get(chat, 0.0)) + tokens
+            queue.tags[chat] = tag
+            queue.seq += 1
+            entry = (-priority, tag, queue.seq)
+            heapq.heappush(queue.heap, entry)
+            try:
+                while True:
+                    if queue.heap[0] == entry:
+                        now = time.monotonic()
+                        wait = queue.wait_time(tokens, now)
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+            except BaseException:
+                # e.g. interrupted: leave the queue, or it would block everyone behind
+                queue.heap.remove(entry)
+                heapq.heapify(queue.heap)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(queue.heap)
+            queue.take(tokens, now)
+            queue.vtime = tag
+            if len(queue.tags) > 1024:  # forget chats that are caught up
+                queue.tags = {k: v for k, v in queue.tags.items() if v > queue.vtime}
+            queue.sent += 1
+            queue.waited += now - start
+            self._cond.notify_all()
+            return Grant(model, tokens)
+
+    def settle(self, grant: Grant | None, tokens: int | None) -> None:
+        """Correct the model's token bucket once the actual tokens of a granted request
+        (prompt and response) are known."""
+        if grant is None or tokens is None:
+            return
+        with self._cond:
+            queue = self._queue(grant.model)
+            if queue is not None and queue.tokens is not None:
+                queue.tokens.give(grant.tokens - tokens)
+                self._cond.notify_all()
+
+    def throttle(self, model: str) -> None:
+        """Empty a model's buckets after the provider rate limited a request anyway."""
+        with self._cond:
+            queue = self._queue(model)
+            if queue is None:
+                return
+            now = time.monotonic()
+            for bucket in (queue.requests, queue.tokens):
+                if bucket is not None:
+                    bucket.drain(now)
+            queue.throttled += 1
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """Per rate-limited model: requests waiting and sent, 429s, mean wait in seconds."""
+        with self._cond:
+            return {
+                model: {
+                    "waiting": len(queue.heap),
+                    "sent": queue.sent,
+                    "throttled": queue.throttled,
+                    "mean_wait": queue.waited / queue.sent if queue.sent else 0.0,
+                    "requests": queue.requests,
+                    "tokens": queue.tokens,
+                }
+                for model, queue in self._queues.items()
+                if queue is not None
+            }
+
+    def reset(self) -> None:
+        """Forget all queues and buckets, e.g. after changing chit.config.RATE_LIMITS."""
+        with self._cond:
+            self._queues.clear()
+
+    def __repr__(self):
+        limited = sum(queue is not None for queue in self._queues.values())
+        return f"Scheduler({limited} rate-limited models)"
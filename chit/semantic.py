@@ -0,0 +1,320 @@
+"""Semantic search over all the messages of a chat, on every branch.
+
+`Chat.semantic_search(query)` embeds the query and compares it with an embedding of every
+message, kept as the rows of one NumPy matrix, so that a search is one matrix-vector
+product and a partial sort, however many messages there are. The index is built on first
+use and kept up to date incrementally: commits queue their message to be embedded (in a
+batch, at the next search) and rm drops the rows of the messages it removes. `push()`
+saves the index next to the remote (`path/to/file.json.vec.npz`), and a cloned chat picks
+it up from there, so only messages added since have to be embedded.
+
+Embedding functions are pluggable: any callable taking a list of texts and returning one
+vector per text. The default, `HashingEmbedder`, runs locally and deterministically with no
+model or network, by hashing words and word pairs into a fixed number of dimensions; it
+matches on shared vocabulary rather than meaning. For real semantic matching use a model,
+e.g. `litellm_embedder("text-embedding-3-small")`.
+
+NumPy is only needed (and imported) once semantic search is used.
+"""
+
+import os
+import zlib
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Optional
+import chit.config
+
+if TYPE_CHECKING:
+    import numpy as np
+    from chit.chit import ChitMessage
+
+    Embedder = Callable[[list[str]], Any]
+
+VECTORS_SUFFIX = ".vec.npz"
+INDEX_VERSION = 1
+
+# number of messages to embed per call of the embedding function
+EMBED_BATCH = 512
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        raise ImportError("Semantic search needs numpy: pip install numpy") from e
+    return numpy
+
+
+def vectors_path(json_file: str) -> str:
+    """Path of the saved semantic index of a remote."""
+    return json_file + VECTORS_SUFFIX
+
+
+def embedder_name(embed: "Embedder") -> str:
+    """Name an index records its embedding function by, to tell whether it can be reused."""
+    return getattr(embed, "name", None) or getattr(embed, "__qualname__", repr(embed))
+
+
+def _as_dict(message: Any) -> dict:
+    return message if isinstance(message, dict) else message.json()
+
+
+def message_text(message: "ChitMessage") -> str:
+    """Text of a message to embed: its content, and the names and arguments of any tools it
+    calls."""
+    m = _as_dict(message.message)
+    content = m.get("content")
+    if content is None or isinstance(content, str):
+        parts = [content or ""]
+    else:
+        parts = [item["text"] for item in content if item["type"] == "text"]
+    for tool_call in map(_as_dict, message.tool_calls or []):
+        parts.append(f"{tool_call['function']['name']} {tool_call['function']['arguments']}")
+    return "\n".join(parts)
+
+
+class HashingEmbedder:
+    """Local, deterministic embedder: the words of a text and the pairs of consecutive words
+    (lowercased), each hashed to one of `dim` dimensions with a random sign.
+
+    Words are runs of ASCII letters, digits and underscores or non-ASCII characters, found
+    and hashed in the UTF-8 bytes of a whole batch of texts at once with array operations,
+    so that embedding doesn't take a Python step per word.
+    """
+
+    def __init__(self, dim: int | None = None):
+        self.dim = dim or chit.config.SEMANTIC_DIM
+        self.name = f"hashing-{self.dim}"
+
+    def __call__(self, texts: list[str]) -> "np.ndarray":
+        np = _numpy()
+        encoded = [text.lower().encode() for text in texts]
+        # texts separated by (and the batch surrounded by) a byte that isn't part of a word
+        buf = np.frombuffer(b"\0" + b"\0".join(encoded) + b"\0", dtype=np.uint8)
+        text_starts = np.cumsum([1] + [len(e) + 1 for e in encoded[:-1]])
+        is_word = _word_bytes(np)[buf]
+        starts = np.flatnonzero(~is_word[:-1] & is_word[1:]) + 1
+        ends = np.flatnonzero(is_word[:-1] & ~is_word[1:])  # last byte of each word
+        # polynomial hash of each word (mod 2**64), summing byte * P**(distance to its end)
+        if len(starts):
+            lengths = ends - starts + 1
+            powers = np.cumprod(np.full(int(lengths.max()), _P, dtype=np.uint64))
+            chars = np.flatnonzero(is_word)
+            terms = buf[chars].astype(np.uint64) * powers[np.repeat(ends, lengths) - chars]
+            h = np.add.reduceat(terms, np.cumsum(lengths) - lengths)
+        else:
+            h = np.zeros(0, dtype=np.uint64)
+        h = _mix(h ^ (h >> np.uint64(32)))
+        rows = np.searchsorted(text_starts, starts, side="right") - 1
+        # and of each pair of consecutive words in the same text
+        pairs = rows[1:] == rows[:-1]
+        h = np.concatenate([h, _mix(h[:-1][pairs] * np.uint64(0x9E3779B1) + h[1:][pairs])])
+        rows = np.concatenate([rows, rows[1:][pairs]])
+        signs = np.where(h & np.uint64(0x80000000), 1.0, -1.0).astype(np.float32)
+        counts = np.bincount(
+            rows * self.dim + (h % np.uint64(self.dim)).astype(np.int64),
+            weights=signs,
+            minlength=len(texts) * self.dim,
+        )
+        return counts.reshape(len(texts), self.dim).astype(np.float32)
+
+    def __repr__(self):
+        return f"HashingEmbedder({self.dim})"
+
+
+_P = 1099511628211  # FNV prime
+
+
+def _word_bytes(np) -> "np.ndarray":
+    """Which byte values are part of words."""
+    table = np.zeros(256, dtype=bool)
+    for lo, hi in ((ord("0"), ord("9")), (ord("a"), ord("z")), (ord("A"), ord("Z"))):
+        table[lo : hi + 1] = True
+    table[ord("_")] = True
+    table[128:] = True
+    return table
+
+
+def _mix(h: "np.ndarray") -> "np.ndarray":
+    """32-bit finalizer of MurmurHash3, on an array of uint64."""
+    np = _numpy()
+    mask = np.uint64(0xFFFFFFFF)
+    h = h & mask
+    h ^= h >> np.uint64(16)
+    h = (h * np.uint64(0x85EBCA6B)) & mask
+    h ^= h >> np.uint64(13)
+    h = (h * np.uint64(0xC2B2AE35)) & mask
+    h ^= h >> np.uint64(16)
+    return h
+
+
+def litellm_embedder(model: str, **kwargs) -> "Embedder":
+    """An embedding function calling an embedding model through litellm."""
+
+    def embed(texts: list[str]) -> list[list[float]]:
+        import litellm
+
+        # providers reject empty inputs
+        response = litellm.embedding(model=model, input=[t or " " for t in texts], **kwargs)
+        return [item["embedding"] for item in response.data]
+
+    embed.name = f"litellm-{model}"
+    return embed
+
+
+class SemanticIndex:
+    """Unit-length embeddings of messages, one row of a matrix per message.
+
+    Rows of removed messages are blanked and reclaimed once they make up half the matrix;
+    the matrix grows by doubling, so adding messages one at a time stays cheap.
+    """
+
+    def __init__(self, embed: Optional["Embedder"] = None):
+        self.embed = embed or chit.config.SEMANTIC_EMBEDDER or HashingEmbedder()
+        self.name = embedder_name(self.embed)
+        self.ids: list[str | None] = []  # message id of each row, None if removed
+        self.rows: dict[str, int] = {}
+        self.roles: list[str | None] = []
+        self.matrix: "np.ndarray | None" = None  # with spare rows beyond len(self.ids)
+        self.pending: set[str] = set()  # messages still to embed
+        self.n_removed = 0
+        self.changed = False  # since loaded or saved
+
+    def __len__(self) -> int:
+        return len(self.rows) + len(self.pending)
+
+    def __contains__(self, msg_id: str) -> bool:
+        return msg_id in self.rows or msg_id in self.pending
+
+    def add(self, message_ids: Iterable[str]) -> None:
+        """Queue messages to be embedded at the next update()."""
+        self.pending.update(i for i in message_ids if i not in self.rows)
+
+    def remove(self, message_ids: Iterable[str]) -> None:
+        for msg_id in message_ids:
+            self.pending.discard(msg_id)
+            row = self.rows.pop(msg_id, None)
+            if row is not None:
+                self.ids[row] = self.roles[row] = None
+                self.matrix[row] = 0
+                self.n_removed += 1
+                self.changed = True
+        if self.n_removed > len(self.ids) // 2:
+            self._reclaim()
+
+    def sync(self, messages: dict[str, "ChitMessage"]) -> None:
+        """Add the messages missing from the index and remove the ones no longer in the chat."""
+        self.remove([i for i in self.rows if i not in messages])
+        self.pending.intersection_update(messages)
+        self.add(i for i in messages if i not in self.rows)
+
+    def update(self, messages: dict[str, "ChitMessage"]) -> None:
+        """Embed the queued messages."""
+        if not self.pending:
+            return
+        np = _numpy()
+        pending = [i for i in self.pending if i in messages]
+        self.pending.clear()
+        for start in range(0, len(pending), EMBED_BATCH):
+            batch = pending[start : start + EMBED_BATCH]
+            vectors = np.asarray(
+                self.embed([message_text(messages[i]) for i in batch]), dtype=np.float32
+            )
+            self._append(batch, [messages[i].message["role"] for i in batch], vectors)
+
+    def _append(self, ids: list[str], roles: list[str], vectors: "np.ndarray") -> None:
+        np = _numpy()
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        n = len(self.ids)
+        if self.matrix is None:
+            self.matrix = np.zeros((max(len(ids), 1024), vectors.shape[1]), dtype=np.float32)
+        elif vectors.shape[1] != self.matrix.shape[1]:
+            raise ValueError(
+                f"Embedding dimension {vectors.shape[1]} doesn't match the index's "
+                f"{self.matrix.shape[1]}"
+            )
+        if n + len(ids) > len(self.matrix):
+            grown = np.zeros(
+                (max(2 * len(self.matrix), n + len(ids)), self.matrix.shape[1]), dtype=np.float32
+            )
+            grown[:n] = self.matrix[:n]
+            self.matrix = grown
+        self.matrix[n : n + len(ids)] = vectors
+        for msg_id in ids:
+            self.rows[msg_id] = len(self.ids)
+            self.ids.append(msg_id)
+        self.roles.extend(roles)
+        self.changed = True
+
+    def _reclaim(self) -> None:
+        """Drop the rows of removed messages."""
+        np = _numpy()
+        keep = [row for row, msg_id in enumerate(self.ids) if msg_id is not None]
+        self.matrix = np.ascontiguousarray(self.matrix[keep])
+        self.ids = [self.ids[row] for row in keep]
+        self.roles = [self.roles[row] for row in keep]
+        self.rows = {msg_id: row for row, msg_id in enumerate(self.ids)}
+        self.n_removed = 0
+
+    def search(
+        self, query: str, k: int = 10, roles: Optional[list[str]] = None
+    ) -> list[tuple[str, float]]:
+        """(message id, cosine similarity) of the k embedded messages most similar to the
+        query, most similar first."""
+        np = _numpy()
+        if not self.rows:
+            return []
+        q = np.asarray(self.embed([query]), dtype=np.float32)[0]
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return []
+        n = len(self.ids)
+        scores = self.matrix[:n] @ (q / norm)
+        valid = np.fromiter((i is not None for i in self.ids), dtype=bool, count=n)
+        if roles is not None:
+            valid &= np.fromiter((r in roles for r in self.roles), dtype=bool, count=n)
+        scores[~valid] = -np.inf
+        k = min(k, int(valid.sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.ids[row], float(scores[row])) for row in top]
+
+    def save(self, path: str) -> None:
+        """Write the embedded messages to a file (atomically)."""
+        np = _numpy()
+        keep = [row for row, msg_id in enumerate(self.ids) if msg_id is not None]
+        dim = self.matrix.shape[1] if self.matrix is not None else 0
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                version=INDEX_VERSION,
+                embedder=self.name,
+                ids=np.array([self.ids[row] for row in keep], dtype=str),
+                roles=np.array([self.roles[row] for row in keep], dtype=str),
+                matrix=self.matrix[keep] if keep else np.zeros((0, dim), dtype=np.float32),
+            )
+        os.replace(tmp, path)
+        self.changed = False
+
+    @classmethod
+    def load(cls, path: str, embed: Optional["Embedder"] = None) -> "SemanticIndex | None":
+        """The index saved to a file, or None if there is none, or it was made by a
+        different embedding function."""
+        np = _numpy()
+        index = cls(embed)
+        try:
+            with np.load(path) as data:
+                if int(data["version"]) != INDEX_VERSION or str(data["embedder"]) != index.name:
+                    return None
+                ids, roles, matrix = data["ids"].tolist(), data["roles"].tolist(), data["matrix"]
+        except (OSError, KeyError, ValueError):
+            return None
+        if ids:
+            index._append(ids, roles, matrix)
+        index.changed = False
+        return index
+
+    def __repr__(self):
+        return f"SemanticIndex({self.name}, {len(self.rows)} messages, {len(self.pending)} pending)"
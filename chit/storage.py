@@ -0,0 +1,448 @@
+"""On-disk layout of chit remotes.
+
+`Chat.push()` writes the json remote itself, one message at a time, so that it knows
+the byte span of every message body in the file. These spans are saved, along with
+the tree structure and the top-level chat attributes, to a small sidecar index file
+next to the remote (`path/to/file.json.idx`). `Chat.clone(..., lazy=True)` then only
+needs to read the index and memory-map the remote: message bodies are decoded one
+at a time, on first access.
+
+Remotes ending in `.jsonl` instead use an append-only layout with one message per
+line and the index embedded in header lines (see `JsonlLog`), so that pushing a new
+commit only appends to the file rather than rewriting it.
+
+Every push also records a generation number in the header, one more than that of the
+remote it replaced. With `chit.config.MULTI_WRITER`, pushes hold an advisory lock on the
+remote (`remote_lock`) and merge in whatever other writers pushed since (see
+`Chat._merge_remote`), which they detect by the generation having moved on.
+"""
+
+import os
+import json
+import mmap
+import time
+from contextlib import contextmanager
+from typing import Any, Iterable, Callable, Iterator
+from chit.objects import resolve_body
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+LOCK_SUFFIX = ".lock"
+
+
+def index_path(json_file: str) -> str:
+    """Path of the sidecar index of a json remote."""
+    return json_file + INDEX_SUFFIX
+
+
+def encode_body(body: dict[str, Any]) -> bytes:
+    """Encode the body of a message, i.e. the members of its json object other than
+    its id and structure (`"message": ..., "tool_calls": ..., ...`), without the
+    enclosing braces."""
+    return b", ".join(
+        json.dumps(k).encode() + b": " + json.dumps(v).encode() for k, v in body.items()
+    )
+
+
+class BodyStore:
+    """Read-only memory map over a remote file, from which single message bodies are
+    decoded by their byte span."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            self._mm = None
+
+    def raw(self, offset: int, length: int) -> bytes:
+        if self._mm is None:
+            raise ValueError(f"BodyStore({self.path}) is closed or empty")
+        return self._mm[offset : offset + length]
+
+    def load(self, offset: int, length: int) -> dict:
+        return json.loads(b"{" + self.raw(offset, length) + b"}")
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    @property
+    def closed(self) -> bool:
+        return self._mm is None
+
+    def __repr__(self):
+        return f"BodyStore({self.path})"
+
+
+def _write_record(
+    f,
+    msg_id: str,
+    structure: dict,
+    body: Callable[[], bytes],
+    index: dict[str, list],
+) -> None:
+    """Write a message as a json object, recording its index entry."""
+    f.write(b'{"id": ' + json.dumps(msg_id).encode())
+    for key in ("children", "parent_id", "home_branch"):
+        f.write(b", " + json.dumps(key).encode() + b": ")
+        f.write(json.dumps(structure[key]).encode())
+    f.write(b", ")
+    raw = body()
+    index[msg_id] = [
+        f.tell(),
+        len(raw),
+        structure["children"],
+        structure["parent_id"],
+        structure["home_branch"],
+    ]
+    f.write(raw + b"}")
+
+
+def write_indexed_json(
+    json_file: str,
+    header: dict,
+    messages: Iterable[tuple[str, dict, Callable[[], bytes]]],
+    before_replace: Callable[[dict[str, list]], None] | None = None,
+) -> dict[str, list]:
+    """Write a json remote and its sidecar index.
+
+    The json file has the same shape as `Chat.asdict()`; it is written by hand only so
+    that the span of each message body is known.
+
+    Arguments:
+        json_file (str): path to the json remote
+        header (dict): all top-level attributes of the chat apart from "messages"
+        messages (iterable): (message id, structure, body) triples, where structure holds
+            the "children", "parent_id" and "home_branch" of the message and body is a
+            callable returning the encoded body (see `encode_body`)
+        before_replace (callable | None): called with the index of the new file once it
+            is written, just before it replaces the old one, e.g. to close memory maps of
+            the old one (which Windows doesn't allow replacing)
+
+    Returns:
+        the index: {message id: [body offset, body length, children, parent_id,
+        home_branch]}
+    """
+    dirname = os.path.dirname(json_file)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    index: dict[str, list] = {}
+    tmp_file = json_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(json.dumps(header).encode()[:-1])  # leave the object open
+        f.write(b', "messages": {' if header else b'"messages": {')
+        for i, (msg_id, structure, body) in enumerate(messages):
+            if i:
+                f.write(b", ")
+            f.write(json.dumps(msg_id).encode() + b": ")
+            _write_record(f, msg_id, structure, body, index)
+        f.write(b"}}")
+    if before_replace is not None:
+        before_replace(index)
+    os.replace(tmp_file, json_file)
+
+    stat = os.stat(json_file)
+    tmp_index = index_path(json_file) + ".tmp"
+    with open(tmp_index, "w") as f:
+        json.dump(
+            {
+                "version": INDEX_VERSION,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "header": header,
+                "index": index,
+            },
+            f,
+        )
+    os.replace(tmp_index, index_path(json_file))
+    return index
+
+
+def read_index(json_file: str) -> dict | None:
+    """Read the sidecar index of a json remote, or None if there is no index or it is
+    out of date with respect to the remote (e.g. the remote was written by an older
+    version of chit, or modified by hand)."""
+    try:
+        with open(index_path(json_file), "r") as f:
+            index = json.load(f)
+        stat = os.stat(json_file)
+    except (OSError, ValueError):
+        return None
+    if (
+        index.get("version") != INDEX_VERSION
+        or index.get("size") != stat.st_size
+        or index.get("mtime_ns") != stat.st_mtime_ns
+    ):
+        return None
+    return index
+
+
+class JsonlLog:
+    """Writer state for a jsonl remote.
+
+    A jsonl remote is an append-only log. Each line is either a message record, i.e. a
+    `ChitMessage.asdict()`, or a header record:
+
+        {"chit_jsonl": 1, "header": {...}, "index": {...}, "prev": ..., "depth": ...}
+
+    where "header" holds the top-level attributes of the chat (root_id, current_id,
+    branch_tips, ...) and "index" maps message ids to their entries as in the sidecar
+    index of a json remote (or to None if the message was removed). A push appends the
+    records of the messages that changed, followed by a header indexing only those;
+    "prev" is the offset of the previous header, so the full index is recovered by
+    following the chain of headers back to a full snapshot (which has "prev": None).
+    Once the chain reaches `chit.config.JSONL_COMPACT_DEPTH` headers, the next push
+    rewrites the file as a single snapshot.
+    """
+
+    MAGIC = "chit_jsonl"
+
+    def __init__(self, path: str, size: int, head: int, depth: int):
+        self.path = path
+        self.size = size  # file size after our last write
+        self.head = head  # offset of the last header
+        self.depth = depth  # number of headers after the last full snapshot
+
+    def can_append(self, max_depth: int) -> bool:
+        """Whether the file is still as we left it, and short enough a chain to append to."""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return False
+        return size == self.size and self.depth < max_depth
+
+    def _write_records(
+        self,
+        f,
+        messages: Iterable[tuple[str, dict | None, Callable[[], bytes] | None]],
+        index: dict[str, list | None],
+    ) -> None:
+        for msg_id, structure, body in messages:
+            if structure is None:
+                index[msg_id] = None
+                continue
+            _write_record(f, msg_id, structure, body, index)
+            f.write(b"\n")
+
+    def _write_header(self, f, header: dict, index: dict, prev: int | None) -> None:
+        self.depth = 0 if prev is None else self.depth + 1
+        self.head = f.tell()
+        record = {
+            self.MAGIC: INDEX_VERSION,
+            "header": header,
+            "index": index,
+            "prev": prev,
+            "depth": self.depth,
+        }
+        f.write(json.dumps(record).encode() + b"\n")
+        self.size = f.tell()
+
+    @classmethod
+    def write(
+        cls,
+        path: str,
+        header: dict,
+        messages: Iterable[tuple[str, dict, Callable[[], bytes]]],
+        before_replace: Callable[[dict[str, list]], None] | None = None,
+    ) -> "JsonlLog":
+        """Write a full snapshot of a chat to a jsonl remote.
+
+        Arguments:
+            path (str): path to the jsonl remote
+            header (dict): all top-level attributes of the chat apart from "messages"
+            messages (iterable): (message id, structure, body) triples, as for
+                `write_indexed_json`
+            before_replace (callable | None): as for `write_indexed_json`
+        """
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        log = cls(path, 0, 0, 0)
+        index: dict[str, list] = {}
+        tmp_file = path + ".tmp"
+        with open(tmp_file, "wb") as f:
+            log._write_records(f, messages, index)
+            log._write_header(f, header, index, prev=None)
+        if before_replace is not None:
+            before_replace(index)
+        os.replace(tmp_file, path)
+        return log
+
+    def append(
+        self,
+        header: dict,
+        messages: Iterable[tuple[str, dict | None, Callable[[], bytes] | None]],
+    ) -> None:
+        """Append the messages that changed since the last write, and a new header.
+
+        Arguments:
+            header (dict): all top-level attributes of the chat apart from "messages"
+            messages (iterable): (message id, structure, body) triples, as for
+                `JsonlLog.write`, except that structure and body are None for removed
+                messages
+        """
+        index: dict[str, list | None] = {}
+        with open(self.path, "ab") as f:
+            self._write_records(f, messages, index)
+            self._write_header(f, header, index, prev=self.head)
+
+    @classmethod
+    def read(cls, path: str) -> tuple["JsonlLog", dict]:
+        """Read the headers of a jsonl remote.
+
+        Returns:
+            the writer state, and a dict with the same "header" and "index" keys as the
+            sidecar index of a json remote.
+        """
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # find the last complete header; anything after it is a partial append
+                end = len(mm)
+                while True:
+                    if end <= 0:
+                        raise ValueError(f"No chit header found in {path}")
+                    start = mm.rfind(b"\n", 0, end - 1) + 1
+                    record = cls._parse_header(mm[start:end])
+                    if record is not None:
+                        break
+                    end = start
+                log = cls(path, end, start, record["depth"])
+                header = record["header"]
+                index: dict[str, list | None] = {}
+                while True:
+                    for msg_id, entry in record["index"].items():
+                        index.setdefault(msg_id, entry)  # later entries win
+                    if record["prev"] is None:
+                        break
+                    prev = record["prev"]
+                    record = json.loads(mm[prev : mm.find(b"\n", prev)])
+        index = {k: v for k, v in index.items() if v is not None}
+        return log, {"header": header, "index": index}
+
+    @classmethod
+    def _parse_header(cls, line: bytes) -> dict | None:
+        if not line.startswith(b'{"' + cls.MAGIC.encode()):
+            return None
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+
+def read_remote_index(path: str) -> dict | None:
+    """The index ("header" and "index") of a json or jsonl remote, or None if it has none
+    (or an out of date one)."""
+    if path.endswith(".jsonl"):
+        return JsonlLog.read(path)[1]
+    return read_index(path)
+
+
+class RemoteReader:
+    """The structure and messages of a remote, read without cloning it into a Chat:
+    through its index if it has one (only decoding the bodies asked for), else by parsing
+    it in full.
+
+    Attributes:
+        header (dict): the top-level attributes of the chat
+        structure (dict): message id -> (children, parent_id, home_branch)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.jsonl_log: JsonlLog | None = None  # writer state, for jsonl remotes
+        if path.endswith(".jsonl"):
+            self.jsonl_log, index = JsonlLog.read(path)
+        else:
+            index = read_index(path)
+        self._store = None
+        self._bodies = None
+        if index is not None:
+            self.header = index["header"]
+            self.structure = {k: tuple(v[2:5]) for k, v in index["index"].items()}
+            self._spans = {k: v[:2] for k, v in index["index"].items()}
+            self._store = BodyStore(path)
+        else:
+            with open(path, "r") as f:
+                self.header = json.load(f)
+            self._bodies = self.header.pop("messages")
+            self.structure = {
+                k: (v["children"], v["parent_id"], v["home_branch"])
+                for k, v in self._bodies.items()
+            }
+
+    def body(self, msg_id: str) -> dict[str, Any]:
+        """Body of a message (see ChitMessage.BODY_FIELDS), with its content fetched from
+        the object store if needed."""
+        if self._bodies is not None:
+            body = {
+                k: v
+                for k, v in self._bodies[msg_id].items()
+                if k not in ("id", "children", "parent_id", "home_branch")
+            }
+        else:
+            body = self._store.load(*self._spans[msg_id])
+        return resolve_body(body, self.header.get("object_store"))
+
+    def message(self, msg_id: str) -> dict:
+        """The message dict of a message."""
+        return self.body(msg_id)["message"]
+
+    def close(self) -> None:
+        if self._store is not None:
+            self._store.close()
+
+    def __enter__(self) -> "RemoteReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def file_stat(path: str) -> tuple[int, int] | None:
+    """(size, mtime_ns) of a file, to tell whether it changed; None if it doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+@contextmanager
+def remote_lock(path: str, timeout: float | None = None) -> Iterator[None]:
+    """Hold an exclusive advisory lock on a remote (on a `.lock` file next to it) across
+    processes, waiting for it for up to `timeout` seconds (forever if None)."""
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with open(path + LOCK_SUFFIX, "a+b") as f:
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError(f"Timed out waiting for the lock on {path}")
+                time.sleep(0.01)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,230 @@
+"""Helpers for streamed AI responses."""
+
+import re
+import time
+from typing import Any, Callable
+import litellm
+import chit.config
+from litellm.types.utils import Message as ChatCompletionMessage, Usage
+
+_FENCE = re.compile(r"^\s*(```|~~~)", re.MULTILINE)
+
+
+class MarkdownStream:
+    """Incrementally render streamed markdown in a Jupyter notebook.
+
+    Re-rendering the whole response on every chunk costs time quadratic in its length.
+    Instead, once a block (paragraph, list, code block ...) is complete, i.e. followed by
+    a blank line outside of any code fence, it is rendered one final time and frozen; only
+    the unfinished tail is re-rendered, in place in its own display, and at most once every
+    chit.config.STREAM_RENDER_INTERVAL_MS milliseconds.
+
+    Usage:
+
+    ```
+    stream = MarkdownStream()
+    for delta in deltas:
+        stream.feed(delta)
+    stream.close()
+    ```
+    """
+
+    def __init__(self, interval_ms: float | None = None):
+        from IPython.display import display, Markdown
+
+        self._display = display
+        self._markdown = Markdown
+        self.interval = (
+            chit.config.STREAM_RENDER_INTERVAL_MS if interval_ms is None else interval_ms
+        ) / 1000
+        self.tail = ""  # text not yet frozen
+        # how far the tail has been scanned for block boundaries, and the number of code
+        # fences in the stream up to there
+        self._scan_pos = 0
+        self._scan_fences = 0
+        self._handle = None
+        self._last_render = 0.0
+        self._dirty = False
+
+    def _render(self, text: str) -> None:
+        if self._handle is None:
+            self._handle = self._display(self._markdown(text), display_id=True)
+        else:
+            self._handle.update(self._markdown(text))
+        self._last_render = time.monotonic()
+        self._dirty = False
+
+    def _freeze(self) -> None:
+        """Freeze every complete block at the start of the tail."""
+        pos, fences = self._scan_pos, self._scan_fences
+        split = None
+        while True:
+            i = self.tail.find("\n\n", pos)
+            if i < 0:
+                break
+            fences += len(_FENCE.findall(self.tail, pos, i))
+            if fences % 2 == 0:
+                split = i
+            pos = i + 2
+        self._scan_pos, self._scan_fences = pos, fences
+        if split is None:
+            return
+        block, self.tail = self.tail[: split + 2], self.tail[split + 2 :]
+        self._scan_pos -= split + 2
+        if block.strip():
+            self._render(block)
+            self._handle = None  # the tail goes in a new display below the frozen block
+        self._dirty = bool(self.tail)
+
+    def feed(self, delta: str) -> None:
+        """Add a chunk of streamed text."""
+        if not delta:
+            return
+        self.tail += delta
+        self._dirty = True
+        self._freeze()
+        if self._dirty and time.monotonic() - self._last_render >= self.interval:
+            self._render(self.tail)
+
+    def close(self) -> None:
+        """Render whatever is left once the stream has ended."""
+        if self._dirty or self._handle is None:
+            self._render(self.tail)
+
+
+class StreamAccumulator:
+    """Build the final response of a stream as its chunks arrive, instead of keeping every
+    chunk around for litellm.stream_chunk_builder to reprocess at the end.
+
+    Exposes the same attributes of a response that chit uses: `message()` (rather than
+    `choices[0].message`), `usage` and `citations`.
+    If `on_tool_call` is given, it is called with each tool call (in the OpenAI format) as
+    soon as its arguments are complete, i.e. once the next tool call starts streaming, or
+    on `finish()`.
+    `usage` is what the provider reports in the stream (requested with
+    `stream_options={"include_usage": True}`); if it reports none, `estimate_usage()`
+    counts the tokens instead, as stream_chunk_builder would.
+    """
+
+    def __init__(self, on_tool_call: Callable[[dict], Any] | None = None):
+        self._content: list[str] = []
+        # tool call index -> {"id": ..., "name": ..., "arguments": [fragments]}
+        self._tool_calls: dict[int, dict] = {}
+        self._on_tool_call = on_tool_call
+        self._n_complete = 0  # tool calls (in index order) known to be complete
+        self.first_token_time: float | None = None  # time.perf_counter() of first delta
+        self.usage = None
+        self.citations = None
+        self.finish_reason: str | None = None
+
+    def add(self, chunk) -> str:
+        """Accumulate a chunk, and return its text delta."""
+        usage = getattr(chunk, "usage", None)
+        if usage is not None:
+            self.usage = usage
+        citations = getattr(chunk, "citations", None)
+        if citations:
+            self.citations = citations
+        if not chunk.choices:
+            return ""
+        choice = chunk.choices[0]
+        if choice.finish_reason:
+            self.finish_reason = choice.finish_reason
+        delta = choice.delta
+        content = delta.content or ""
+        tool_calls = getattr(delta, "tool_calls", None) or []
+        if self.first_token_time is None and (content or tool_calls):
+            self.first_token_time = time.perf_counter()
+        if content:
+            self._content.append(content)
+        for tool_call in tool_calls:
+            self._add_tool_call(tool_call)
+        return content
+
+    def _add_tool_call(self, tool_call) -> None:
+        index = tool_call.index
+        if index is None:
+            # some providers don't number tool calls: a new id starts a new call
+            if tool_call.id or not self._tool_calls:
+                index = len(self._tool_calls)
+            else:
+                index = max(self._tool_calls)
+        if index not in self._tool_calls:
+            self._complete(len(self._tool_calls))  # a new tool call completes the others
+        slot = self._tool_calls.setdefault(
+            index, {"id": None, "name": "", "arguments": []}
+        )
+        if tool_call.id:
+            slot["id"] = tool_call.id
+        function = tool_call.function
+        if function is not None:
+            if function.name:
+                slot["name"] += function.name
+            if function.arguments:
+                slot["arguments"].append(function.arguments)
+
+    @staticmethod
+    def _format_tool_call(slot: dict) -> dict:
+        return {
+            "id": slot["id"],
+            "type": "function",
+            "function": {
+                "name": slot["name"],
+                "arguments": "".join(slot["arguments"]),
+            },
+        }
+
+    def _complete(self, n: int) -> None:
+        """Mark the first n tool calls as complete."""
+        if self._on_tool_call is not None:
+            slots = [slot for _, slot in sorted(self._tool_calls.items())]
+            for slot in slots[self._n_complete : n]:
+                self._on_tool_call(self._format_tool_call(slot))
+        self._n_complete = max(self._n_complete, n)
+
+    def finish(self) -> None:
+        """Signal the end of the stream, completing any remaining tool calls."""
+        self._complete(len(self._tool_calls))
+
+    def estimate_usage(
+        self, model: str, messages: list, prompt_tokens: int | None = None
+    ) -> None:
+        """If the provider reported no usage, estimate it with litellm's token counter, from
+        the request's messages (or their known prompt_tokens) and the response."""
+        if self.usage is not None:
+            return
+        if prompt_tokens is None:
+            prompt_tokens = litellm.token_counter(model=model, messages=messages)
+        text = self.content + "".join(
+            slot["name"] + "".join(slot["arguments"]) for slot in self._tool_calls.values()
+        )
+        completion_tokens = (
+            litellm.token_counter(model=model, text=text, count_response_tokens=True)
+            if text
+            else 0
+        )
+        self.usage = Usage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+
+    @property
+    def content(self) -> str:
+        return "".join(self._content)
+
+    def tool_calls(self) -> list[dict] | None:
+        """Tool calls assembled so far, in the OpenAI format."""
+        if not self._tool_calls:
+            return None
+        return [
+            self._format_tool_call(slot) for _, slot in sorted(self._tool_calls.items())
+        ]
+
+    def message(self) -> ChatCompletionMessage:
+        """The complete response message."""
+        return ChatCompletionMessage(
+            content=self.content if self._content or not self._tool_calls else None,
+            role="assistant",
+            tool_calls=self.tool_calls(),
+        )
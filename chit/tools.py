@@ -0,0 +1,147 @@
+"""JSON specs of the functions given to a Chat as tools.
+
+Generating a spec from a function's numpydoc docstring (litellm.utils.function_to_dict)
+means parsing its docstring and signature, which adds up when many chats are created with
+the same tools, e.g. when cloning chats or setting `chat.tools` repeatedly. Specs are
+therefore computed once per process, in a registry keyed by the function's identity (module
+and qualified name) and a fingerprint of its code, docstring and signature -- so redefining
+a function in a notebook, or reloading its module, produces a fresh spec.
+
+Besides plain functions, tools can be bound methods, functools.partial objects (the
+arguments the partial fixes are left out of the spec) and callable objects. Lambdas work
+too, provided they are given a `__name__` and numpydoc `__doc__`.
+"""
+
+import inspect
+import hashlib
+import weakref
+import functools
+from collections import OrderedDict
+from typing import Callable
+import litellm
+
+# (module, qualname, fingerprint, fixed arguments) -> spec
+_SPECS: dict[tuple, dict] = {}
+
+# ids of the tools of a list and of their specs -> (weak references to the tools, specs),
+# shared between chats with the same tools; weak, so as not to keep e.g. the objects of
+# bound methods alive
+_TOOLSETS: OrderedDict = OrderedDict()
+_TOOLSETS_MAX = 128
+
+
+def _described(
+    tool: Callable, name: str, doc: str | None, signature: inspect.Signature
+) -> Callable:
+    """The tool, wrapped with the name, docstring and signature litellm needs to describe
+    it, which it may lack itself (e.g. a functools.partial)."""
+
+    def described(*args, **kwargs):
+        return tool(*args, **kwargs)
+
+    described.__name__ = name
+    described.__doc__ = doc
+    described.__signature__ = signature
+    return described
+
+
+def _unwrap(tool: Callable) -> tuple[Callable, tuple]:
+    """The function that defines a tool's behaviour, and the arguments fixed by partials."""
+    fixed: tuple = ()
+    while isinstance(tool, functools.partial):
+        fixed += (len(tool.args), tuple(sorted(tool.keywords)))
+        tool = tool.func
+    if inspect.ismethod(tool):
+        tool = tool.__func__
+    elif not inspect.isfunction(tool) and not inspect.isbuiltin(tool):
+        tool = type(tool).__call__  # a callable object
+    return tool, fixed
+
+
+def _fingerprint(func: Callable) -> str:
+    """Hash of everything a function's spec is derived from."""
+    code = getattr(func, "__code__", None)
+    parts = [
+        func.__name__,
+        inspect.getdoc(func) or "",
+        repr(getattr(func, "__defaults__", None)),
+        repr(getattr(func, "__kwdefaults__", None)),
+        repr(getattr(func, "__annotations__", None)),
+    ]
+    if code is not None:
+        parts += [code.co_code.hex(), repr(code.co_consts), repr(code.co_varnames)]
+    return hashlib.sha1("\0".join(parts).encode()).hexdigest()
+
+
+def _key(tool: Callable) -> tuple:
+    func, fixed = _unwrap(tool)
+    return (
+        getattr(func, "__module__", None),
+        getattr(func, "__qualname__", None),
+        _fingerprint(func),
+        fixed,
+    )
+
+
+def _describe(tool: Callable) -> dict:
+    """litellm.utils.function_to_dict, extended to partials and callable objects."""
+    func, _ = _unwrap(tool)
+    name = getattr(tool, "__name__", None) or func.__name__
+    if name == "__call__":
+        name = type(tool).__name__
+    if name == "<lambda>":
+        raise ValueError(
+            "Lambdas need a name to be used as tools: set their __name__ (and a "
+            "numpydoc __doc__), or give them a json attribute"
+        )
+    if func is getattr(type(tool), "__call__", None):
+        # a callable object, documented by its __call__ or else its class
+        doc = func.__doc__ or type(tool).__doc__
+    else:
+        doc = inspect.getdoc(func)
+    return litellm.utils.function_to_dict(
+        _described(tool, name, doc, inspect.signature(tool))
+    )
+
+
+def tool_spec(tool: Callable) -> dict:
+    """The json spec of a tool: its `json` attribute if it has one, otherwise generated
+    from its numpydoc docstring (once per process, see module docstring)."""
+    spec = getattr(tool, "json", None)
+    if isinstance(spec, dict):
+        return spec
+    key = _key(tool)
+    spec = _SPECS.get(key)
+    if spec is None:
+        spec = {"type": "function", "function": _describe(tool)}
+        _SPECS[key] = spec
+    return spec
+
+
+def toolset(tools: list[Callable]) -> tuple[list[dict], dict[str, Callable]]:
+    """The list of json specs and the map from tool names to tools for a list of tools.
+    Chats with the same tools share these, so they must not be modified."""
+    key = tuple(map(id, tools))
+    cached = _TOOLSETS.get(key)
+    # the ids may have been reused by other tools since
+    if cached is not None and all(ref() is tool for ref, tool in zip(cached[0], tools)):
+        _TOOLSETS.move_to_end(key)
+        specs = cached[1]
+    else:
+        specs = [tool_spec(tool) for tool in tools]
+        try:
+            refs = [weakref.ref(tool) for tool in tools]
+        except TypeError:  # a tool that can't be weakly referenced
+            refs = None
+        if refs is not None:
+            _TOOLSETS[key] = (refs, specs)
+            if len(_TOOLSETS) > _TOOLSETS_MAX:
+                _TOOLSETS.popitem(last=False)
+    return specs, {spec["function"]["name"]: tool for tool, spec in zip(tools, specs)}
+
+
+def clear_registry() -> None:
+    """Forget all generated specs, e.g. after changing a tool (or its docstring) in place
+    rather than redefining it."""
+    _SPECS.clear()
+    _TOOLSETS.clear()
@@ -0,0 +1,177 @@
+"""Lazy, non-recursive traversals of a chat tree.
+
+Each function takes a Chat's `messages` dict and the id of the message to start from, and
+generates as it goes, keeping only the messages still to be visited (DFS) or the current
+frontier (BFS) -- never the visited part of the tree -- so that walks over trees of any
+size or depth run in memory proportional to what they yield, and hit no recursion limit.
+
+Children are visited in the order Chat.log() draws them: the heir (the next message on the
+parent's home branch) first, then the other branches in the order they were created.
+
+Filters are applied during the walk rather than to its results: `prune(message)` skips a
+message along with its whole subtree, so its descendants are never even looked at, and
+`where(message)` skips just the message. Predicates that only look at the tree structure
+(`id`, `parent_id`, `children`, `home_branch`) don't load the bodies of lazily cloned
+messages; ones that look at `message`, `usage` etc. load (and keep) them.
+"""
+
+from collections import deque
+from typing import TYPE_CHECKING, Callable, Iterator, Literal, Optional
+
+if TYPE_CHECKING:
+    from chit.chit import ChitMessage
+
+    Predicate = Callable[[ChitMessage], bool]
+
+
+def _children(message: "ChitMessage") -> Iterator[tuple[str, Optional[str]]]:
+    """(branch, child_id) pairs of a message, the heir first; child_id is None for a branch
+    whose tip is the message itself."""
+    home = message.home_branch
+    if home in message.children:
+        yield home, message.children[home]
+    for branch, child_id in message.children.items():
+        if branch != home:
+            yield branch, child_id
+
+
+def iter_edges(
+    messages: dict[str, "ChitMessage"],
+    start_id: str,
+    branch: str | None = None,
+    prune: Optional["Predicate"] = None,
+    max_depth: int | None = None,
+) -> Iterator[tuple[str, Optional[str], int]]:
+    """(branch, message_id, depth) for the start message and every branch pointer below it,
+    depth-first, including the pointers of branches that end at their parent (with
+    message_id None). This is what Chat.log() draws.
+
+    Arguments:
+        branch (str | None): branch to report the start message as reached by; defaults
+            to its home branch
+        prune (callable): messages (and their subtrees) to leave out
+        max_depth (int | None): don't go deeper than this many messages below the start
+    """
+    stack = [(branch or messages[start_id].home_branch, start_id, 0)]
+    while stack:
+        branch, msg_id, depth = stack.pop()
+        if msg_id is None:
+            yield branch, None, depth
+            continue
+        message = messages[msg_id]
+        if prune is not None and prune(message):
+            continue
+        yield branch, msg_id, depth
+        if max_depth is None or depth < max_depth:
+            children = list(_children(message))
+            stack.extend(
+                (child_branch, child_id, depth + 1)
+                for child_branch, child_id in reversed(children)
+            )
+
+
+def iter_subtree(
+    messages: dict[str, "ChitMessage"],
+    start_id: str,
+    order: Literal["dfs", "bfs"] = "dfs",
+    prune: Optional["Predicate"] = None,
+    max_depth: int | None = None,
+) -> Iterator[str]:
+    """Ids of the start message and its descendants, depth-first (pre-order) or breadth-first.
+
+    Arguments:
+        order (str): "dfs" or "bfs"
+        prune (callable): messages (and their subtrees) to leave out
+        max_depth (int | None): don't go deeper than this many messages below the start
+    """
+    if order == "dfs":
+        for _, msg_id, _ in iter_edges(messages, start_id, prune=prune, max_depth=max_depth):
+            if msg_id is not None:
+                yield msg_id
+        return
+    if order != "bfs":
+        raise ValueError(f"Invalid order {order}")
+    queue = deque([(start_id, 0)])
+    while queue:
+        msg_id, depth = queue.popleft()
+        message = messages[msg_id]
+        if prune is not None and prune(message):
+            continue
+        yield msg_id
+        if max_depth is None or depth < max_depth:
+            queue.extend(
+                (child_id, depth + 1)
+                for _, child_id in _children(message)
+                if child_id is not None
+            )
+
+
+def walk(
+    messages: dict[str, "ChitMessage"],
+    start_id: str,
+    order: Literal["dfs", "bfs"] = "dfs",
+    where: Optional["Predicate"] = None,
+    prune: Optional["Predicate"] = None,
+    max_depth: int | None = None,
+) -> Iterator["ChitMessage"]:
+    """The start message and its descendants, as in iter_subtree, that satisfy `where`."""
+    for msg_id in iter_subtree(messages, start_id, order, prune, max_depth):
+        message = messages[msg_id]
+        if where is None or where(message):
+            yield message
+
+
+def _is_leaf(
+    messages: dict[str, "ChitMessage"], message: "ChitMessage", prune: Optional["Predicate"]
+) -> bool:
+    return all(
+        child_id is None or (prune is not None and prune(messages[child_id]))
+        for child_id in message.children.values()
+    )
+
+
+def iter_leaves(
+    messages: dict[str, "ChitMessage"],
+    start_id: str,
+    prune: Optional["Predicate"] = None,
+) -> Iterator["ChitMessage"]:
+    """Messages below (or at) the start without children, depth-first. With `prune`, a
+    message whose children are all pruned counts as a leaf."""
+    for msg_id in iter_subtree(messages, start_id, prune=prune):
+        message = messages[msg_id]
+        if _is_leaf(messages, message, prune):
+            yield message
+
+
+def iter_paths(
+    messages: dict[str, "ChitMessage"],
+    start_id: str,
+    prune: Optional["Predicate"] = None,
+) -> Iterator[list[str]]:
+    """Paths from the start message to each leaf below it (see iter_leaves), as lists of ids.
+
+    Consecutive paths share their common prefix: the same list is yielded every time,
+    truncated and extended in place, so enumerating all paths costs time proportional to
+    the size of the tree rather than the total length of the paths. Copy a path (`list(path)`)
+    to keep it past the next iteration.
+    """
+    path: list[str] = []
+    for _, msg_id, depth in iter_edges(messages, start_id, prune=prune):
+        if msg_id is None:
+            continue
+        del path[depth:]
+        path.append(msg_id)
+        if _is_leaf(messages, messages[msg_id], prune):
+            yield path
+
+
+def ancestors(
+    messages: dict[str, "ChitMessage"], msg_id: str, include_self: bool = False
+) -> Iterator["ChitMessage"]:
+    """The parent, grandparent, ... of a message, up to the root."""
+    message = messages[msg_id]
+    if include_self:
+        yield message
+    while message.parent_id is not None:
+        message = messages[message.parent_id]
+        yield message
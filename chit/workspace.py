@@ -0,0 +1,368 @@
+"""A directory of chit remotes, managed as one collection of chats.
+
+A `Workspace` keeps a catalog of the chats in its directory -- titles, sizes, branch tips,
+last-modified times -- read from the remotes' indexes (see chit.storage) rather than by
+cloning them, and saved to the directory so that reopening a workspace only needs to stat
+the files that have changed. Chats are cloned when first accessed and kept in a least
+recently used cache bounded by their (estimated) size in memory; chats evicted from the
+cache, or still in it when the workspace is flushed, are pushed back to their remotes if
+they have changed.
+
+Listing and searching chats go through the catalog and the remotes on disk, without
+loading chats into the cache.
+"""
+
+import os
+import re
+import json
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Iterator, Optional, Pattern
+import chit.config
+from chit.chit import Chat
+from chit.storage import RemoteReader
+from chit.utils import wordcel
+
+CATALOG_FILE = ".chit_catalog.json"
+CATALOG_VERSION = 1
+
+# how far down master to look for the first user message, to title a chat by
+TITLE_SEARCH_DEPTH = 8
+TITLE_LENGTH = 80
+
+
+@dataclass
+class CatalogEntry:
+    name: str  # file name of the remote, within the workspace directory
+    title: str  # the gui title if set, else the start of the first user message
+    size: int  # bytes on disk
+    mtime: float
+    n_messages: int
+    model: str | None
+    current_branch: str
+    current_id: str
+    branch_tips: dict[str, str]
+    mtime_ns: int = 0  # to tell whether the file changed since it was cataloged
+
+
+def _text(content: str | list[dict] | None) -> str:
+    if content is None or isinstance(content, str):
+        return content or ""
+    return " ".join(item["text"] for item in content if item["type"] == "text")
+
+
+def _title(reader: RemoteReader) -> str:
+    """The gui title of a chat if it was set, else the start of its first user message."""
+    header = reader.header
+    display_title = (header.get("display_config") or {}).get("title")
+    if display_title and display_title != chit.config.DISPLAY_CONFIG["title"]:
+        return display_title
+    msg_id = header["root_id"]
+    for _ in range(TITLE_SEARCH_DEPTH):
+        if msg_id is None:
+            break
+        message = reader.message(msg_id)
+        if message["role"] == "user":
+            return " ".join(_text(message["content"]).split())[:TITLE_LENGTH]
+        msg_id = reader.structure[msg_id][0].get("master")
+    return display_title or ""
+
+
+def read_entry(path: str) -> CatalogEntry:
+    """Catalog entry of a remote."""
+    stat = os.stat(path)
+    with RemoteReader(path) as reader:
+        header = reader.header
+        return CatalogEntry(
+            name=os.path.basename(path),
+            title=_title(reader),
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            n_messages=len(reader.structure),
+            model=header.get("model"),
+            current_branch=header["current_branch"],
+            current_id=header["current_id"],
+            branch_tips=header["branch_tips"],
+            mtime_ns=stat.st_mtime_ns,
+        )
+
+
+class Workspace:
+    def __init__(self, directory: str, max_bytes: int | None = None, lazy: bool | None = None):
+        """
+        Open a directory of chit remotes (.json and .jsonl files) as a workspace.
+
+        Arguments:
+            directory (str): directory of the remotes; created if it doesn't exist
+            max_bytes (int | None): bound on the total size of the chats kept loaded, as
+                estimated by the size of their remotes. The least recently used chats are
+                evicted (pushed back, if changed) beyond this, though the chat last
+                accessed always stays loaded. Defaults to chit.config.WORKSPACE_MAX_BYTES
+            lazy (bool | None): passed on to Chat.clone when loading chats
+
+        Chats are accessed by file name, with or without the extension: `ws["notes"]`.
+        Work with chats through the workspace (`ws["notes"].commit(...)`) rather than
+        holding on to them, since a chat that has been evicted is no longer written back.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes or chit.config.WORKSPACE_MAX_BYTES
+        self.lazy = lazy
+        os.makedirs(directory, exist_ok=True)
+        self.catalog: dict[str, CatalogEntry] = {}
+        # loaded chats, least recently used first
+        self._chats: OrderedDict[str, Chat] = OrderedDict()
+        # each loaded chat's header as of when it was last read or written, to tell if
+        # e.g. it has been checked out elsewhere since
+        self._headers: dict[str, str] = {}
+        self._load_catalog()
+        self.refresh()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load_catalog(self) -> None:
+        try:
+            with open(self._path(CATALOG_FILE), "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != CATALOG_VERSION:
+            return
+        self.catalog = {e["name"]: CatalogEntry(**e) for e in data["entries"]}
+
+    def _save_catalog(self) -> None:
+        path = self._path(CATALOG_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(
+                {
+                    "version": CATALOG_VERSION,
+                    "entries": [asdict(e) for e in self.catalog.values()],
+                },
+                f,
+            )
+        os.replace(path + ".tmp", path)
+
+    def refresh(self) -> None:
+        """Bring the catalog up to date with the directory, re-reading the entries of the
+        remotes that were added or modified since they were cataloged."""
+        changed = False
+        seen = set()
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if (
+                    e.name.startswith(".")
+                    or not e.name.endswith((".json", ".jsonl"))
+                    or not e.is_file()
+                ):
+                    continue
+                seen.add(e.name)
+                stat = e.stat()
+                entry = self.catalog.get(e.name)
+                if (
+                    entry is not None
+                    and entry.size == stat.st_size
+                    and entry.mtime_ns == stat.st_mtime_ns
+                ):
+                    continue
+                try:
+                    self.catalog[e.name] = read_entry(e.path)
+                except (OSError, ValueError, KeyError, TypeError) as exc:
+                    wordcel(f"Skipping {e.path}, which is not a chit remote: {exc}")
+                    self.catalog.pop(e.name, None)
+                changed = True
+        for name in set(self.catalog) - seen:
+            del self.catalog[name]
+            changed = True
+        if changed:
+            self._save_catalog()
+
+    def _resolve(self, name: str) -> str:
+        """File name of a chat given its name with or without the extension."""
+        for candidate in (name, name + ".json", name + ".jsonl"):
+            if candidate in self.catalog:
+                return candidate
+        raise KeyError(f"No chat {name} in workspace {self.directory}")
+
+    def __contains__(self, name: str) -> bool:
+        try:
+            self._resolve(name)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.catalog)
+
+    def __len__(self) -> int:
+        return len(self.catalog)
+
+    def __getitem__(self, name: str) -> Chat:
+        name = self._resolve(name)
+        chat = self._chats.get(name)
+        if chat is not None:
+            self._chats.move_to_end(name)
+            return chat
+        chat = Chat.clone(self._path(name), lazy=self.lazy)
+        self._add(name, chat)
+        return chat
+
+    def _add(self, name: str, chat: Chat) -> None:
+        self._chats[name] = chat
+        self._headers[name] = json.dumps(chat._header_dict())
+        self._evict()
+
+    @property
+    def loaded(self) -> list[str]:
+        """Names of the chats currently loaded, least recently used first."""
+        return list(self._chats)
+
+    @property
+    def loaded_bytes(self) -> int:
+        """Estimated memory taken by the loaded chats."""
+        return sum(self.catalog[name].size for name in self._chats if name in self.catalog)
+
+    def _is_dirty(self, name: str, chat: Chat) -> bool:
+        return bool(chat._dirty) or json.dumps(chat._header_dict()) != self._headers[name]
+
+    def _write_back(self, name: str, chat: Chat) -> None:
+        chat.push()
+        self._headers[name] = json.dumps(chat._header_dict())
+        self.catalog[name] = read_entry(self._path(name))
+
+    def _evict(self) -> None:
+        written = False
+        while len(self._chats) > 1 and self.loaded_bytes > self.max_bytes:
+            name, chat = self._chats.popitem(last=False)
+            if self._is_dirty(name, chat):
+                self._write_back(name, chat)
+                written = True
+            del self._headers[name]
+        if written:
+            self._save_catalog()
+
+    def flush(self) -> None:
+        """Push back every loaded chat that changed since it was loaded or last pushed."""
+        written = False
+        for name, chat in self._chats.items():
+            if self._is_dirty(name, chat):
+                self._write_back(name, chat)
+                written = True
+        if written:
+            self._save_catalog()
+
+    def close(self) -> None:
+        """Flush and unload all chats."""
+        self.flush()
+        self._chats.clear()
+        self._headers.clear()
+
+    def __enter__(self) -> "Workspace":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def new(self, name: str, **kwargs) -> Chat:
+        """
+        Create a chat in the workspace, saved to `name` (.json unless it ends with .jsonl).
+        Keyword arguments are passed on to Chat.
+        """
+        if not name.endswith((".json", ".jsonl")):
+            name += ".json"
+        if name in self.catalog or os.path.exists(self._path(name)):
+            raise ValueError(f"Chat {name} already exists in workspace {self.directory}")
+        chat = Chat(remote=self._path(name), **kwargs)
+        chat.push()
+        self.catalog[name] = read_entry(self._path(name))
+        self._save_catalog()
+        self._add(name, chat)
+        return chat
+
+    def ls(
+        self,
+        pattern: str | Pattern | None = None,
+        sort: str = "mtime",
+        reverse: bool | None = None,
+    ) -> list[CatalogEntry]:
+        """
+        Catalog entries of the chats, without loading them.
+
+        Arguments:
+            pattern (str | Pattern | None): only list chats whose title or name matches
+                this regex (case-insensitive if a string)
+            sort (str): a CatalogEntry field to sort by, e.g. "mtime", "size", "name"
+            reverse (bool | None): sort in descending order; defaults to True for
+                "mtime", "size" and "n_messages" (most recent/largest first)
+        """
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern, re.IGNORECASE)
+        entries = [
+            e
+            for e in self.catalog.values()
+            if pattern is None or pattern.search(e.title) or pattern.search(e.name)
+        ]
+        if reverse is None:
+            reverse = sort in ("mtime", "size", "n_messages")
+        return sorted(entries, key=lambda e: getattr(e, sort), reverse=reverse)
+
+    def _iter_messages(self, name: str) -> Iterator[tuple[str, dict]]:
+        """(id, message) of every message of a chat: from memory if it is loaded, since
+        it may have changed, else straight from its remote without loading it."""
+        chat = self._chats.get(name)
+        if chat is not None:
+            for message in chat.walk():
+                m = message.message
+                yield message.id, m if isinstance(m, dict) else m.json()
+            return
+        with RemoteReader(self._path(name)) as reader:
+            for msg_id in reader.structure:
+                yield msg_id, reader.message(msg_id)
+
+    def search(
+        self,
+        pattern: str | Pattern,
+        *,
+        case_sensitive: bool = False,
+        regex: bool = False,
+        roles: Optional[list[str]] = None,
+        chats: Optional[list[str]] = None,
+        max_results: Optional[int] = None,
+    ) -> list[dict[str, Any]]:
+        """
+        Search the messages of all the chats in the workspace, most recently modified
+        chats first, without loading them into the cache.
+
+        Args:
+            pattern: String or compiled regex pattern to search for
+            case_sensitive: Whether to perform case-sensitive matching
+            regex: Whether to treat pattern as a regex (if string)
+            roles: List of roles to search in. None means all roles.
+            chats: Names of the chats to search. None means all chats.
+            max_results: Maximum number of results to return. None means return all matches.
+
+        Returns:
+            List of dicts with the "chat" (its name), "title", "id" and "message" (the
+            message dict) of each match
+        """
+        if isinstance(pattern, str) and not regex:
+            pattern = re.escape(pattern)
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern, 0 if case_sensitive else re.IGNORECASE)
+        names = None if chats is None else {self._resolve(name) for name in chats}
+        results = []
+        for entry in self.ls():
+            if names is not None and entry.name not in names:
+                continue
+            for msg_id, message in self._iter_messages(entry.name):
+                if roles is not None and message["role"] not in roles:
+                    continue
+                if pattern.search(_text(message.get("content"))):
+                    results.append(
+                        {"chat": entry.name, "title": entry.title, "id": msg_id, "message": message}
+                    )
+                    if max_results and len(results) >= max_results:
+                        return results
+        return results
+
+    def __repr__(self):
+        return f"Workspace({self.directory}, {len(self.catalog)} chats, {len(self._chats)} loaded)"
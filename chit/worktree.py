@@ -0,0 +1,71 @@
+"""Several independent checkouts of one chat, for working on its branches in parallel.
+
+A `Worktree` is a handle on a Chat with a checkout of its own (`current_id` and
+`current_branch`) and everything else -- the messages, branch tips, tools, remote -- shared
+with the chat and every other worktree of it. Committing through a worktree commits from
+its checkout and moves only its checkout; the new message is visible to all of them at
+once. Get one with `chat.worktree(...)`.
+
+Worktrees can be used from different threads. Changes to the shared tree (adding a message
+or a branch, rm, mv, push) are made under the chat's lock, `chat.lock`, which is held only
+for the change itself: the slow parts of a commit -- waiting on the provider, running tools
+-- run unlocked, so commits on different branches proceed in parallel. If another worktree
+commits on the same branch and from the same message in the meantime, the commit goes to a
+new branch, as it would if the branch had already been taken when it started (see
+Chat.commit).
+"""
+
+from typing import Any, Optional
+from chit.chit import Chat
+
+
+class Worktree(Chat):
+    # attributes of the worktree itself; all others are the chat's
+    _OWN = frozenset({"chat", "current_id", "current_branch"})
+
+    def __init__(
+        self,
+        chat: Chat,
+        message_id: Optional[str | int | list[str]] = None,
+        branch_name: Optional[str] = None,
+    ):
+        """
+        A new checkout of a chat, starting from the chat's current checkout, or from the
+        given message and/or branch (as taken by Chat.checkout).
+        """
+        object.__setattr__(self, "chat", chat)
+        with chat.lock:
+            self.current_id = chat.current_id
+            self.current_branch = chat.current_branch
+            chat._worktrees.add(self)
+        if message_id is not None or branch_name is not None:
+            self.checkout(message_id, branch_name)
+
+    def __getattr__(self, name: str) -> Any:
+        # only called for attributes the worktree doesn't have itself
+        return getattr(self.chat, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name in self._OWN:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.chat, name, value)
+
+    def _cursors(self) -> list[Chat]:
+        return self.chat._cursors()
+
+    def push(self) -> None:
+        """Push the chat (with the chat's own checkout, not this worktree's)."""
+        self.chat.push()
+
+    def worktree(
+        self,
+        message_id: Optional[str | int | list[str]] = None,
+        branch_name: Optional[str] = None,
+    ) -> "Worktree":
+        if message_id is None and branch_name is None:
+            message_id, branch_name = self.current_id, self.current_branch
+        return self.chat.worktree(message_id, branch_name)
+
+    def __repr__(self):
+        return f"Worktree({self.current_branch}@{self.current_id} of {self.chat!r})"